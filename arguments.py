@@ -7,6 +7,17 @@ import argparse
 #########################
 
 
+# the distinct, non-empty lines of a batch file, in order
+def batch_keys(file_name):
+    try:
+        with open(file_name, 'r') as fp:
+            keys = [line.strip() for line in fp]
+    except OSError as exc:
+        print("ERROR: cannot read batch file", file_name, ":", exc)
+        exit(-1)
+    return list(dict.fromkeys(key for key in keys if key))
+
+
 def parse():
     parser = argparse.ArgumentParser(
         prog='clingen-dosage-ai-tools',
@@ -22,8 +33,19 @@ def parse():
     # encoding options
     parser.add_argument('--template', action='store_true',
                         help="Generate template output column '<source-name>-template' if specified in config.yml.")
+    parser.add_argument('--template-jobs', action='store', dest='template_jobs', type=int, default=1,
+                        help="Number of worker processes used to render templates for large sources.")
     parser.add_argument('--onehot', action='store_true',
                         help="Generate one-hot encodings for columns that support it.")
+    parser.add_argument('--onehot-max', action='store', type=int, default=None,
+                        help="One-hot encode only the given number of most frequent values of a column; "
+                             "the other values are counted in an 'other' column.")
+    parser.add_argument('--sparse', action='store', nargs='?', const='npz', default=None, choices=['npz', 'mtx'],
+                        help="Keep one-hot columns sparse and write them per source as a scipy.sparse .npz "
+                             "(default) or Matrix Market .mtx matrix with a column list, instead of CSV columns.")
+    parser.add_argument('--ml-export', action='store_true', dest='ml_export',
+                        help="Also write the numeric encoded columns of each source as a float32 NumPy .npy matrix "
+                             "with a JSON manifest of its columns.")
     parser.add_argument('--categories', action='store_true',
                         help="Generate category encodings for columns that support it.")
     parser.add_argument('--expand', action='store_true',
@@ -37,9 +59,39 @@ def parse():
     parser.add_argument('--age', action='store_true',
                         help="Generate output column transforming date column to days since date value.")
 
+    parser.add_argument('--jobs', action='store', type=int, default=1,
+                        help="Number of sources to process at the same time in worker processes.")
+    parser.add_argument('--chunksize', action='store', type=int, default=None,
+                        help="Process each source in chunks of this many rows, writing output as each chunk is done.")
+
     # configuration management
     parser.add_argument('--force', action='store_true',
                         help="Download datafiles even if present and overwrite.")
+    parser.add_argument('--refresh', action='store_true',
+                        help="Download datafiles again only if they changed on the server since the last download.")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Compare each source to the release processed last, keep a history of the changes and "
+                             "only render the template of the rows added or changed since.")
+    parser.add_argument('--no-cache', action='store_false', dest='cache',
+                        help="Do not read or write the columnar (Parquet) cache of parsed source files.")
+    parser.add_argument('--build-index', action='store_true', dest='build_index',
+                        help="Build the join-key index of each source for fast --variant and --gene lookups, "
+                             "then exit.")
+    parser.add_argument('--fit-encoders', action='store_true',
+                        help="Fit the onehot and category encodings over all rows of each source, save them for "
+                             "later runs and exit.")
+    parser.add_argument('--build-kb', action='store', dest='build_kb', type=str, default=None,
+                        help="Process all sources (or --sources) into the given knowledge base file for --lookup "
+                             "requests, then exit.")
+    parser.add_argument('--lookup', action='store', type=str, default=None,
+                        help="Look up --variant / --gene (or a --variant-file / --gene-file batch) in the given "
+                             "knowledge base file built with --build-kb, without reading the sources.")
+    parser.add_argument('--serve', action='store', type=str, default=None,
+                        help="Keep the processed sources in memory and answer variant / gene lookups over HTTP on "
+                             "[host:]port or unix:<socket path> until stopped.")
+    parser.add_argument('--profile', action='store', nargs='?', const='profile.json', default=None,
+                        help="Measure the time, memory, rows and columns of each stage of each source, and write "
+                             "the report to the given JSON file (default profile.json) and as a table at exit.")
     parser.add_argument('--counts', action='store_true',
                         help="Print unique value counts for columns (helpful for deciding on mappings and categories).")
 
@@ -52,12 +104,26 @@ def parse():
                         type=lambda s: [str(item) for item in s.split(',')])  # validate against configured dictionaries
     parser.add_argument('--joined-output',  action='store', dest='output', type=str, default=None,
                         help='The desired output file name.')
+    parser.add_argument('--output-format', action='store', dest='output_format', default='csv',
+                        choices=['csv', 'csv.gz', 'parquet', 'feather'],
+                        help="Format of the per-source and joined output files: CSV (default), gzip compressed "
+                             "CSV, Parquet or Feather (Parquet and Feather need pyarrow).")
+    parser.add_argument('--join-engine', action='store', default='pandas', choices=['pandas', 'sqlite'],
+                        help="Join the sources in memory (pandas) or out of core in an SQLite database (sqlite).")
+    parser.add_argument('--join-budget', action='store', type=int, default=None,
+                        help="Stop before a join of the joined output would give more than this number of rows.")
     parser.add_argument('--variant',  action='store', type=str,
                         help='Filter to a specific variant (CV VariationID). Variable must be tagged in join-group.')
     parser.add_argument('--gene',  action='store', type=str,
                         help='Filter to a specific gene (symbol). Variable must be tagged in join-group.')
     parser.add_argument('--template-output', action='store', dest='text_output', type=str, default=None,
                         help="Generate text output file using template values to specified file.")
+    parser.add_argument('--variant-file', action='store', dest='variant_file', type=str, default=None,
+                        help='File of variants (CV VariationID), one per line, to process as one batch.')
+    parser.add_argument('--gene-file', action='store', dest='gene_file', type=str, default=None,
+                        help='File of genes (symbol), one per line, to process as one batch.')
+    parser.add_argument('--output-dir', action='store', dest='output_dir', type=str, default=None,
+                        help='Directory for the per-variant or per-gene output files of a batch.')
 
     args = parser.parse_args()
 
@@ -71,10 +137,71 @@ def parse():
     if args.text_output is not None and not args.template:
         args.template = True
 
-    # if joining, then need a list of sources in desired join order
-    if args.join and not args.sources:
+    # the knowledge base keeps the template text for lookups
+    if args.build_kb is not None:
+        args.template = True
+        if args.join:
+            print("ERROR: --build-kb cannot be combined with --joined-output.")
+            exit(-1)
+
+    # if joining, then need a list of sources in desired join order (a lookup joins the sources of the knowledge base)
+    if args.join and not args.sources and args.lookup is None:
         print("ERROR: must specify --sources with --joined-output. The sources list is the list of data files to join.")
         exit(-1)
 
+    # a batch filters on all the variants (or genes) in one pass, then writes output files for each of them
+    args.batch = None
+    args.batch_kind = None
+    if args.variant_file is not None and args.gene_file is not None:
+        print("ERROR: specify only one of --variant-file and --gene-file.")
+        exit(-1)
+    if args.variant_file is not None:
+        if args.variant:
+            print("ERROR: --variant cannot be combined with --variant-file.")
+            exit(-1)
+        args.batch_kind = 'variant'
+        args.batch = batch_keys(args.variant_file)
+        if not all(key.isdigit() for key in args.batch):
+            print("ERROR: --variant-file must list numeric ClinVar variation ids.")
+            exit(-1)
+        args.batch = [int(key) for key in args.batch]
+        args.variant = ','.join(str(key) for key in args.batch)
+    if args.gene_file is not None:
+        if args.gene:
+            print("ERROR: --gene cannot be combined with --gene-file.")
+            exit(-1)
+        args.batch_kind = 'gene'
+        args.batch = batch_keys(args.gene_file)
+        args.gene = ','.join(args.batch)
+    if args.batch is not None:
+        if len(args.batch) == 0:
+            print("ERROR: no variants or genes found in the batch file.")
+            exit(-1)
+        if args.output_dir is None:
+            print("ERROR: must specify --output-dir with --variant-file or --gene-file.")
+            exit(-1)
+        if args.build_kb is not None:
+            print("ERROR: --build-kb cannot be combined with --variant-file or --gene-file.")
+            exit(-1)
+
+    # the service keeps the template text for its queries
+    if args.serve is not None:
+        args.template = True
+        if args.join or args.batch is not None or args.build_kb is not None:
+            print("ERROR: --serve cannot be combined with --joined-output, --build-kb, --variant-file or --gene-file.")
+            exit(-1)
+        if not args.serve.startswith('unix:') and not args.serve.rpartition(':')[2].isdigit():
+            print("ERROR: --serve must be a [host:]port or unix:<socket path>.")
+            exit(-1)
+
+    # the release history covers whole sources
+    if args.incremental and (args.variant or args.gene):
+        print("ERROR: --incremental cannot be combined with --variant, --gene, --variant-file or --gene-file.")
+        exit(-1)
+
+    if args.lookup is not None and not (args.variant or args.gene):
+        print("ERROR: must specify --variant, --gene, --variant-file or --gene-file with --lookup.")
+        exit(-1)
+
 
     return args
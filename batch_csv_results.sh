@@ -16,22 +16,11 @@ mkdir -p "$OUTPUT_FOLDER"
 # Define log level
 LOGLEVEL="info"
 
-# Loop through each variant ID in the file
-while IFS= read -r VARIANT_ID; do
-    echo "Generating summary for variant ID: $VARIANT_ID"
-
-    # Run main.py in the current directory
-    python main.py --loglevel=$LOGLEVEL --template \
-        --sources="clinvar-submission-summary,clinvar-variant-summary,gencc-submissions,clingen-dosage,clingen-gene-disease,vrs" \
-        --joined-output="${VARIANT_ID}.csv" --variant=$VARIANT_ID
-
-    # Move the generated file to the output folder
-    if [ -f "${VARIANT_ID}.csv" ]; then
-        mv "${VARIANT_ID}.csv" "$OUTPUT_FOLDER/"
-    else
-        echo "Warning: File ${VARIANT_ID}.csv was not created!"
-    fi
-done < "$INPUT_FILE"
+# Generate the joined output of all variant IDs in one run (one file per variant ID, named variant_<id>.csv)
+echo "Generating summaries for variant IDs in: $INPUT_FILE"
+python main.py --loglevel=$LOGLEVEL --template \
+    --sources="clinvar-submission-summary,clinvar-variant-summary,gencc-submissions,clingen-dosage,clingen-gene-disease,vrs" \
+    --joined-output=joined.csv --variant-file="$INPUT_FILE" --output-dir="$OUTPUT_FOLDER"
 
 echo "Batch processing complete! Results stored in $OUTPUT_FOLDER"
 
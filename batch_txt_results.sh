@@ -21,15 +21,10 @@ fi
 # Ensure the output directory exists
 mkdir -p "$output_folder"
 
-# Read the input file line by line
-while IFS= read -r variant_id || [[ -n "$variant_id" ]]; do
-    if [[ -n "$variant_id" ]]; then  # Ensure the line is not empty
-        echo "Processing variant ID: $variant_id"
-        python main.py --loglevel=info --expand \
-            --sources="clinvar-submission-summary,clinvar-variant-summary,vrs,gencc-submissions,clingen-gene-disease,clingen-consensus-assertions-adult,clingen-consensus-assertions-pediatric,clingen-dosage,clingen-overall-scores-adult,clingen-overall-scores-pediatric" \
-            --template --template-output="${output_folder}/variant_${variant_id}.txt" \
-            --variant="$variant_id"
-    fi
-done < "$input_file"
+# Process all variant IDs in one run (one text file per variant ID, named variant_<id>.txt)
+echo "Processing variant IDs in: $input_file"
+python main.py --loglevel=info --expand \
+    --sources="clinvar-submission-summary,clinvar-variant-summary,vrs,gencc-submissions,clingen-gene-disease,clingen-consensus-assertions-adult,clingen-consensus-assertions-pediatric,clingen-dosage,clingen-overall-scores-adult,clingen-overall-scores-pediatric" \
+    --template --variant-file="$input_file" --output-dir="$output_folder"
 
 echo "Processing complete. Results are saved in the '$output_folder' directory."
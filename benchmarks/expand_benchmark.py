@@ -0,0 +1,95 @@
+# local modules
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import encode  # noqa: E402
+
+# other libraries
+import argparse  # noqa: E402
+import time  # noqa: E402
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+#########################
+#
+# EXPAND BENCHMARK
+#
+# Times --expand on a synthetic frame shaped like clinvar-variant-summary (a GeneSymbol column where some rows
+# list several genes), comparing the split+explode implementation with the previous row by row appends.
+# The row by row version is quadratic, so it is timed on a smaller frame and reported per row.
+#
+#   python benchmarks/expand_benchmark.py --rows=1000000 --baseline-rows=10000
+#
+#########################
+
+GENES = ['BRCA1', 'BRCA2', 'TP53', 'MYH7', 'LDLR', 'APOB', 'KISS1R', 'PCSK9', 'MLH1', 'MSH2']
+
+
+def synthetic(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    genes = np.array(GENES)[rng.integers(0, len(GENES), size=rows)].astype(object)
+    # about one row in ten lists two or three genes
+    multi = rng.random(rows) < 0.1
+    extra = np.array(GENES)[rng.integers(0, len(GENES), size=rows)]
+    genes[multi] = genes[multi] + ',' + extra[multi]
+    third = multi & (rng.random(rows) < 0.3)
+    genes[third] = genes[third] + ',' + extra[third]
+    return pd.DataFrame({
+        'VariationID': np.arange(rows),
+        'GeneSymbol': genes,
+        'ClinicalSignificance': rng.choice(['Benign', 'Pathogenic', 'Uncertain significance'], size=rows),
+    })
+
+
+# the previous implementation: copy and append a row for each value, keeping the original row
+def row_by_row(df, dic):
+    dic_filter_df = dic.loc[(dic.get('expand') == True)]
+    for i, r in dic_filter_df.iterrows():
+        col_name = r['column']
+        expandable_rows_df = df.loc[(df.get(col_name).str.contains(","))]
+        for exp_i, exp_r in expandable_rows_df.iterrows():
+            values = exp_r[col_name].split(",")
+            for v in values:
+                new_row = expandable_rows_df.loc[exp_i].copy()
+                new_row[col_name] = v
+                df.loc[len(df)] = new_row
+    return df
+
+
+def timed(function, *arguments):
+    start = time.perf_counter()
+    result = function(*arguments)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark --expand implementations.')
+    parser.add_argument('--rows', type=int, default=1000000, help='Rows for the split+explode implementation.')
+    parser.add_argument('--baseline-rows', type=int, default=10000, help='Rows for the row by row implementation.')
+    args = parser.parse_args()
+
+    dic = pd.DataFrame({'column': ['VariationID', 'GeneSymbol', 'ClinicalSignificance'],
+                        'expand': [False, True, False]})
+
+    df = synthetic(args.rows)
+    expanded, seconds = timed(encode.expand, df, dic, 'benchmark')
+    print("split+explode: {:,} rows -> {:,} rows in {:.2f}s ({:.2f} us/row)".format(
+        len(df), len(expanded), seconds, seconds / len(df) * 1e6))
+
+    baseline_df = synthetic(args.baseline_rows)
+    baseline, baseline_seconds = timed(row_by_row, baseline_df.copy(), dic)
+    print("row by row:    {:,} rows -> {:,} rows in {:.2f}s ({:.2f} us/row)".format(
+        len(baseline_df), len(baseline), baseline_seconds, baseline_seconds / len(baseline_df) * 1e6))
+
+    # same rows, apart from the comma separated originals the row by row version kept
+    check, check_seconds = timed(encode.expand, baseline_df, dic, 'benchmark')
+    kept = baseline.loc[~baseline['GeneSymbol'].str.contains(',')]
+    same = kept.sort_values(list(kept.columns)).reset_index(drop=True).equals(
+        check.sort_values(list(check.columns)).reset_index(drop=True))
+    print("split+explode on the same {:,} rows: {:.3f}s ({:.0f}x faster), same rows: {}".format(
+        len(baseline_df), check_seconds, baseline_seconds / check_seconds, same))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+# other libraries
+import argparse
+import datetime
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+#########################
+#
+# STARTUP BENCHMARK
+#
+# Times short runs of main.py (by default a filtered run of a single small source, as the batch jobs make) from
+# the start of the process to its exit, and lists the imports that take longest. With --record the timings are
+# appended to a JSON lines file, so startup can be tracked from one change to the next.
+#
+#   python benchmarks/startup_benchmark.py --runs=10 --record=startup.jsonl -- --sources=vrs --variant=12345
+#
+#########################
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_ARGUMENTS = ['--sources=vrs', '--variant=12345']
+IMPORT_PATTERN = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$')
+
+
+def run(arguments, importtime=False):
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['main.py'] + arguments
+    start = time.perf_counter()
+    completed = subprocess.run(command, cwd=REPO, capture_output=True, text=True)
+    seconds = time.perf_counter() - start
+    if completed.returncode != 0:
+        print(completed.stdout, completed.stderr, file=sys.stderr)
+        sys.exit("main.py failed with exit code {}".format(completed.returncode))
+    return seconds, completed.stderr
+
+
+# the modules imported by main.py and its local modules (the top two levels), by cumulative import time
+def slowest_imports(importtime_output, count):
+    imports = []
+    for line in importtime_output.splitlines():
+        match = IMPORT_PATTERN.match(line)
+        if match and len(match.group(3)) <= 3:
+            imports.append((int(match.group(2)) / 1e6, match.group(4).strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the startup of short main.py runs.')
+    parser.add_argument('--runs', type=int, default=5, help='Number of timed runs.')
+    parser.add_argument('--imports', type=int, default=10, help='Number of slowest imports to list.')
+    parser.add_argument('--record', type=str, default=None, help='JSON lines file to append the timings to.')
+    parser.add_argument('arguments', nargs='*', help='main.py arguments (after --).')
+    args = parser.parse_args()
+    arguments = args.arguments or DEFAULT_ARGUMENTS
+
+    # the first run compiles the modules and the source registry
+    run(arguments)
+    timings = [run(arguments)[0] for i in range(args.runs)]
+    print("main.py {}: median {:.2f}s, min {:.2f}s over {} runs".format(
+        ' '.join(arguments), statistics.median(timings), min(timings), args.runs))
+
+    seconds, output = run(arguments, importtime=True)
+    imports = slowest_imports(output, args.imports)
+    for import_seconds, module in imports:
+        print("  import {:<30} {:.3f}s".format(module, import_seconds))
+
+    if args.record is not None:
+        record = {'date': datetime.datetime.now().isoformat(timespec='seconds'), 'arguments': arguments,
+                  'runs': args.runs, 'median': round(statistics.median(timings), 3),
+                  'min': round(min(timings), 3), 'imports': {module: round(s, 3) for s, module in imports}}
+        with open(args.record, 'a') as fp:
+            fp.write(json.dumps(record) + '\n')
+        print("Recorded in", args.record)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+# local modules
+import helper
+
+# other libraries
+import json
+import os
+from os import access, R_OK
+from os.path import isfile
+import pandas as pd
+
+###############################
+#
+# COLUMNAR SOURCE CACHE
+#
+# Parsing the large tab-delimited sources (e.g. ClinVar variant_summary.txt) takes minutes on every run.
+# The parsed dataframe is saved as Parquet in a .cache directory inside the source directory, together
+# with a signature of the data file (size, modification time, published md5), the parse settings and
+# the dtype schema.
+# Later runs read the Parquet file instead and rebuild it only when the signature changes.
+#
+###############################
+
+CACHE_DIR = '.cache'
+CACHE_VERSION = 1
+# smaller row groups let filtered reads skip more of the file using the row group statistics
+ROW_GROUP_SIZE = 100000
+
+
+def cache_dir(sourcefile):
+    return str(os.path.join(sourcefile.get('path'), CACHE_DIR))
+
+
+def cache_file(sourcefile):
+    return str(os.path.join(cache_dir(sourcefile), sourcefile.get('name') + '.parquet'))
+
+
+def signature_file(sourcefile):
+    return str(os.path.join(cache_dir(sourcefile), sourcefile.get('name') + '.json'))
+
+
+# read the published md5 checksum for the source (downloaded alongside the data file), if any
+def published_md5(sourcefile):
+    md5_file = sourcefile.get('md5_file')
+    if not md5_file:
+        return None
+    md5_file_path = str(os.path.join(sourcefile.get('path'), md5_file))
+    if not (isfile(md5_file_path) and access(md5_file_path, R_OK)):
+        return None
+    with open(md5_file_path, 'r') as fp:
+        tokens = fp.read().split()
+    return tokens[0] if len(tokens) > 0 else None
+
+
+# describe the data file and the settings used to parse it; any difference invalidates the cache
+def signature(sourcefile, data_file, dtypes=None):
+    stat = os.stat(data_file)
+    return {
+        'version': CACHE_VERSION,
+        'file': os.path.basename(data_file),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'md5': published_md5(sourcefile),
+        'header_row': str(sourcefile.get('header_row')),
+        'skip_rows': str(sourcefile.get('skip_rows')),
+        'delimiter': str(sourcefile.get('delimiter')),
+        'quoting': str(sourcefile.get('quoting')),
+        'dtypes': {column: str(dtype) for column, dtype in (dtypes or {}).items()},
+    }
+
+
+def is_current(sourcefile, data_file, dtypes=None):
+    parquet_file = cache_file(sourcefile)
+    sig_file = signature_file(sourcefile)
+    if not (isfile(parquet_file) and isfile(sig_file)):
+        return False
+    try:
+        with open(sig_file, 'r') as fp:
+            cached_signature = json.load(fp)
+    except (OSError, ValueError):
+        return False
+    return cached_signature == signature(sourcefile, data_file, dtypes)
+
+
+# pyarrow filter expression for row filters (see reader.row_filters), with the values cast to the column type
+def filter_expression(parquet_file, filters):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    schema = pq.read_schema(parquet_file)
+    expression = None
+    for column, values, split in filters:
+        field = pc.field(column)
+        column_type = schema.field(column).type
+        if pa.types.is_dictionary(column_type):
+            column_type = column_type.value_type
+            field = field.cast(column_type)
+        if split:
+            condition = pc.match_substring_regex(field.cast(pa.string()), helper.list_pattern(values))
+        elif pa.types.is_string(column_type) or pa.types.is_large_string(column_type):
+            condition = field.isin([str(v) for v in values])
+        else:
+            condition = field.isin(values)
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+# read only the cached rows that match the row filters; Parquet row groups whose statistics rule out the values
+# are skipped without being decoded; returns None when the filters do not apply to the cached columns
+def read_filtered(parquet_file, filters, columns=None):
+    try:
+        return pd.read_parquet(parquet_file, columns=columns, filters=filter_expression(parquet_file, filters))
+    except ImportError:
+        raise
+    except Exception as exc:
+        helper.debug("Cannot filter cache", parquet_file, ":", exc)
+        return None
+
+
+# returns the cached dataframe, or None when there is no current cache for the data file
+def read(sourcefile, data_file, dtypes=None, columns=None, filters=None):
+    if not is_current(sourcefile, data_file, dtypes):
+        helper.debug("No current cache for", sourcefile.get('name'))
+        return None
+    parquet_file = cache_file(sourcefile)
+    try:
+        df = None
+        if filters:
+            df = read_filtered(parquet_file, filters, columns)
+        if df is None:
+            df = pd.read_parquet(parquet_file, columns=columns)
+    except ImportError as exc:
+        helper.warning("Cannot read source cache (pyarrow not installed):", exc)
+        return None
+    except Exception as exc:
+        helper.warning("Ignoring unreadable cache", parquet_file, ":", exc)
+        return None
+    helper.info("Read cached source", parquet_file, "(" + str(len(df)) + " rows)")
+    return df
+
+
+# Parquet columns must hold a single type; the python csv engine can leave object columns with a mix
+# of numbers and strings, so those are stored as strings (missing values are left missing)
+def arrow_safe(df):
+    for column in df.columns:
+        if df[column].dtype == object:
+            inferred = pd.api.types.infer_dtype(df[column], skipna=True)
+            if inferred not in ('string', 'empty'):
+                helper.debug("Caching mixed column", column, "(" + inferred + ") as strings")
+                df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+    return df
+
+
+def write(sourcefile, data_file, df, dtypes=None):
+    os.makedirs(cache_dir(sourcefile), exist_ok=True)
+    parquet_file = cache_file(sourcefile)
+    try:
+        arrow_safe(df.copy()).to_parquet(parquet_file, index=False, row_group_size=ROW_GROUP_SIZE)
+    except ImportError as exc:
+        helper.warning("Cannot cache source (pyarrow not installed):", exc)
+        return False
+    except Exception as exc:
+        helper.warning("Failed to cache", sourcefile.get('name'), ":", exc)
+        invalidate(sourcefile)
+        return False
+    with open(signature_file(sourcefile), 'w') as fp:
+        json.dump(signature(sourcefile, data_file, dtypes), fp, indent=2)
+    helper.info("Cached source", sourcefile.get('name'), "as", parquet_file)
+    return True
+
+
+# remove the cached dataframe of the source; the join-key and gzip checkpoint indexes in the same directory are kept,
+# as they find out themselves when the data file changed and are rebuilt on their next use
+def invalidate(sourcefile):
+    for file_name in [cache_file(sourcefile), signature_file(sourcefile)]:
+        if isfile(file_name):
+            helper.info("Removing cache", file_name)
+            os.remove(file_name)
+
+
+# iterate over the cached dataframe in batches of rows (only rows matching the row filters, if any),
+# or None when there is no current cache for the data file
+def iter_batches(sourcefile, data_file, dtypes=None, batch_size=100000, columns=None, filters=None):
+    if not is_current(sourcefile, data_file, dtypes):
+        helper.debug("No current cache for", sourcefile.get('name'))
+        return None
+    try:
+        import pyarrow.dataset as ds
+        import pyarrow.parquet as pq
+    except ImportError as exc:
+        helper.warning("Cannot read source cache (pyarrow not installed):", exc)
+        return None
+    parquet_file = cache_file(sourcefile)
+    helper.info("Reading cached source", parquet_file, "in batches of", batch_size, "rows")
+    if filters:
+        try:
+            expression = filter_expression(parquet_file, filters)
+            dataset = ds.dataset(parquet_file, format='parquet')
+            batches = dataset.to_batches(columns=columns, filter=expression, batch_size=batch_size)
+            return (batch.to_pandas() for batch in batches)
+        except Exception as exc:
+            helper.debug("Cannot filter cache", parquet_file, ":", exc)
+    return (batch.to_pandas() for batch in pq.ParquetFile(parquet_file).iter_batches(batch_size=batch_size,
+                                                                                        columns=columns))
@@ -0,0 +1,218 @@
+# local modules
+import cache
+import encode
+import helper
+import reader
+
+# other libraries
+import hashlib
+import json
+import os
+import time
+from os.path import isfile
+import numpy as np
+import pandas as pd
+
+###############################
+#
+# INCREMENTAL RELEASES
+#
+# ClinVar publishes a new release every month, in which only a small part of the rows change. With --incremental,
+# each source keeps the state of the last release it processed in a .delta directory next to its config.yml (which,
+# unlike the .cache directory, is kept when a new data file is downloaded):
+#  - the join key (the variation-id column, or else the first join-group column) and a hash of every data row, so
+#    a new release is compared to the last one and the variants (or other keys) added, changed and removed are
+#    recorded in the history of the source;
+#  - the template text of every row, by a hash of the values the template reads, so only the rows that are new or
+#    changed since the last release are rendered again and the text of rows removed from the release is dropped.
+# The other steps (expand, map, onehot, categories, days/age) are column operations over the whole source and are
+# run as usual, so the outputs are the same as those of a run without --incremental.
+# The history keeps, for every release, the counts of the changes and a small Parquet file of the keys that changed.
+#
+###############################
+
+DELTA_DIR = '.delta'
+DELTA_VERSION = 1
+
+
+def delta_dir(sourcefile):
+    return str(os.path.join(sourcefile.get('path'), DELTA_DIR))
+
+
+def state_file(sourcefile):
+    return str(os.path.join(delta_dir(sourcefile), sourcefile.get('name') + '.json'))
+
+
+def rows_file(sourcefile):
+    return str(os.path.join(delta_dir(sourcefile), sourcefile.get('name') + '.rows.parquet'))
+
+
+def text_file(sourcefile):
+    return str(os.path.join(delta_dir(sourcefile), sourcefile.get('name') + '.text.parquet'))
+
+
+def changes_file(sourcefile, number):
+    return str(os.path.join(delta_dir(sourcefile), sourcefile.get('name') + '.release-' + str(number) + '.parquet'))
+
+
+def load_state(sourcefile):
+    if not isfile(state_file(sourcefile)):
+        return None
+    try:
+        with open(state_file(sourcefile), 'r') as fp:
+            state = json.load(fp)
+    except (OSError, ValueError):
+        return None
+    return state if state.get('version') == DELTA_VERSION else None
+
+
+# the file column holding the join key of the rows: the variation-id column, or else the first join-group column
+def key_column(sourcefile, dic):
+    groups = {r['column']: r['join-group'] for i, r in dic.loc[dic['join-group'].notnull()].iterrows()}
+    columns = [c for c in reader.header(sourcefile) if reader.dictionary_column(sourcefile, c) in groups]
+    for column in columns:
+        if groups[reader.dictionary_column(sourcefile, column)] == 'variation-id':
+            return column
+    return columns[0] if len(columns) > 0 else None
+
+
+# which release the data file is: its published md5 checksum, or else its size and modification time
+def release_id(sourcefile):
+    signature = cache.signature(sourcefile, reader.data_file(sourcefile))
+    if signature['md5'] is not None:
+        return signature['md5']
+    return str(signature['size']) + '-' + str(signature['mtime_ns'])
+
+
+# identifies the template and the columns it reads; the saved text is only used for the same template
+def template_id(sourcefile, columns):
+    text = sourcefile['template'] + '\n' + '\n'.join(columns)
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+# hash of the values of each row
+def row_hashes(df):
+    return pd.util.hash_pandas_object(df, index=False).to_numpy(dtype=np.uint64)
+
+
+# start the incremental processing of a source, with the template text saved for the last release
+def start(sourcefile, dic):
+    if not reader.pyarrow_available():
+        helper.warning("Cannot process", sourcefile['name'], "incrementally (pyarrow not installed)")
+        return None
+    state = load_state(sourcefile)
+    text = pd.Series(dtype=object)
+    if state is not None and isfile(text_file(sourcefile)):
+        saved = pd.read_parquet(text_file(sourcefile))
+        text = pd.Series(saved['text'].to_numpy(dtype=object), index=saved['hash'].to_numpy(dtype=np.uint64))
+    helper.debug("Saved template text of", len(text), "rows for", sourcefile['name'])
+    return {'sourcefile': sourcefile, 'state': state, 'key': key_column(sourcefile, dic), 'columns': None,
+            'keys': [], 'hashes': [], 'text': text, 'template': None, 'used': [], 'rendered': 0, 'reused': 0}
+
+
+# add the rows read from the data file (the whole source, or one chunk of it) to the release
+def add_rows(release, df):
+    if release['columns'] is None:
+        release['columns'] = df.columns.tolist()
+    hashes = row_hashes(df)
+    release['hashes'].append(hashes)
+    if release['key'] is not None and release['key'] in df.columns:
+        release['keys'].append(df[release['key']].astype(str).where(df[release['key']].notna(), None).to_numpy())
+    else:
+        # without a join key each row is its own key
+        release['keys'].append(hashes.astype(str))
+
+
+# apply the template as encode.template does, rendering only the rows whose template values have no saved text
+def template(release, df, sourcefile, jobs=1):
+    template_column_name = "{}-template".format(sourcefile['name'])
+    if len(df) == 0:
+        df[template_column_name] = pd.Series(dtype=str)
+        return df
+    template_text = sourcefile['template']
+    columns = encode.template_columns(template_text, df.columns)
+    if release['template'] is None:
+        release['template'] = template_id(sourcefile, columns)
+        state = release['state']
+        if state is not None and state.get('template') != release['template']:
+            helper.info("Template of", sourcefile['name'], "changed; rendering all rows")
+            release['text'] = pd.Series(dtype=object)
+
+    hashes = row_hashes(df[columns])
+    saved = release['text']
+    found = pd.Index(saved.index).get_indexer(hashes) if len(saved) > 0 else np.full(len(hashes), -1)
+    text = np.empty(len(df), dtype=object)
+    text[found >= 0] = saved.to_numpy()[found[found >= 0]]
+
+    missing = np.flatnonzero(found < 0)
+    if len(missing) > 0:
+        # rows with the same template values are rendered once
+        unique_hashes, first, inverse = np.unique(hashes[missing], return_index=True, return_inverse=True)
+        records = df[columns].iloc[missing[first]].to_dict('records')
+        rendered = np.array(encode.render_records(template_text, records, jobs), dtype=object)
+        text[missing] = rendered[inverse.reshape(-1)]
+        rendered_text = pd.Series(rendered, index=unique_hashes)
+        release['text'] = pd.concat([saved, rendered_text]) if len(saved) > 0 else rendered_text
+    release['rendered'] = release['rendered'] + len(missing)
+    release['reused'] = release['reused'] + len(df) - len(missing)
+    release['used'].append(hashes)
+    df[template_column_name] = pd.Series(text, index=df.index, dtype=object)
+    return df
+
+
+# the keys added, changed and removed since the last release, from the (key, row hash) pairs of both releases
+def changes(previous, current):
+    pair_counts = [rows.value_counts(dropna=False).rename('count').reset_index() for rows in (previous, current)]
+    pairs = pair_counts[0].merge(pair_counts[1], how='outer', on=['key', 'hash', 'count'], indicator=True)
+    keys = pd.Index(pairs.loc[pairs['_merge'] != 'both', 'key'].unique())
+    in_previous = keys.isin(previous['key'])
+    in_current = keys.isin(current['key'])
+    change = np.where(in_previous & in_current, 'changed', np.where(in_current, 'added', 'removed'))
+    return pd.DataFrame({'key': keys.to_numpy(dtype=object), 'change': change}).sort_values(by='key', ignore_index=True)
+
+
+# compare the release to the last one, record it in the history and keep the template text of its rows
+def finish(release):
+    sourcefile = release['sourcefile']
+    sourcename = sourcefile['name']
+    state = release['state']
+    if len(release['hashes']) == 0:
+        return
+    current = pd.DataFrame({'key': np.concatenate(release['keys']), 'hash': np.concatenate(release['hashes'])})
+    os.makedirs(delta_dir(sourcefile), exist_ok=True)
+
+    release_ids = [r['release'] for r in state['releases']] if state is not None else []
+    entry = {'release': release_id(sourcefile), 'file': os.path.basename(reader.data_file(sourcefile)),
+             'processed': time.strftime('%Y-%m-%dT%H:%M:%S'), 'rows': len(current)}
+    if state is None or not isfile(rows_file(sourcefile)):
+        helper.info("First release of", sourcename, "for incremental processing:", len(current), "rows")
+        state = {'version': DELTA_VERSION, 'releases': []}
+    elif state.get('key') != release['key'] or state.get('columns') != release['columns']:
+        helper.info("Columns of", sourcename, "differ from the last release; not comparing the releases")
+    elif entry['release'] not in release_ids:
+        found = changes(pd.read_parquet(rows_file(sourcefile)), current)
+        counts = found['change'].value_counts()
+        for change in ['added', 'changed', 'removed']:
+            entry[change] = int(counts.get(change, 0))
+        entry['changes'] = os.path.basename(changes_file(sourcefile, len(state['releases'])))
+        found.to_parquet(changes_file(sourcefile, len(state['releases'])), index=False)
+        helper.info("Release of", sourcename, "has", entry['added'], "added,", entry['changed'], "changed and",
+                    entry['removed'], "removed", release['key'] or 'rows', "since the last release")
+    if entry['release'] not in release_ids:
+        state['releases'].append(entry)
+    current.to_parquet(rows_file(sourcefile), index=False)
+
+    if release['template'] is not None:
+        # only the text of the rows in this release
+        used = np.unique(np.concatenate(release['used']))
+        text = release['text']
+        text = text.loc[~text.index.duplicated()].reindex(used)
+        pd.DataFrame({'hash': used, 'text': text.to_numpy(dtype=object)}).to_parquet(text_file(sourcefile),
+                                                                                  index=False)
+        helper.info("Rendered the template of", release['rendered'], "rows of", sourcename, "and reused",
+                    release['reused'])
+        state['template'] = release['template']
+    state['key'] = release['key']
+    state['columns'] = release['columns']
+    with open(state_file(sourcefile), 'w') as fp:
+        json.dump(state, fp, indent=2)
@@ -1,7 +1,12 @@
 # local modules
+import cache
 import helper
+import profiling
 
 # other libraries
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
 from os import access, R_OK
 from os.path import isfile
 
@@ -12,19 +17,62 @@ from os.path import isfile
 #########################
 
 
-def all_files(source_files_df, force):
-    download_count = 0
-    for i, s in source_files_df.iterrows():
-        if download(s, force):
-            download_count = download_count + 1
+# sources downloaded at the same time
+DOWNLOAD_THREADS = 4
+# fetch metadata of the last download, kept next to the config.yml of the source
+FETCH_FILE = 'fetch.json'
 
-    if download_count > 0:
-        helper.info("Downloading complete;", download_count, "files.")
+
+def fetch_file(source):
+    return str(os.path.join(source.get('path'), FETCH_FILE))
+
+
+def read_fetch_metadata(source):
+    if not isfile(fetch_file(source)):
+        return None
+    try:
+        with open(fetch_file(source), 'r') as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+def write_fetch_metadata(source, metadata):
+    with open(fetch_file(source), 'w') as fp:
+        json.dump(metadata, fp, indent=2)
+
+
+# request headers that make the server answer 304 Not Modified when the file did not change since the last download
+def conditions(metadata):
+    headers = {}
+    if metadata.get('etag'):
+        headers['If-None-Match'] = metadata['etag']
+    if metadata.get('last_modified'):
+        headers['If-Modified-Since'] = metadata['last_modified']
+    return headers
+
+
+# returns the names of the sources with a new data file
+def all_files(source_files_df, force, refresh=False):
+    # settings missing from a config.yml are NaN in the data frame
+    sources = [s.dropna() for i, s in source_files_df.iterrows()]
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_THREADS) as executor:
+        downloaded = list(executor.map(lambda s: profiling.run(s.get('name'), 'download', download, s, force, refresh),
+                                       sources))
+    changed = [s.get('name') for s, d in zip(sources, downloaded) if d]
+
+    if len(changed) > 0:
+        helper.info("Downloading complete;", len(changed), "files:", changed)
+    elif refresh:
+        helper.info("All files up to date. No files to download.")
     else:
         helper.info("All files present. No files to download.")
+    return changed
 
 
-def download(source, force):
+# With refresh, an existing data file is downloaded again only when it changed on the server: a new published md5
+# checksum, or else a conditional request on the ETag / Last-Modified of the last download.
+def download(source, force, refresh=False):
     # TODO: use os path join instead
 
     name = source.get('name')
@@ -36,12 +84,15 @@ def download(source, force):
         helper.debug("datafile specified for ", name, "as", file_path)
 
     # if not forced, let's check if the file already exists to see if we need to download or not
+    refreshing = False
     if not force:
         if len(file_path) > 0:
             if isfile(file_path) and access(file_path, R_OK):
                 helper.debug("Found existing readable file", file_path)
-                # False indicates we did not download file
-                return False
+                if not refresh:
+                    # False indicates we did not download file
+                    return False
+                refreshing = True
         else:
             helper.critical("No datafile specified for", name, "!")
             exit(-1)
@@ -56,18 +107,45 @@ def download(source, force):
     md5_file_path = ''
     if md5_file:
         md5_file_path = source_path + '/' + md5_file
-    md5_hash_downloaded = ''
     md5_url = source.get('md5_url')
     url = source.get('url')
+    gzip_flag = source.get('gzip')
+    if gzip_flag and file == download_file:  # for gzip datafile and download file should be different
+        helper.error("gzip option requires differing data/download file names for", name)
+
+    request_conditions = None
+    md5_hash_approved = None
+    if refreshing and url:
+        metadata = read_fetch_metadata(source)
+        if metadata is None or metadata.get('url') != url:
+            helper.info("No fetch metadata for", name, "; downloading", file)
+        elif md5_url and md5_file:
+            # the published checksum is a few bytes instead of the whole file
+            helper.download(md5_url, md5_file_path)
+            with open(md5_file_path, 'r') as fp:
+                md5_hash_approved = fp.read().split(' ')
+            if metadata.get('md5') in md5_hash_approved:
+                helper.info("Published md5 checksum unchanged for", name, "; not downloading", file)
+                return False
+        else:
+            request_conditions = conditions(metadata)
+    elif refreshing:
+        helper.debug("No url to refresh", file_path, "from")
+        return False
+
     if url:
+        # the download is checksummed and (if configured) unzipped to "file" while it is written
         if download_file:
-            helper.download(url, download_file_path)
+            gunzip_path = file_path if gzip_flag and file != download_file else None
+            fetched = helper.download(url, download_file_path, gunzip_path, request_conditions)
             file_we_downloaded = download_file_path
         else:
-            helper.download(url, file_path)
+            fetched = helper.download(url, file_path, conditions=request_conditions)
             file_we_downloaded = file_path
-        if md5_url:  # if we are doing md5 check then get the hash for the downloaded file
-            md5_hash_downloaded = helper.get_md5(file_we_downloaded)
+        if fetched is None:
+            helper.info("Not modified on the server;", file_path)
+            return False
+        md5_hash_downloaded = fetched['md5']
         helper.info("Completed data file download;", file_we_downloaded)
     else:
         print("ERROR: no url for", file, "for source", source.get('name'), "; Please acquire manually.")
@@ -75,8 +153,10 @@ def download(source, force):
         exit(-1)
     if md5_url:
         if md5_file:
-            r = helper.download(md5_url, md5_file_path)
-            md5_hash_approved = r.text.split(' ')
+            if md5_hash_approved is None:
+                helper.download(md5_url, md5_file_path)
+                with open(md5_file_path, 'r') as fp:
+                    md5_hash_approved = fp.read().split(' ')
             if md5_hash_downloaded in md5_hash_approved:
                 helper.info("MD5 check successful")
             else:
@@ -87,15 +167,11 @@ def download(source, force):
         else:
             helper.warning("WARNING: md5_url specified but not md5_file. Not performing checksum.")
 
-    # unzip the downloaded file if configured to do so and output as "file"
-    gzip_flag = source.get('gzip')
-    if gzip_flag:
-        if file != download_file:  # for gzip datafile and download file should be different
-            helper.gunzip_file(download_file_path, file_path)
-        else:
-            helper.error("gzip option requires differing data/download file names for", name)
-
     # else:  if there's a future case where we need to change the name of a non-gzip downloaded file afterward
 
+    write_fetch_metadata(source, fetched)
+    # the cache of the previous data file (the join-key index is rebuilt when next used)
+    cache.invalidate(source)
+
     # return True since we downloaded a file
     return True
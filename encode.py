@@ -0,0 +1,385 @@
+# local modules
+import helper
+import profiling
+
+# other libraries
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+####################
+#
+# CONSTANTS
+#
+####################
+ONE_HOT_PREFIX = 'hot'
+CATEGORIES_PREFIX = 'cat'
+ORDINAL_PREFIX = 'ord'
+RANK_PREFIX = 'rnk'
+DAYS_PREFIX = 'days'
+AGE_PREFIX = 'age'
+# one-hot column of the values beyond the --onehot-max most frequent ones
+ONE_HOT_OTHER = 'other'
+
+
+#########################
+#
+# ENCODING STEPS
+#
+# Each step takes the source dataframe (the whole source, or one chunk of it when streaming) and
+# returns the transformed dataframe.
+#
+#########################
+
+
+def strip_hash(df):
+    helper.debug("Strip hashes and spaces from column labels")
+    columns = {}
+    for column in df:
+        new_column = column.strip(' #')
+        if new_column != column:
+            helper.debug("Stripping", column, "to", new_column)
+            columns[column] = new_column
+        else:
+            helper.debug("Not stripping colum", column)
+    return df.rename(columns, axis='columns')
+
+
+# replace each row holding a comma separated list in an expand column with one row per value; with more than one
+# expand column, a row gets one row per combination of values
+def expand(df, dic, sourcename):
+    dic_filter_df = dic.loc[(dic.get('expand') == True)]
+    if len(dic_filter_df) > 0:
+        helper.debug("Found", len(dic_filter_df), "columns to expand.")
+        helper.debug("expand columns for", sourcename, "length", len(df))
+        # the row order is kept by sorting on the index, so it must follow the rows (e.g. not a filtered index)
+        df = df.reset_index(drop=True)
+        for i, r in dic_filter_df.iterrows():
+            col_name = r['column']
+            if not (pd.api.types.is_object_dtype(df[col_name]) or pd.api.types.is_string_dtype(df[col_name])):
+                helper.debug("not expanding non-text column", col_name)
+                continue
+            helper.debug("expanding column", col_name)
+            # only split the rows that hold a list, then put the new rows back in place of the originals
+            multiple = df[col_name].str.contains(',', regex=False, na=False).to_numpy(dtype=bool)
+            if not multiple.any():
+                continue
+            multiple_df = df.loc[multiple]
+            expanded_df = multiple_df.assign(**{col_name: multiple_df[col_name].str.split(',')}).explode(col_name)
+            df = pd.concat([df.loc[~multiple], expanded_df]).sort_index(kind='stable')
+        df = df.reset_index(drop=True)
+        helper.debug("new length", len(df))
+    return df
+
+
+def filter_genes(df, dic, gene, sourcename):
+    # TODO: what if no gene-id column is selected in --gene?
+    dic_filter_df = dic.loc[(dic['join-group'] == 'gene-symbol')]
+    if len(dic_filter_df) > 0:
+        helper.debug("filter columns with gene-symbol join group and value", gene,
+                     "for", sourcename, "length", len(df))
+        for i, r in dic_filter_df.iterrows():
+            col_name = r['column']
+            genes = gene.split(',')
+            helper.debug("filtering column", col_name, " in ", genes)
+            df = df.loc[(df[col_name].isin(genes))]
+        helper.debug("new length", len(df))
+    return df
+
+
+def filter_variants(df, dic, variant, sourcename):
+    # TODO: what if no variation-id column is selected in --columns?
+    dic_filter_df = dic.loc[(dic['join-group'] == 'variation-id')]
+    if len(dic_filter_df) > 0:
+        helper.debug("filter columns with variation-id join group and value", variant,
+                     "for", sourcename, "length", len(df))
+        for i, r in dic_filter_df.iterrows():
+            col_name = r['column']
+            variants = map(int, variant.split(','))
+            helper.debug("filtering column", col_name, " = ", variant, variants)
+            df = df.loc[df[col_name].isin(variants)]
+        helper.debug("new length", len(df))
+    return df
+
+
+# Compile the mapping.csv rows into lookup tables, once per source: for each column the map-values of each map-name,
+# indexed by the column value as text.
+def compile_mapping(map_config_df):
+    mapping = {}
+    if len(map_config_df) == 0:
+        return mapping
+    map_config_df = map_config_df.loc[map_config_df['map-name'].notna()]
+    for column_name, map_col_df in map_config_df.groupby('column', sort=False):
+        tables = {}
+        for m, map_name_df in map_col_df.groupby('map-name', sort=False):
+            keys = map_name_df['value'].astype(str)
+            if keys.duplicated().any():
+                helper.warning("Duplicate values in mapping", m, "for", column_name, ":",
+                               list(keys[keys.duplicated()].unique()), "; using the first")
+            table = pd.Series(map_name_df['map-value'].to_numpy(), index=pd.Index(keys.to_numpy()))
+            tables[m] = table.loc[~keys.duplicated().to_numpy()]
+        mapping[column_name] = tables
+    return mapping
+
+
+def map_column(df, column_name, mapping):
+    # get mapping subset for this column, if any (dictionary column name == mapping column name)
+    tables = mapping.get(column_name)
+
+    helper.debug("Map config for column:", column_name)
+    helper.debug(tables)
+
+    if tables is None:
+        return df
+
+    # look up the distinct values of the column once, then take the map-values of each map-name for all rows
+    df[column_name] = df[column_name].astype(str)
+    codes, uniques = pd.factorize(df[column_name])
+    mapped = {}
+    for m, table in tables.items():
+        if m in df.columns:
+            # an existing column is kept
+            helper.debug("Not mapping", column_name, "to existing column", m)
+            continue
+        positions = table.index.get_indexer(uniques)
+        missing = uniques[positions < 0]
+        if len(missing) > 0:
+            helper.warning(len(missing), "value(s) of", column_name, "not in mapping", m, "(left empty):",
+                           list(missing[:10]))
+        mapped[m] = table.array.take(positions[codes], allow_fill=True)
+    if len(mapped) == 0:
+        return df
+    return pd.concat([df.reset_index(drop=True), pd.DataFrame(mapped)], axis=1)
+
+
+# mapping converts the column values to text, which also changes what gets encoded
+def mapped_as_text(r, mapping, args):
+    return args.map and r['map'] is True and r['column'] in mapping
+
+
+# the sorted distinct values of a column and whether it has missing values, as fitted by LabelEncoder;
+# with a --onehot-max limit, also the most frequent values that get their own one-hot column
+def vocabulary(values, has_na, counts=None, limit=None):
+    vocab = {'values': sorted(values), 'na': bool(has_na)}
+    if limit is not None and counts is not None:
+        vocab['top'] = top_values(counts, limit)
+    return vocab
+
+
+# the limit most frequent values (ties in value order) of a {value: count} dictionary
+def top_values(counts, limit):
+    order = sorted(counts.items(), key=lambda item: (-item[1], str(item[0])))
+    return [value for value, count in order[:limit]]
+
+
+def onehot_prefix(column_name):
+    return column_name + '_' + ONE_HOT_PREFIX + '_'
+
+
+# with --onehot-max, values other than the most frequent ones are counted in a single "other" column
+def onehot_values(df, column_name, vocab=None, limit=None):
+    one_hot_values = df[column_name]
+    if vocab is not None:
+        # encode against a fixed vocabulary so every chunk produces the same columns
+        if 'top' in vocab:
+            return capped_values(one_hot_values, vocab['top'], len(vocab['values']) > len(vocab['top']))
+        return pd.Categorical(one_hot_values, categories=vocab['values'])
+    if isinstance(one_hot_values.dtype, pd.CategoricalDtype):
+        # only encode the values present after filtering
+        one_hot_values = one_hot_values.cat.remove_unused_categories()
+    if limit is not None:
+        counts = one_hot_values.value_counts()
+        counts = counts.loc[counts > 0]
+        if len(counts) > limit:
+            return capped_values(one_hot_values, top_values(counts.to_dict(), limit), True)
+    return one_hot_values
+
+
+def capped_values(values, top, other):
+    categories = sorted(top) + ([ONE_HOT_OTHER] if other else [])
+    if other:
+        values = values.astype(object).where(values.isin(top) | values.isna(), ONE_HOT_OTHER)
+    return pd.Categorical(values, categories=categories)
+
+
+# one-hot columns as a sparse matrix built from the category codes, instead of one dense column per value
+def sparse_onehot(one_hot_values, oh_prefix, index):
+    from scipy import sparse
+    categorical = pd.Categorical(one_hot_values)
+    codes = categorical.codes
+    rows = np.flatnonzero(codes >= 0)
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.uint8), (rows, codes[rows])),
+                               shape=(len(codes), len(categorical.categories)))
+    columns = [oh_prefix + '_' + str(value) for value in categorical.categories]
+    return pd.DataFrame.sparse.from_spmatrix(matrix, index=index, columns=columns)
+
+
+def onehot(df, column_name, vocab=None, limit=None, sparse_output=False):
+    helper.debug("One-hot encoding", column_name, "as", ONE_HOT_PREFIX + column_name)
+    oh_prefix = onehot_prefix(column_name)
+    one_hot_values = onehot_values(df, column_name, vocab, limit)
+    if sparse_output:
+        one_hot_encoded = sparse_onehot(one_hot_values, oh_prefix, df.index)
+    else:
+        if not isinstance(one_hot_values, pd.Series):
+            one_hot_values = pd.Series(one_hot_values, index=df.index)
+        one_hot_encoded = pd.get_dummies(one_hot_values, prefix=oh_prefix)
+    return pd.concat([df, one_hot_encoded], axis=1)
+
+
+def categories(df, column_name, sourcename, vocab=None):
+    encoded_column_name = CATEGORIES_PREFIX + '_' + column_name
+    helper.debug("Category encoding", column_name, "as", encoded_column_name, "in", sourcename)
+    helper.debug("Existing values to be encoded:", df)
+    if vocab is None:
+        # sklearn takes seconds to import, so only when label encoding without saved encoders
+        from sklearn.preprocessing import LabelEncoder
+        encoder = LabelEncoder()
+        df[encoded_column_name] = encoder.fit_transform(df[column_name])
+    else:
+        # same codes as LabelEncoder: position in the sorted values, with missing values last
+        codes = pd.Categorical(df[column_name], categories=vocab['values']).codes.astype('int64')
+        if vocab['na']:
+            codes = np.where(df[column_name].isna(), len(vocab['values']), codes)
+        df[encoded_column_name] = codes
+
+    # TODO: do we then normalize or scale the values afterwards, is that a separate option?
+    return df
+
+
+def dates(df, column_name, date_format, args):
+    helper.debug("Age/Days: Column=", column_name, " format=", date_format)
+    if not (args.age or args.days):
+        return df
+    # parse the column once for both encodings
+    parsed = helper.parse_dates(df[column_name], date_format)
+    sentinels = helper.date_sentinels(df[column_name])
+    if args.age:
+        age_column = AGE_PREFIX + '_' + column_name
+        df[age_column] = helper.dates_to_age(parsed, sentinels)
+    if args.days:
+        days_column = DAYS_PREFIX + '_' + column_name
+        df[days_column] = helper.dates_to_days(parsed, sentinels)
+    return df
+
+
+# create augmented columns for onehot, mapping, continuous, scaling, categories, rank
+def encode(df, dic, mapping, sourcename, args, vocabularies=None):
+    if vocabularies is None:
+        vocabularies = {}
+    helper.debug("Processing onehot, mapping, etc. for", sourcename, "df=", df)
+    # time spent in each kind of encoding, for --profile
+    timings = {}
+
+    # loop through each column and process any configured options
+    for i, r in dic.iterrows():
+
+        column_name = r['column']
+
+        #
+        # mappings
+        #
+        if args.map and r['map'] is True:
+            df = profiling.timed(timings, 'map', map_column, df, column_name, mapping)
+
+        #
+        # onehot encoding
+        #
+        if args.onehot and r['onehot'] is True:
+            df = profiling.timed(timings, 'onehot', onehot, df, column_name, vocabularies.get(column_name),
+                                 args.onehot_max, args.sparse is not None)
+
+        #
+        # categories/label encoding
+        #
+        if args.categories and r['category'] is True:
+            df = profiling.timed(timings, 'categories', categories, df, column_name, sourcename,
+                                 vocabularies.get(column_name))
+
+        # date time encodings (age, days)
+        if not pd.isna(r['format']):
+            df = profiling.timed(timings, 'days/age', dates, df, column_name, r['format'], args)
+
+        # column-level NaN value replacement
+        if not pd.isna(r['na-value']) and r['na-value'] is not None and column_name in df.columns:
+            helper.debug("Apply na-value", r['na-value'], "to", column_name)
+            helper.fillna(df, r['na-value'], [column_name])
+
+        # Strategies: variable deletion, mean/median imputation, most common value, ???
+        # continuous
+        #  z-score?
+        #   (https://www.analyticsvidhya.com/blog/2015/11/8-ways-deal-continuous-variables-predictive-modeling/)
+        #  log transformation
+        #   (https://www.freecodecamp.org/news/feature-engineering-and-feature-selection-for-beginners/)
+        # min-max Normalization
+        #   (https://www.freecodecamp.org/news/feature-engineering-and-feature-selection-for-beginners/)
+        # standardization
+        #   (https://www.freecodecamp.org/news/feature-engineering-and-feature-selection-for-beginners/)
+
+        # scaling
+
+    # if specified, fill any remaining N/A values that weren't filled in at the field level
+    if args.na_value is not None:
+        helper.fillna(df, args.na_value)
+
+    profiling.add_timings(sourcename, timings, df)
+    return df
+
+
+# template columns are read as dict['column'] or dict.column; any other use of dict needs every column
+TEMPLATE_FIELD_PATTERN = re.compile(r"""\bdict(?:\.([A-Za-z_][A-Za-z_0-9]*)|\[\s*(['"])(.*?)\2\s*\])""")
+TEMPLATE_DICT_PATTERN = re.compile(r"\bdict\b")
+# rows rendered per worker task, and the fewest rows worth starting a process pool for
+TEMPLATE_BATCH_ROWS = 2000
+TEMPLATE_PARALLEL_ROWS = 10000
+
+
+# columns of the dataframe used by the template, so only those are copied into the per-row dicts
+def template_columns(template_text, columns):
+    fields = TEMPLATE_FIELD_PATTERN.findall(template_text)
+    if len(fields) != len(TEMPLATE_DICT_PATTERN.findall(template_text)):
+        return list(columns)
+    names = {attribute or key for attribute, quote, key in fields}
+    return [column for column in columns if column in names]
+
+
+# render the template for each record (a dict per row); the template is compiled once per process
+def render(template_text, records):
+    genshi_template = helper.get_genshi_template(template_text)
+    return [str(genshi_template.generate(dict=record)).strip() for record in records]
+
+
+# render across a pool of forked worker processes, keeping the row order
+def render_parallel(template_text, records, jobs):
+    batches = [records[start:start + TEMPLATE_BATCH_ROWS] for start in range(0, len(records), TEMPLATE_BATCH_ROWS)]
+    context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context) as executor:
+        rendered = executor.map(render, [template_text] * len(batches), batches)
+        return [text for batch in rendered for text in batch]
+
+
+# render the records, across a pool of jobs worker processes when there are enough of them
+def render_records(template_text, records, jobs=1):
+    # workers are forked, as main.py is a script that cannot be re-imported by spawned workers
+    if jobs > 1 and len(records) >= TEMPLATE_PARALLEL_ROWS and 'fork' in multiprocessing.get_all_start_methods():
+        helper.debug("Rendering", len(records), "rows with", jobs, "workers")
+        return render_parallel(template_text, records, jobs)
+    return render(template_text, records)
+
+
+def template(df, sourcefile, jobs=1):
+    sourcefile_name = sourcefile['name']
+    template_column_name = "{}-template".format(sourcefile_name)
+    helper.debug("Applying template to", sourcefile_name, "as", template_column_name)
+    if len(df) > 0:
+        template_text = sourcefile['template']
+        columns = template_columns(template_text, df.columns)
+        rendered = render_records(template_text, df[columns].to_dict('records'), jobs)
+        df[template_column_name] = pd.Series(rendered, index=df.index, dtype=object)
+    else:
+        df[template_column_name] = pd.Series(dtype=str)
+    helper.debug("df after template:")
+    helper.debug(df)
+    return df
@@ -0,0 +1,86 @@
+# local modules
+import cache
+import encode
+import helper
+import reader
+
+# other libraries
+import json
+import os
+from os.path import isfile
+import numpy as np
+
+###############################
+#
+# PERSISTED ENCODERS
+#
+# The one-hot vocabularies and category (label) codes of a source are fitted once over all rows of the source
+# with --fit-encoders and saved in encoders.json next to the config.yml of the source. Later runs encode with
+# the saved vocabularies instead of fitting on the rows left after filtering, so --variant / --gene, chunked
+# and batch runs give the same one-hot columns and category codes as a run over the whole source.
+# The encoders are fitted again automatically when the data file changes; runs with other encoding settings
+# (--expand, --map, --onehot-max, dictionary) do not use them.
+#
+###############################
+
+ENCODERS_VERSION = 1
+ENCODERS_FILE = 'encoders.json'
+
+
+def encoders_file(sourcefile):
+    return str(os.path.join(sourcefile.get('path'), ENCODERS_FILE))
+
+
+def exists(sourcefile):
+    return isfile(encoders_file(sourcefile))
+
+
+# the settings that change the fitted values of the encoded columns
+def settings(sourcefile, dic, mapping, args):
+    encoded = dic.loc[(dic['onehot'] == True) | (dic['category'] == True)]
+    return {
+        'version': ENCODERS_VERSION,
+        'columns': sorted(encoded['column']),
+        'expand': sorted(dic.loc[(dic['expand'] == True), 'column']) if args.expand else [],
+        'text': sorted(r['column'] for i, r in encoded.iterrows() if encode.mapped_as_text(r, mapping, args)),
+        'onehot_max': args.onehot_max,
+    }
+
+
+def data_signature(sourcefile):
+    return cache.signature(sourcefile, reader.data_file(sourcefile))
+
+
+def load(sourcefile):
+    try:
+        with open(encoders_file(sourcefile), 'r') as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+# the saved vocabularies of the columns (None when they were fitted with other settings), and whether the data
+# file changed since they were fitted
+def read(sourcefile, run_settings):
+    saved = load(sourcefile)
+    if saved is None:
+        helper.warning("Cannot read saved encoders", encoders_file(sourcefile))
+        return None, False
+    if saved.get('settings') != run_settings:
+        helper.warning("Saved encoders for", sourcefile.get('name'), "were fitted with other settings; not using them")
+        return None, False
+    return saved['vocabularies'], saved.get('signature') != data_signature(sourcefile)
+
+
+def json_value(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def write(sourcefile, run_settings, vocabularies):
+    with open(encoders_file(sourcefile), 'w') as fp:
+        json.dump({'settings': run_settings, 'signature': data_signature(sourcefile), 'vocabularies': vocabularies},
+                  fp, indent=2, default=json_value)
+    helper.info("Saved encoders of", len(vocabularies), "columns for", sourcefile.get('name'), "as",
+                encoders_file(sourcefile))
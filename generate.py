@@ -1,5 +1,6 @@
 # local modules
 import helper
+import reader
 
 # other libraries
 import os
@@ -21,6 +22,7 @@ config_yml = """--- # Source file description
   url: # put download url here (e.g. https://ftp.ncbi.nlm.nih.gov/pub/clinvar/tab_delimited/variant_summary.txt.gz)
   download_file: # put name of download file here if different from final file name (e.g. for gz first) (optional)
   file: data.tsv # put name of download file here (if gzip then put the final unzipped name here)
+  # a file ending in .gz (e.g. variant_summary.txt.gz) is read compressed, without gzip
   gzip: 0 # 0 = no gzip, 1 = use gunzip to transform download_file to file
   header_row: 0 # the row number in file that contains the column headers starting at row zero for first line
   skip_rows: None # comma separated list of rows to skip starting at 0 before the header (header 0 after skipped rows)
@@ -35,18 +37,21 @@ config_yml = """--- # Source file description
 
 def config(sources_path):
     cnt = 0
-    for root, dirs, files in os.walk(sources_path):
-        for d in dirs:
-            yml = str(os.path.join(sources_path, d, 'config.yml'))
+    # only the source directories themselves, not what is inside them
+    for d in next(os.walk(sources_path))[1]:
+        # skip hidden directories
+        if d.startswith('.'):
+            continue
+        yml = str(os.path.join(sources_path, d, 'config.yml'))
 
-            if isfile(yml) and access(yml, R_OK):
-                helper.debug("Found existing config.yml", yml)
-            else:
-                cnt = cnt + 1
-                helper.debug("Created missing configuration ", yml, "; Please edit and re-run.")
-                print("Created missing configuration ", yml, "; Please edit and re-run.")
-                with open(yml, 'w') as file:
-                    file.write(config_yml)
+        if isfile(yml) and access(yml, R_OK):
+            helper.debug("Found existing config.yml", yml)
+        else:
+            cnt = cnt + 1
+            helper.debug("Created missing configuration ", yml, "; Please edit and re-run.")
+            print("Created missing configuration ", yml, "; Please edit and re-run.")
+            with open(yml, 'w') as file:
+                file.write(config_yml)
     if cnt == 0:
         helper.info("All data sources have a config.yml")
         print("All data sources have a config.yml")
@@ -58,15 +63,7 @@ def config(sources_path):
 def dictionary(srcfile):
     # TODO: analyze column data and set category, onehot, continuous, days, age, based on data types and frequency
     print("Creating dictionary template")
-    data_file = str(os.path.join(srcfile.get('path'), srcfile.get('file')))
-    separator_type = helper.get_separator(srcfile.get('delimiter'))
-    df_data_loc = pd.read_csv(data_file,
-                              header=srcfile.get('header_row'), sep=separator_type,
-                              skiprows=helper.skip_array(srcfile.get('skip_rows')), engine='python',
-                              quoting=srcfile.get('quoting'),
-                              nrows=0,
-                              on_bad_lines='warn')
-    cols = df_data_loc.columns.tolist()
+    cols = reader.header(srcfile)
     # create dataframe with appropriate columns
     df_dic = pd.DataFrame(columns=['column', 'comment', 'join-group', 'onehot', 'category',
                                    'continuous', 'format', 'map', 'days', 'age', 'expand', 'na-value'])
@@ -0,0 +1,85 @@
+# local modules
+import cache
+import helper
+
+# other libraries
+import gzip
+import os
+from os.path import isfile
+
+###############################
+#
+# COMPRESSED DATA FILES
+#
+# A source whose file ends in .gz (e.g. ClinVar variant_summary.txt.gz) is read as it was downloaded, decompressing
+# it as a stream, instead of keeping an uncompressed copy next to it.
+# For the join-key index (see keyindex.py) the lines of the data file are found by their offsets in the
+# uncompressed data. To seek to them, a checkpoint index of the gzip stream is kept with the join-key index: an
+# access point every CHECKPOINT_SPACING bytes of uncompressed data, holding the decompressor state at that point
+# (as in zlib's zran example), so a lookup decompresses from the access point before each line instead of from the
+# start of the file. The checkpoint index needs the indexed_gzip package; without it, lookups decompress the file
+# up to the last line they read.
+#
+###############################
+
+GZIP_SUFFIX = '.gz'
+CHECKPOINT_SPACING = 4 * 1024 * 1024
+
+
+def compressed(file_name):
+    return file_name.endswith(GZIP_SUFFIX)
+
+
+def indexed_gzip_available():
+    try:
+        import indexed_gzip  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def checkpoint_file(sourcefile):
+    return str(os.path.join(cache.cache_dir(sourcefile), sourcefile.get('name') + '.gzidx'))
+
+
+# open the data file to read its (uncompressed) data from the start
+def open_data(file_name):
+    if compressed(file_name):
+        return gzip.open(file_name, 'rb')
+    return open(file_name, 'rb')
+
+
+# open the data file to seek to offsets of its uncompressed data, using the checkpoint index when there is one
+def open_seekable(sourcefile, file_name):
+    if not compressed(file_name):
+        return open(file_name, 'rb')
+    if not indexed_gzip_available():
+        helper.debug("indexed_gzip not installed; decompressing", file_name, "to seek")
+        # seeking forward decompresses up to the offset
+        return gzip.open(file_name, 'rb')
+    import indexed_gzip
+
+    index_file = checkpoint_file(sourcefile)
+    if isfile(index_file):
+        return indexed_gzip.IndexedGzipFile(file_name, index_file=index_file)
+    # access points are added while seeking
+    return indexed_gzip.IndexedGzipFile(file_name, spacing=CHECKPOINT_SPACING)
+
+
+# build the checkpoint index of a compressed data file; returns False when it cannot be built
+def build(sourcefile, file_name):
+    if not compressed(file_name):
+        return False
+    if not indexed_gzip_available():
+        helper.warning("indexed_gzip not installed; lookups in", file_name,
+                       "decompress the file from the start up to the rows they read")
+        return False
+    import indexed_gzip
+
+    helper.info("Building gzip checkpoint index for", file_name)
+    os.makedirs(cache.cache_dir(sourcefile), exist_ok=True)
+    with indexed_gzip.IndexedGzipFile(file_name, spacing=CHECKPOINT_SPACING) as fp:
+        fp.build_full_index()
+        fp.export_index(checkpoint_file(sourcefile))
+    helper.debug("Saved gzip checkpoint index as", checkpoint_file(sourcefile))
+    return True
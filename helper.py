@@ -1,13 +1,20 @@
 import gzip
 import hashlib
+import os
+from os.path import isfile
 import shutil
 from datetime import datetime, timezone
-import dateparser
+from functools import lru_cache
 import pytz
-import requests
 import logging
+import re
 import sys
-from genshi.template import NewTextTemplate
+import zlib
+import numpy as np
+import pandas as pd
+
+# dateparser, genshi and requests are imported by the functions that use them, as importing them takes longer than
+# a short filtered run
 
 ####################
 #
@@ -29,24 +36,30 @@ def log_setup(loglevel):
     )
 
 
+# only format the message (e.g. a whole dataframe) when the level is enabled
+def log(log_type, arguments, sep=' '):
+    if logging.getLogger().isEnabledFor(getattr(logging, log_type.upper())):
+        getattr(logging, log_type)(sep.join(str(a) for a in arguments))
+
+
 def debug(*arguments, log_type='debug', sep=' '):
-    getattr(logging, log_type)(sep.join(str(a) for a in arguments))
+    log(log_type, arguments, sep)
 
 
 def info(*arguments, log_type='info', sep=' '):
-    getattr(logging, log_type)(sep.join(str(a) for a in arguments))
+    log(log_type, arguments, sep)
 
 
 def warning(*arguments, log_type='warning', sep=' '):
-    getattr(logging, log_type)(sep.join(str(a) for a in arguments))
+    log(log_type, arguments, sep)
 
 
 def error(*arguments, log_type='error', sep=' '):
-    getattr(logging, log_type)(sep.join(str(a) for a in arguments))
+    log(log_type, arguments, sep)
 
 
 def critical(*arguments, log_type='critical', sep=' '):
-    getattr(logging, log_type)(sep.join(str(a) for a in arguments))
+    log(log_type, arguments, sep)
 
 
 def str_to_datetime(date_str, date_format):
@@ -55,6 +68,7 @@ def str_to_datetime(date_str, date_format):
         return datetime.strptime(str(date_str), date_format).replace(tzinfo=pytz.UTC)
     # then try dateparser generic handling
     except (ValueError, TypeError):
+        import dateparser
         return dateparser.parse(str(date_str)).replace(tzinfo=pytz.UTC)
 
 
@@ -84,6 +98,50 @@ def get_age(date_str, date_format):
     return date_to_age(dt)
 
 
+# parse text with dateparser, for dates that do not match the configured format (memoized, as the same few
+# unmatched values tend to repeat down a column)
+@lru_cache(maxsize=None)
+def parse_date_text(date_str):
+    import dateparser
+    return dateparser.parse(date_str).replace(tzinfo=pytz.UTC)
+
+
+# parse a column of dates once: every distinct value is parsed with pd.to_datetime using the configured format,
+# and only the distinct values that do not match the format go to dateparser; the "-" / "NA" sentinels are left
+# as NaT (see date_sentinels); returns UTC wall times as naive datetimes, like str_to_datetime
+def parse_dates(values, date_format):
+    text = values.astype(str)
+    sentinels = date_sentinels(values)
+    unique_text = pd.unique(text[~sentinels])
+    parsed = pd.to_datetime(pd.Series(unique_text, dtype=object), format=date_format, errors='coerce')
+    if isinstance(parsed.dtype, pd.DatetimeTZDtype):
+        parsed = parsed.dt.tz_localize(None)
+    elif parsed.dtype == object:
+        # mixed UTC offsets, which str_to_datetime replaces with UTC
+        parsed = pd.to_datetime(parsed.map(lambda dt: dt if pd.isna(dt) else dt.replace(tzinfo=None)))
+    residual = parsed.isna().to_numpy()
+    if residual.any():
+        parsed[residual] = [parse_date_text(date_str).replace(tzinfo=None) for date_str in unique_text[residual]]
+    lookup = pd.Series(parsed.to_numpy(), index=unique_text)
+    return pd.Series(lookup.reindex(text.to_numpy()).to_numpy(), index=values.index)
+
+
+def date_sentinels(values):
+    return values.isin(["-", "NA"]).to_numpy(dtype=bool)
+
+
+# days since 1/1/1970 for parsed dates (see parse_dates), -1 for sentinels
+def dates_to_days(parsed, sentinels):
+    days = (parsed - epoch.replace(tzinfo=None)) // pd.Timedelta(days=1)
+    return np.where(sentinels, -1, days.fillna(-1).to_numpy(dtype=np.int64))
+
+
+# days until today for parsed dates (see parse_dates), -1 for sentinels
+def dates_to_age(parsed, sentinels):
+    age = (today.replace(tzinfo=None) - parsed) // pd.Timedelta(days=1)
+    return np.where(sentinels, -1, age.fillna(-1).to_numpy(dtype=np.int64))
+
+
 def apply_template(template, record):
     # template is the string from the config.yml
     # record is the record array for one line of the source
@@ -95,8 +153,10 @@ def apply_template(template, record):
     return output
 
 
-# Acquire a Genshi Text Template object for our template pattern
+# Acquire a Genshi Text Template object for our template pattern (compiled once per template text)
+@lru_cache(maxsize=None)
 def get_genshi_template(template_text):
+    from genshi.template import NewTextTemplate
     return NewTextTemplate(template_text)
 
 
@@ -105,10 +165,21 @@ def apply_genshi_template(template, record):
     # template is the string from the config.yml
     # record is the record array for one line of the source
     output = str(template.generate(dict=record)).strip()
-    debug("Template output:",output)
+    debug("Template output:", output)
     return output
 
 
+# fill missing values in place; categorical columns need the fill value added as a category first
+def fillna(df, value, columns=None):
+    if columns is None:
+        columns = df.columns
+    for column in columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype) and value not in df[column].cat.categories:
+            df[column] = df[column].cat.add_categories([value])
+    df.fillna({column: value for column in columns}, inplace=True)
+    return df
+
+
 def skip_array(skip_text):
     if type(skip_text) is str:
         return eval('['+skip_text+']')
@@ -117,6 +188,11 @@ def skip_array(skip_text):
     return eval('['+skip_text.astype(str)+']')
 
 
+# regular expression matching any of the values as an item of a comma separated list
+def list_pattern(values):
+    return '(?:^|,)(?:' + '|'.join(re.escape(str(v)) for v in values) + ')(?:,|$)'
+
+
 def get_separator(delimiter):
     if delimiter == 'tab':
         return '\t'
@@ -126,13 +202,123 @@ def get_separator(delimiter):
         return None
 
 
-def download(download_url, filepath):
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_POOL_SIZE = 8
+DOWNLOAD_TIMEOUT = 60
+
+
+# one pooled session shared by all downloads (and download threads), so connections to a server are reused
+@lru_cache(maxsize=None)
+def http_session():
+    import requests
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=DOWNLOAD_POOL_SIZE, pool_maxsize=DOWNLOAD_POOL_SIZE)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# gzip decompression of a stream of chunks, also of files made of several gzip members
+class Gunzip:
+    def __init__(self):
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, chunk):
+        data = self.decompressor.decompress(chunk)
+        while self.decompressor.eof and len(self.decompressor.unused_data) > 0:
+            unused_data = self.decompressor.unused_data
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            data = data + self.decompressor.decompress(unused_data)
+        return data
+
+    def flush(self):
+        if not self.decompressor.eof:
+            raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+        return self.decompressor.flush()
+
+
+# Download the url to filepath in chunks, computing the md5 checksum of the downloaded bytes on the way and
+# decompressing them to gunzip_path (if given) in the same pass. The download is written to filepath.part first;
+# a part left by an interrupted download is resumed with an HTTP Range request when the server still has the
+# same file. With conditions (If-None-Match / If-Modified-Since request headers) nothing is downloaded when the
+# file did not change on the server. Returns the fetch metadata of the downloaded file (md5 hex digest, ETag,
+# Last-Modified, length), or None when the file did not change.
+def download(download_url, filepath, gunzip_path=None, conditions=None):
+    part_path = filepath + '.part'
+    validator_path = part_path + '.validator'
+    file_hash = hashlib.md5()
+    gunzip = Gunzip() if gunzip_path is not None else None
+    headers = dict(conditions) if conditions else {}
+    resume_from = 0
+    if isfile(part_path) and isfile(validator_path):
+        resume_from = os.path.getsize(part_path)
+        with open(validator_path, 'r') as fp:
+            validator = fp.read()
+        if resume_from > 0 and len(validator) > 0:
+            # the server sends the whole file instead of the rest when it changed since the part was written
+            headers.update({'Range': 'bytes=' + str(resume_from) + '-', 'If-Range': validator})
+
     info("Downloading", download_url, "as", filepath)
-    response = requests.get(download_url)
-    response.raise_for_status()
-    open(filepath, 'wb').write(response.content)
+    with http_session().get(download_url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+        if response.status_code == 416:
+            # nothing left to download for the part, or the part is not valid for the file; start over
+            response.close()
+            remove_file(part_path)
+            remove_file(validator_path)
+            return download(download_url, filepath, gunzip_path, conditions)
+        if response.status_code == 304:
+            info("Not modified since the last download:", download_url)
+            return None
+        response.raise_for_status()
+
+        resumed = response.status_code == 206 and 'Range' in headers
+        if resumed:
+            info("Resuming download of", filepath, "after", resume_from, "bytes")
+        else:
+            with open(validator_path, 'w') as fp:
+                fp.write(response.headers.get('ETag', response.headers.get('Last-Modified', '')))
+
+        with open(part_path, 'ab' if resumed else 'wb') as out:
+            unzip_out = open(gunzip_path + '.part', 'wb') if gunzip is not None else None
+            try:
+                if resumed:
+                    # checksum and decompress the bytes downloaded before
+                    with open(part_path, 'rb') as fp:
+                        while chunk := fp.read(DOWNLOAD_CHUNK_SIZE):
+                            file_hash.update(chunk)
+                            if gunzip is not None:
+                                unzip_out.write(gunzip.decompress(chunk))
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    out.write(chunk)
+                    file_hash.update(chunk)
+                    if gunzip is not None:
+                        unzip_out.write(gunzip.decompress(chunk))
+                if gunzip is not None:
+                    unzip_out.write(gunzip.flush())
+            finally:
+                if unzip_out is not None:
+                    unzip_out.close()
+
+    os.replace(part_path, filepath)
+    remove_file(validator_path)
+    if gunzip is not None:
+        os.replace(gunzip_path + '.part', gunzip_path)
+        info("Completed gunzip", gunzip_path)
+    debug(file_hash.hexdigest())
     info("Completed download of", filepath)
-    return response
+    return {
+        'url': download_url,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'content_length': os.path.getsize(filepath),
+        'md5': file_hash.hexdigest(),
+        'downloaded': datetime.now(timezone.utc).isoformat(timespec='seconds')
+    }
+
+
+def remove_file(file_path):
+    if isfile(file_path):
+        os.remove(file_path)
 
 
 def get_md5(filename_with_path):
@@ -0,0 +1,155 @@
+# local modules
+import helper
+
+# other libraries
+import numpy as np
+import pandas as pd
+
+###############################
+#
+# JOIN PLANNER
+#
+# The joined output (--joined-output) left joins the processed sources in the order of --sources: each source
+# joins on the join-group (by helper.get_join_precedence) that a source before it already has.
+# The planner keeps that result, but executes the joins in the order that keeps the intermediate frames
+# smallest: each step runs the join that adds the fewest rows, among the sources whose join column is already
+# in the merged frame. The number of rows of each join is counted beforehand from the key counts of the
+# source, on integer key codes shared by all sources of the join-group, and a join that would go over the
+# --join-budget raises JoinError before it runs out of memory (which ends a run, while the query service answers
+# the request with an error).
+# Columns are renamed up front to their names in the joined output, and rows are put back in --sources order
+# at the end, so the output is the same as joining in --sources order.
+#
+###############################
+
+KEY_COLUMN = '__join_key'
+ROW_PREFIX = '__row-'
+
+
+# the sources cannot be joined as asked: a source shares no join-group with the sources before it, or a join would
+# go over the --join-budget
+class JoinError(ValueError):
+    pass
+
+
+# the join of each source after the first: the join-group, the (output) column it joins to and its own column,
+# picked as in the sequential join of the sources in --sources order
+def plan(sources, dictionary):
+    dic_df = dictionary[dictionary['join-group'].notnull()].copy()
+    dic_df['precedence'] = dic_df.apply(lambda x: helper.get_join_precedence(x.get('join-group')), axis=1)
+    steps = []
+    already_joined_dic_df = pd.DataFrame(data=None, columns=dic_df.columns)
+    for c, s in enumerate(sources):
+        s_dic_df = dic_df.loc[(dic_df['name'] == s)].sort_values(by=['precedence'])
+        if c > 0:
+            # pick a join group that is already in a merged dataset, starting with the highest precedence
+            selected_join_group = None
+            for jg in s_dic_df['join-group'].unique():
+                if len(already_joined_dic_df.loc[(already_joined_dic_df['join-group'] == jg)]) > 0:
+                    selected_join_group = jg
+                    break
+            if selected_join_group is None:
+                raise JoinError("Didn't find a matching prior join-group for " + s)
+            left_join_column = already_joined_dic_df.loc[(already_joined_dic_df['join-group']
+                                                          == selected_join_group)].iloc[0]['column']
+            right_join_column = s_dic_df.loc[(s_dic_df['join-group'] == selected_join_group)].iloc[0]['column']
+            steps.append({'source': s, 'join-group': selected_join_group,
+                          'left': left_join_column, 'right': right_join_column})
+        already_joined_dic_df = pd.concat([already_joined_dic_df, s_dic_df])
+    return steps
+
+
+# the names of the columns of each source in the joined output: columns already in the output get the suffix of
+# the source, and a join column named like the column it joins to is not repeated;
+# also which source each output column comes from
+def output_columns(columns, sources, steps, suffixes):
+    right_columns = {step['source']: step for step in steps}
+    names = {}
+    owners = {}
+    for s in sources:
+        names[s] = {}
+        step = right_columns.get(s)
+        for column in columns[s]:
+            if step is not None and column == step['right'] and column == step['left']:
+                continue
+            name = column + '-' + suffixes[s] if column in owners else column
+            names[s][column] = name
+            owners[name] = s
+    return names, owners
+
+
+# integer codes of the join column values, shared by all the columns of the join-group (missing values are -1)
+def key_codes(keys, values):
+    return keys.get_indexer(values)
+
+
+def estimate_rows(left_codes, right_codes, size):
+    # missing keys match each other, as in pd.merge
+    counts = np.bincount(right_codes + 1, minlength=size + 1)
+    return int(np.maximum(counts[left_codes + 1], 1).sum())
+
+
+# the columns of a source under their output names, and the row number of each row in the source
+def renamed(data, s, names):
+    frame = data[s].loc[:, list(names[s])].rename(columns=names[s])
+    return with_column(frame, ROW_PREFIX + s, np.arange(len(frame)))
+
+
+# add a column without inserting into the (often fragmented) frame
+def with_column(df, column, values):
+    return pd.concat([df, pd.DataFrame({column: values}, index=df.index)], axis=1)
+
+
+def join(data, dictionary, sources, suffixes, budget=None):
+    steps = plan(sources, dictionary)
+    names, owners = output_columns({s: data[s].columns for s in sources}, sources, steps, suffixes)
+
+    # the distinct values of each join-group over the columns joined on
+    group_values = {}
+    for step in steps:
+        group_values.setdefault(step['join-group'], []).extend([data[owners[step['left']]][step['left']],
+                                                                data[step['source']][step['right']]])
+    keys = {}
+    for jg, values in group_values.items():
+        # empty columns would change the dtype of the keys
+        values = [v for v in values if len(v) > 0] or values
+        keys[jg] = pd.Index(pd.concat(values, ignore_index=True).dropna().unique())
+        helper.debug("Join-group", jg, "has", len(keys[jg]), "distinct keys")
+
+    out_df = renamed(data, sources[0], names)
+    joined = {sources[0]}
+    pending = list(steps)
+    order = [sources[0]]
+    while len(pending) > 0:
+        # the joins that can run now, and the rows each would give
+        candidates = []
+        for step in pending:
+            if owners[step['left']] not in joined:
+                continue
+            jg_keys = keys[step['join-group']]
+            left_codes = key_codes(jg_keys, out_df[step['left']])
+            right_codes = key_codes(jg_keys, data[step['source']][step['right']])
+            rows = estimate_rows(left_codes, right_codes, len(jg_keys))
+            candidates.append((rows, step, left_codes, right_codes))
+        rows, step, left_codes, right_codes = min(candidates, key=lambda candidate: candidate[0])
+        s = step['source']
+        helper.info("Joining", s, "on", step['right'], "=", step['left'], "(" + step['join-group'] + "):",
+                    len(out_df), "rows to", rows)
+        if budget is not None and rows > budget:
+            raise JoinError("Joining " + s + " would give " + str(rows) + " rows, more than the --join-budget of " +
+                            str(budget) + " rows; filter the sources with --variant / --gene or leave out " + s)
+
+        right_df = with_column(renamed(data, s, names), KEY_COLUMN, right_codes)
+        out_df = pd.merge(with_column(out_df, KEY_COLUMN, left_codes), right_df, how='left', on=KEY_COLUMN)
+        out_df = out_df.drop(columns=[KEY_COLUMN])
+        joined.add(s)
+        order.append(s)
+        pending.remove(step)
+
+    helper.debug("Join order:", order)
+    # rows in the order of the sequential join in --sources order
+    row_columns = [ROW_PREFIX + s for s in sources]
+    if order != list(sources):
+        out_df = out_df.sort_values(by=row_columns, kind='stable', na_position='last', ignore_index=True)
+    columns = [name for s in sources for name in names[s].values()]
+    return out_df.loc[:, columns]
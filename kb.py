@@ -0,0 +1,210 @@
+# local modules
+import helper
+import joins
+import output
+import sqljoin
+
+# other libraries
+import json
+import os
+import sqlite3
+import sys
+from os.path import isfile
+import pandas as pd
+
+###############################
+#
+# VARIANT KNOWLEDGE BASE
+#
+# --build-kb runs the pipeline once over all the sources (or --sources), with the --expand, --map, --onehot, ...
+# options given and --template, and keeps the processed rows of each source in an SQLite database file, indexed
+# on the join-group columns of the source (variation-id, gene-symbol, hgnc-id, ...).
+# --lookup then answers --variant / --gene (or --variant-file / --gene-file) requests from that file alone: it
+# reads the rows of the first source for the variants or genes, then, join by join, the rows of each later source
+# holding the keys they join to, and joins just those rows as the joined output does. The rows are the same as
+# those of a --joined-output run over the sources, filtered on the same variants or genes, with the encodings
+# fitted over all rows of each source (as with --fit-encoders).
+# The sources are not joined up front: gene level sources would repeat their rows for every variant of the gene.
+#
+###############################
+
+KB_VERSION = 1
+KB_TABLE = '__kb'
+
+
+# the join order when --sources is not given: the sources with variation-id columns, then each source that joins
+# to a source before it
+def join_order(dictionary):
+    dic_df = dictionary[dictionary['join-group'].notnull()]
+    groups = {s: set(g) for s, g in dic_df.groupby('name', sort=True)['join-group']}
+    for s in sorted(set(dictionary['name']) - set(groups)):
+        helper.warning("Source", s, "has no join-group columns; leaving it out of the knowledge base")
+    order = [s for s, join_groups in groups.items() if 'variation-id' in join_groups]
+    pending = [s for s in groups if s not in order]
+    if len(order) == 0 and len(pending) > 0:
+        order.append(pending.pop(0))
+    joined = set().union(*[groups[s] for s in order])
+    while len(pending) > 0:
+        s = next((s for s in pending if len(groups[s] & joined) > 0), None)
+        if s is None:
+            helper.critical("Cannot join", pending, "to the other sources; specify the join order with --sources")
+            exit(-1)
+        order.append(s)
+        joined.update(groups[s])
+        pending.remove(s)
+    helper.debug("Knowledge base join order:", order)
+    return order
+
+
+# how the sources join: their order, column suffixes and join-group columns (of the columns of each source)
+def join_settings(dictionary, sources, suffixes, columns):
+    dic_df = dictionary.loc[dictionary['join-group'].notnull() & dictionary['name'].isin(sources)]
+    join_columns = [{'name': r['name'], 'column': r['column'], 'join-group': r['join-group']}
+                    for i, r in dic_df.iterrows() if r['column'] in columns[r['name']]]
+    # check the sources join in this order
+    joins.plan(sources, pd.DataFrame(join_columns, columns=['name', 'column', 'join-group']))
+    return {'sources': sources, 'suffixes': {s: suffixes[s] for s in sources}, 'join-columns': join_columns}
+
+
+# index the sources loaded into the database by the pipeline on their join-group columns, record how they join,
+# and put the knowledge base in place
+def build(dictionary, sources, suffixes, args):
+    file_name = sqljoin.database_file(args)
+    connection = sqljoin.connect(file_name)
+    settings = {'version': KB_VERSION, 'template': args.template}
+    settings.update(join_settings(dictionary, sources, suffixes, sqljoin.schema(connection, sources)))
+    with connection:
+        for c in settings['join-columns']:
+            helper.debug("Indexing", c['name'], "on", c['column'])
+            connection.execute("CREATE INDEX " + sqljoin.quote('__index-' + c['name'] + '-' + c['column']) +
+                               " ON " + sqljoin.quote(c['name']) + " (" + sqljoin.quote(c['column']) + ")")
+        connection.execute("CREATE TABLE " + KB_TABLE + " (name TEXT PRIMARY KEY, value TEXT)")
+        connection.executemany("INSERT INTO " + KB_TABLE + " VALUES (?, ?)",
+                               [(name, json.dumps(value)) for name, value in settings.items()])
+    connection.execute("ANALYZE")
+    connection.close()
+    os.replace(file_name, args.build_kb)
+    helper.info("Built knowledge base of", len(sources), "sources as", args.build_kb)
+
+
+def connect(kb_file):
+    if not isfile(kb_file):
+        helper.critical("Cannot find knowledge base", kb_file, "; build it with --build-kb")
+        exit(-1)
+    # read only, so lookups can run side by side
+    return sqlite3.connect('file:' + kb_file + '?mode=ro', uri=True, check_same_thread=False)
+
+
+def read_settings(connection):
+    settings = {name: json.loads(value) for name, value in connection.execute("SELECT name, value FROM " + KB_TABLE)}
+    if settings.get('version') != KB_VERSION:
+        helper.critical("Knowledge base was built by another version; build it again with --build-kb")
+        exit(-1)
+    return settings
+
+
+# the rows of a source, in source order, holding one of the values in each of the (column, values) conditions;
+# missing values match each other, as in pd.merge
+def read_rows(connection, sourcename, dtypes, conditions):
+    where = []
+    params = []
+    for column, values in conditions:
+        values = pd.Series(values)
+        clause = sqljoin.quote(column) + " IN (SELECT value FROM json_each(?))"
+        params.append(json.dumps(values.dropna().unique().tolist()))
+        if values.isna().any():
+            clause = "(" + clause + " OR " + sqljoin.quote(column) + " IS NULL)"
+        where.append(clause)
+    query = "SELECT * FROM " + sqljoin.quote(sourcename)
+    if len(where) > 0:
+        query = query + " WHERE " + " AND ".join(where)
+    df = pd.read_sql_query(query + " ORDER BY rowid", connection, params=params)
+    return sqljoin.restore(df, {column: (dtype, sourcename) for column, dtype in dtypes.items()},
+                           {sourcename: False})
+
+
+# the joined rows for the variants and / or genes (comma separated, as in --variant and --gene), and the rows of
+# each source that are in them, read from the knowledge base
+def lookup(connection, settings, variant=None, gene=None):
+    columns = sqljoin.schema(connection, settings['sources'])
+    return join_rows(settings, columns, lambda s, conditions: read_rows(connection, s, columns[s], conditions),
+                     variant, gene)
+
+
+# join the rows for the variants and / or genes; read_source(sourcename, conditions) gives the rows of a source
+# holding one of the values in each of the (column, values) conditions
+def join_rows(settings, columns, read_source, variant=None, gene=None):
+    sources = settings['sources']
+    join_columns = pd.DataFrame(settings['join-columns'], columns=['name', 'column', 'join-group'])
+    steps = {step['source']: step for step in joins.plan(sources, join_columns)}
+    names, owners = joins.output_columns({s: list(columns[s]) for s in sources}, sources, list(steps.values()),
+                                         settings['suffixes'])
+    filters = []
+    if variant:
+        filters.append(('variation-id', [int(v) for v in str(variant).split(',')]))
+    if gene:
+        filters.append(('gene-symbol', str(gene).split(',')))
+
+    data = {}
+    for s in sources:
+        # the --variant / --gene filters, as on the sources of a run, and the keys the source joins to
+        conditions = [(column, values) for join_group, values in filters
+                      for column in join_columns.loc[(join_columns['name'] == s) &
+                                                     (join_columns['join-group'] == join_group), 'column']]
+        step = steps.get(s)
+        if step is not None:
+            conditions.append((step['right'], data[owners[step['left']]][step['left']]))
+        data[s] = read_source(s, conditions)
+    return joins.join(data, join_columns, sources, settings['suffixes']), data
+
+
+# the joined rows with --na-value and --columns applied, as in the joined output
+def output_rows(joined, args):
+    # fill in any Nan values after merging dataframes
+    if args.na_value is not None:
+        helper.fillna(joined, args.na_value)
+    return output.select_columns(joined, args.columns)
+
+
+# the template text of the rows of each source that has a template
+def write_text(text_file, data):
+    for sourcename, df in data.items():
+        if "{}-template".format(sourcename) in df.columns:
+            output.write_text(text_file, df, sourcename)
+
+
+# write the joined rows as --output-format to a file name, or as CSV to an open file (standard output), and the
+# template text of the rows of each source
+def write(joined, data, args, csv_file, text_file_name=None):
+    if isinstance(csv_file, str):
+        output.write_frame(output_rows(joined, args), csv_file, args)
+    else:
+        output_rows(joined, args).to_csv(csv_file, index=False)
+    if text_file_name is not None:
+        with open(text_file_name, 'w') as text_file:
+            write_text(text_file, data)
+
+
+# answer a --lookup from the knowledge base: the joined rows go to --joined-output (or standard output) and the
+# template text to --template-output; for a --variant-file / --gene-file batch, each variant or gene gets its own
+# files in --output-dir
+def run(args):
+    connection = connect(args.lookup)
+    settings = read_settings(connection)
+    if args.batch is None:
+        joined, data = lookup(connection, settings, args.variant, args.gene)
+        helper.info("Found", len(joined), "rows in", args.lookup)
+        write(joined, data, args, args.output if args.output is not None else sys.stdout, args.text_output)
+    else:
+        os.makedirs(args.output_dir, exist_ok=True)
+        helper.info("Writing", len(args.batch), args.batch_kind, "lookups to", args.output_dir)
+        for key in args.batch:
+            if args.batch_kind == 'variant':
+                joined, data = lookup(connection, settings, variant=key)
+            else:
+                joined, data = lookup(connection, settings, gene=key)
+            file_name = str(os.path.join(args.output_dir, args.batch_kind + '_' + str(key)))
+            csv_file = file_name + output.FORMAT_EXTENSIONS[args.output_format]
+            text_file_name = file_name + '.txt' if settings['template'] else None
+            write(joined, data, args, csv_file, text_file_name)
+    connection.close()
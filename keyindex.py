@@ -0,0 +1,237 @@
+# local modules
+import cache
+import gzindex
+import helper
+import reader
+
+# other libraries
+import io
+import json
+import os
+from os.path import isfile
+import numpy as np
+import pandas as pd
+
+###############################
+#
+# JOIN-KEY INDEX
+#
+# For each join-group column of a source (variation-id, gene-symbol, hgnc-id, ... as set in dictionary.csv)
+# the index maps every value to the data rows holding it: the row number (which is also the row in the
+# Parquet cache) and the byte offset of the row's line in the data file.
+# --variant and --gene lookups then read just those rows, either from the cache row groups or by seeking to
+# the lines in the data file, instead of scanning the source.
+# For a compressed (.gz) data file the offsets are in the uncompressed data, and the gzip checkpoint index built
+# with the join-key index (see gzindex.py) lets the lookups seek to them.
+# The index is built with --build-index and kept next to the source cache. Once built, it is rebuilt
+# automatically when the data file (or the join-group columns of the dictionary) change.
+#
+###############################
+
+INDEX_ROW_GROUP_SIZE = 100000
+BLOCK_SIZE = 64 * 1024 * 1024
+
+
+def index_file(sourcefile):
+    return str(os.path.join(cache.cache_dir(sourcefile), sourcefile.get('name') + '.index.parquet'))
+
+
+def signature_file(sourcefile):
+    return str(os.path.join(cache.cache_dir(sourcefile), sourcefile.get('name') + '.index.json'))
+
+
+# file columns of the join-group columns, and which of them are expanded (lists of values)
+def join_columns(sourcefile, dic):
+    settings = {}
+    for i, r in dic.loc[dic['join-group'].notnull()].iterrows():
+        settings[r['column']] = r['expand'] == True
+    columns = {}
+    for file_column in reader.header(sourcefile):
+        column = reader.dictionary_column(sourcefile, file_column)
+        if column in settings:
+            columns[file_column] = settings[column]
+    return columns
+
+
+def signature(sourcefile, dic):
+    sig = cache.signature(sourcefile, reader.data_file(sourcefile))
+    sig['columns'] = sorted(join_columns(sourcefile, dic))
+    return sig
+
+
+# returns the index description when the index is current for the data file, otherwise None
+def current(sourcefile, dic):
+    if not (isfile(index_file(sourcefile)) and isfile(signature_file(sourcefile))):
+        return None
+    try:
+        with open(signature_file(sourcefile), 'r') as fp:
+            description = json.load(fp)
+    except (OSError, ValueError):
+        return None
+    if description.get('signature') != signature(sourcefile, dic):
+        return None
+    return description
+
+
+def exists(sourcefile):
+    return isfile(index_file(sourcefile))
+
+
+# --build-index of a compressed data file also needs its gzip checkpoint index, without which the offsets of the
+# join-key index could only be reached by decompressing the file from the start
+def can_build(sourcefile):
+    if gzindex.compressed(reader.data_file(sourcefile)) and not gzindex.indexed_gzip_available():
+        helper.critical("Cannot build the gzip checkpoint index of", reader.data_file(sourcefile),
+                        "for the join-key index of", sourcefile.get('name'),
+                        "(indexed_gzip not installed; see requirements.txt)")
+        return False
+    return True
+
+
+# byte offset of the start of every line in the (uncompressed) file, and the size of the file
+def line_starts(file_name):
+    starts = [np.zeros(1, dtype=np.int64)]
+    position = 0
+    with gzindex.open_data(file_name) as fp:
+        while True:
+            block = fp.read(BLOCK_SIZE)
+            if not block:
+                break
+            newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 10).astype(np.int64)
+            starts.append(newlines + position + 1)
+            position = position + len(block)
+    starts = np.concatenate(starts)
+    # no line starts at the end of the file
+    return starts[starts < position], position
+
+
+# byte offsets of the data rows, or None when the rows do not map one to one to lines (e.g. quoted values with
+# line breaks, or malformed lines the parser dropped)
+def row_offsets(sourcefile, rows):
+    file_name = reader.data_file(sourcefile)
+    starts, size = line_starts(file_name)
+    ends = np.append(starts[1:], size)
+    first = int(reader.records(sourcefile, np.array([0]))[0])
+    # the parser skips blank lines and the configured skip rows
+    data_lines = np.arange(len(starts))
+    data_lines = data_lines[(data_lines >= first) & (ends - starts > 1)]
+    data_lines = data_lines[~np.isin(data_lines, reader.skip_rows(sourcefile))]
+    if len(data_lines) != rows:
+        helper.debug("Data rows do not line up with the lines of", file_name, ":", rows, "rows,",
+                     len(data_lines), "lines")
+        return None, None
+    data_offset = int(starts[first]) if first < len(starts) else size
+    return starts[data_lines], data_offset
+
+
+def build(sourcefile, dic):
+    sourcename = sourcefile.get('name')
+    columns = join_columns(sourcefile, dic)
+    if len(columns) == 0:
+        helper.info("No join-group columns to index for", sourcename)
+        return False
+    if not reader.pyarrow_available():
+        helper.warning("Cannot build index for", sourcename, "(pyarrow not installed)")
+        return False
+
+    helper.info("Building join-key index for", sourcename, "on", list(columns))
+    # same parse as the full read (and the cache), so row numbers agree
+    scan = reader.read_csv(sourcefile, dtypes={column: str for column in columns}, usecols=list(columns))
+    offsets, data_offset = row_offsets(sourcefile, len(scan))
+
+    keys = []
+    for column, expand in columns.items():
+        values = scan[column].dropna()
+        if expand:
+            # also index each item of a list of values
+            values = pd.concat([values, values.str.split(',').explode()])
+        keys.append(pd.DataFrame({'column': column, 'value': values.to_numpy(dtype=str),
+                                  'row': values.index.to_numpy(dtype=np.int64)}))
+    keys_df = pd.concat(keys, ignore_index=True).drop_duplicates()
+    keys_df['offset'] = offsets[keys_df['row'].to_numpy()] if offsets is not None else -1
+    keys_df = keys_df.sort_values(by=['column', 'value', 'row'], ignore_index=True)
+    if offsets is not None:
+        gzindex.build(sourcefile, reader.data_file(sourcefile))
+
+    os.makedirs(cache.cache_dir(sourcefile), exist_ok=True)
+    keys_df.to_parquet(index_file(sourcefile), index=False, row_group_size=INDEX_ROW_GROUP_SIZE)
+    with open(signature_file(sourcefile), 'w') as fp:
+        json.dump({'signature': signature(sourcefile, dic), 'rows': len(scan), 'data_offset': data_offset},
+                  fp, indent=2)
+    helper.info("Indexed", len(keys_df), "keys of", len(scan), "rows for", sourcename, "as", index_file(sourcefile))
+    return True
+
+
+# rows (and line offsets) holding the values of all the row filters (see reader.row_filters)
+def rows(sourcefile, filters):
+    import pyarrow.parquet as pq
+
+    keys_df = None
+    for file_column, values, split in filters:
+        found = pq.read_table(index_file(sourcefile), columns=['row', 'offset'],
+                              filters=[('column', '=', file_column), ('value', 'in', [str(v) for v in values])])
+        found = found.to_pandas().drop_duplicates()
+        keys_df = found if keys_df is None else keys_df.merge(found, on=['row', 'offset'])
+    return keys_df.sort_values(by='row', ignore_index=True)
+
+
+# read the rows from the cache row groups holding them
+def read_cached_rows(sourcefile, found, columns=None):
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(cache.cache_file(sourcefile))
+    sizes = [parquet_file.metadata.row_group(i).num_rows for i in range(parquet_file.num_row_groups)]
+    starts = np.cumsum([0] + sizes)
+    row_numbers = found['row'].to_numpy()
+    groups = np.searchsorted(starts, row_numbers, side='right') - 1
+    selected = np.unique(groups)
+    # position of each selected row group within the rows read
+    selected_starts = np.cumsum([0] + [sizes[g] for g in selected[:-1]])
+    positions = row_numbers - starts[groups] + selected_starts[np.searchsorted(selected, groups)]
+    table = parquet_file.read_row_groups(selected.tolist(), columns=columns)
+    helper.info("Read", len(found), "indexed rows from", len(selected), "row groups of",
+                cache.cache_file(sourcefile))
+    return reader.missing_as_nan(table.take(positions).to_pandas())
+
+
+# read the rows by seeking to their lines in the data file and parsing them after the header lines
+def read_lines(sourcefile, dtypes, found, data_offset, columns=None):
+    with gzindex.open_seekable(sourcefile, reader.data_file(sourcefile)) as fp:
+        lines = [fp.read(data_offset)]
+        for offset in found['offset']:
+            fp.seek(int(offset))
+            line = fp.readline()
+            lines.append(line if line.endswith(b'\n') else line + b'\n')
+    helper.info("Read", len(found), "indexed lines from", reader.data_file(sourcefile))
+    return reader.read_csv(sourcefile, dtypes=dtypes, source=io.BytesIO(b''.join(lines)), usecols=columns)
+
+
+# read only the rows matching the row filters using the index; returns None when there is no index to use
+def read(sourcefile, dic, filters, use_cache=True, columns=None):
+    if not filters or not exists(sourcefile):
+        return None
+    description = current(sourcefile, dic)
+    if description is None:
+        helper.info("Join-key index for", sourcefile.get('name'), "is out of date")
+        if not build(sourcefile, dic):
+            return None
+        description = current(sourcefile, dic)
+    # only columns in the index can be looked up
+    if not all(file_column in description['signature']['columns'] for file_column, values, split in filters):
+        return None
+
+    dtypes = reader.schema(sourcefile, dic)
+    found = rows(sourcefile, filters)
+    if len(found) == 0:
+        read_dtypes = dtypes if columns is None else {c: d for c, d in dtypes.items() if c in columns}
+        return reader.read_csv(sourcefile, reader.line_engine(sourcefile), read_dtypes, nrows=0, usecols=columns)
+    if use_cache and cache.is_current(sourcefile, reader.data_file(sourcefile), dtypes):
+        return read_cached_rows(sourcefile, found, columns)
+    if description['data_offset'] is not None and (found['offset'] >= 0).all():
+        if columns is not None:
+            dtypes = {column: dtype for column, dtype in dtypes.items() if column in columns}
+        df = read_lines(sourcefile, dtypes, found, description['data_offset'], columns)
+        if len(df) == len(found):
+            return df
+        helper.warning("Indexed lines do not match", reader.data_file(sourcefile), "; reading all rows")
+    return None
@@ -0,0 +1,296 @@
+# local modules
+import encode
+import helper
+import reader
+
+# other libraries
+import json
+import os
+from textwrap import TextWrapper
+import numpy as np
+import pandas as pd
+
+#########################
+#
+# OUTPUT FILES
+#
+# The per-source and joined outputs are written as --output-format: CSV, gzip compressed CSV, or the columnar
+# Parquet and Feather (Arrow IPC) formats, which keep the dtypes of the columns. Outputs written in parts (the
+# chunks of --chunksize, the batches of the out-of-core join) keep a columnar file open until the last part.
+# With --ml-export the numeric encoded columns of each per-source output are also written as a float32 NumPy
+# matrix (.npy, to load with numpy.load(..., mmap_mode='r')) with a JSON manifest of its columns.
+#
+#########################
+
+# file extension of each --output-format
+FORMAT_EXTENSIONS = {'csv': '.csv', 'csv.gz': '.csv.gz', 'parquet': '.parquet', 'feather': '.feather'}
+GZIP_OPTIONS = {'method': 'gzip', 'compresslevel': 6, 'mtime': 0}
+# bytes copied at a time into the --ml-export matrix
+FEATURE_BLOCK_BYTES = 64 * 1024 * 1024
+
+# columnar files written in parts, and the schema of their first part
+writers = {}
+
+
+# per-source files are put in current directory, prepend source name to file
+def source_output_file(sourcename, args):
+    output_file = sourcename + '-output' + FORMAT_EXTENSIONS[args.output_format]
+    if args.output is not None:
+        output_file = sourcename + '-' + args.output
+    return output_file
+
+
+# the file name without the extension of its format
+def output_base(file_name):
+    for extension in FORMAT_EXTENSIONS.values():
+        if file_name.endswith(extension):
+            return file_name[:-len(extension)]
+    return os.path.splitext(file_name)[0]
+
+
+# the frame as an Arrow table; sparse columns are made dense, and object or category columns holding values of more
+# than one type (e.g. text filled with a numeric --na-value) are written as text
+def arrow_table(df, schema=None):
+    import pyarrow as pa
+
+    sparse = sparse_columns(df)
+    if len(sparse) > 0:
+        df = df.astype({column: df[column].dtype.subtype for column in sparse})
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowTypeError, pa.ArrowInvalid):
+        df = df.copy()
+        for column in df.columns:
+            if df[column].dtype == object or isinstance(df[column].dtype, pd.CategoricalDtype):
+                values = df[column].astype(object)
+                df[column] = values.where(values.isna(), values.astype(str))
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    if schema is not None:
+        try:
+            table = table.select(schema.names).cast(schema)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, KeyError) as exc:
+            helper.critical("Rows do not fit the columns of the rows written before them:", exc,
+                            "; use --output-format=csv or a larger --chunksize")
+            exit(-1)
+    return table
+
+
+# the schema of a file written in parts: columns without a value in the first part are text, and (in Feather
+# files, which cannot change the categories from one part to the next) categories are written as their values
+def parts_schema(table, output_format):
+    import pyarrow as pa
+
+    fields = []
+    for field in table.schema:
+        if pa.types.is_null(field.type):
+            field = field.with_type(pa.string())
+        elif pa.types.is_dictionary(field.type) and output_format == 'feather':
+            field = field.with_type(field.type.value_type)
+        fields.append(field)
+    return pa.schema(fields, metadata=table.schema.metadata)
+
+
+def open_writer(file_name, schema, output_format):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if output_format == 'parquet':
+        return pq.ParquetWriter(file_name, schema)
+    return pa.ipc.new_file(file_name, schema, options=pa.ipc.IpcWriteOptions(compression='lz4'))
+
+
+# write the frame as --output-format; append adds the rows to a file already started, and more keeps a columnar file
+# open for the parts still to come, until close
+def write_frame(df, file_name, args, append=False, more=False):
+    if args.output_format in ('csv', 'csv.gz'):
+        compression = GZIP_OPTIONS if args.output_format == 'csv.gz' else 'infer'
+        df.to_csv(file_name, index=False, mode='a' if append else 'w', header=not append, compression=compression)
+        return
+    if not reader.pyarrow_available():
+        helper.critical("Cannot write", args.output_format, "output (pyarrow not installed)")
+        exit(-1)
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+
+    if append and file_name in writers:
+        writer, schema = writers.pop(file_name)
+        table = arrow_table(df, schema)
+    elif more:
+        table = arrow_table(df)
+        schema = parts_schema(table, args.output_format)
+        table = table.cast(schema)
+        writer = open_writer(file_name, schema, args.output_format)
+    else:
+        # the whole output at once
+        if args.output_format == 'parquet':
+            pq.write_table(arrow_table(df), file_name)
+        else:
+            feather.write_feather(arrow_table(df), file_name)
+        return
+    writer.write_table(table)
+    if more:
+        writers[file_name] = (writer, schema)
+    else:
+        writer.close()
+
+
+# finish a file written in parts
+def close(file_name):
+    if file_name in writers:
+        writer, schema = writers.pop(file_name)
+        writer.close()
+
+
+# drop any columns that were not included in --columns (or keep them all)
+def select_columns(df, columns):
+    if columns is None:
+        return df
+    columns_to_remove = list(set(df.columns.values.tolist()) - set(columns))
+    helper.debug("Columns to remove:", columns_to_remove)
+    return df.drop(columns_to_remove, axis=1)
+
+
+# create per-source output files to debugging purposes; append=True adds rows to a file already started, and
+# more=True keeps a columnar file open for the chunks still to come (see close)
+def write_source(df, sourcename, args, append=False, more=False):
+    helper.debug("columns for ", sourcename, ":")
+    helper.debug(df.columns.values.tolist())
+
+    output_file = source_output_file(sourcename, args)
+    helper.debug("Generating intermediate source output", output_file)
+    single_source_df = select_columns(df, args.columns)
+    if args.sparse is not None:
+        # the sparse one-hot columns are written by write_sparse
+        single_source_df = single_source_df.drop(columns=sparse_columns(single_source_df))
+    helper.debug("single_source_df:", single_source_df)
+    write_frame(single_source_df, output_file, args, append, more)
+
+
+# one-hot columns encoded as sparse columns (--sparse)
+def sparse_columns(df):
+    return [column for column, dtype in df.dtypes.items() if isinstance(dtype, pd.SparseDtype)]
+
+
+# the selected sparse one-hot columns of the rows written to the per-source output
+def sparse_part(df, args):
+    df = select_columns(df, args.columns)
+    return df[sparse_columns(df)]
+
+
+def sparse_output_files(sourcename, args):
+    base = output_base(source_output_file(sourcename, args)) + '-onehot'
+    return base + ('.mtx' if args.sparse == 'mtx' else '.npz'), base + '-columns.csv'
+
+
+# write the sparse one-hot columns of the per-source output rows (in parts, e.g. one per chunk) as a scipy.sparse
+# .npz or Matrix Market .mtx matrix, with a file listing the column of each matrix column
+def write_sparse(parts, sourcename, args):
+    columns = parts[0].columns.tolist() if len(parts) > 0 else []
+    if len(columns) == 0:
+        return
+    from scipy import io, sparse
+
+    matrix_file, columns_file = sparse_output_files(sourcename, args)
+    matrix = sparse.vstack([part.sparse.to_coo() for part in parts], format='csr')
+    helper.debug("Writing", matrix.shape, "sparse one-hot matrix for", sourcename, "as", matrix_file)
+    if args.sparse == 'mtx':
+        io.mmwrite(matrix_file, matrix)
+    else:
+        sparse.save_npz(matrix_file, matrix)
+    pd.DataFrame({'column': columns}).to_csv(columns_file, index_label='index')
+
+
+# a mapping table whose map-values are all numbers
+def numeric_table(table):
+    values = table.dropna()
+    return len(values) > 0 and pd.to_numeric(values, errors='coerce').notna().all()
+
+
+# the numeric encoded columns of the per-source output for --ml-export, in dictionary order: the map-names with
+# numeric map-values, the one-hot columns (unless written by --sparse), and the category, age and days codes
+def feature_columns(df, dic, mapping, args):
+    names = set(select_columns(df, args.columns).columns)
+    features = {}
+    for i, r in dic.iterrows():
+        column_name = r['column']
+        found = []
+        if args.map and r['map'] is True:
+            found += [(m, 'map') for m, table in mapping.get(column_name, {}).items() if numeric_table(table)]
+        if args.onehot and r['onehot'] is True and args.sparse is None:
+            prefix = encode.onehot_prefix(column_name)
+            found += [(name, 'onehot') for name in df.columns if name.startswith(prefix)]
+        if args.categories and r['category'] is True:
+            found.append((encode.CATEGORIES_PREFIX + '_' + column_name, 'categories'))
+        if not pd.isna(r['format']):
+            if args.age:
+                found.append((encode.AGE_PREFIX + '_' + column_name, 'age'))
+            if args.days:
+                found.append((encode.DAYS_PREFIX + '_' + column_name, 'days'))
+        for name, encoding in found:
+            if name in names and name not in features:
+                features[name] = {'name': name, 'encoding': encoding, 'column': column_name}
+    return list(features.values())
+
+
+def feature_output_files(sourcename, args):
+    base = output_base(source_output_file(sourcename, args)) + '-features'
+    return base + '.npy', base + '.json'
+
+
+# append the feature columns of the per-source output rows (the whole source, or one chunk of it) to the raw float32
+# rows of the --ml-export matrix, which finish_features turns into the .npy file
+def write_features(df, features, sourcename, args, append=False):
+    matrix_file, manifest_file = feature_output_files(sourcename, args)
+    names = [feature['name'] for feature in features]
+    values = np.empty((len(df), len(names)), dtype=np.float32)
+    for position, name in enumerate(names):
+        column = df[name] if name in df.columns else pd.Series(np.nan, index=df.index)
+        values[:, position] = pd.to_numeric(column, errors='coerce').to_numpy(dtype=np.float32, na_value=np.nan)
+    with open(matrix_file + '.part', 'ab' if append else 'wb') as fp:
+        values.tofile(fp)
+
+
+# write the --ml-export matrix as a .npy file (copying the raw rows a block at a time, so the matrix is never held in
+# memory) and its manifest, which lists the output column, encoding and dictionary column of each matrix column
+def finish_features(features, sourcename, args):
+    matrix_file, manifest_file = feature_output_files(sourcename, args)
+    part_file = matrix_file + '.part'
+    shape = (os.path.getsize(part_file) // (4 * len(features)), len(features))
+    helper.debug("Writing", shape, "feature matrix for", sourcename, "as", matrix_file)
+    if shape[0] == 0:
+        np.save(matrix_file, np.empty(shape, dtype=np.float32))
+    else:
+        rows = np.memmap(part_file, dtype=np.float32, mode='r', shape=shape)
+        matrix = np.lib.format.open_memmap(matrix_file, mode='w+', dtype=np.float32, shape=shape)
+        block = max(1, FEATURE_BLOCK_BYTES // (4 * shape[1]))
+        for start in range(0, shape[0], block):
+            matrix[start:start + block] = rows[start:start + block]
+        matrix.flush()
+        del matrix, rows
+    os.remove(part_file)
+    manifest = {'source': sourcename, 'file': os.path.basename(matrix_file), 'dtype': 'float32',
+                'shape': list(shape),
+                'columns': [dict({'index': i}, **feature) for i, feature in enumerate(features)]}
+    with open(manifest_file, 'w') as fp:
+        json.dump(manifest, fp, indent=2)
+
+
+# the template column of each row as wrapped text, or None when the source has no template column
+def wrapped_text(df, sourcename):
+    wrapper = TextWrapper(width=80, break_long_words=False, break_on_hyphens=False)
+    template_column_name = "{}-template".format(sourcename)
+    if template_column_name not in df.columns:
+        helper.warning("No template output for", sourcename)
+        return None
+    return df[template_column_name].map(wrapper.fill)
+
+
+# write the template column of each row as wrapped text
+def write_text(file, df, sourcename, text=None):
+    if text is None:
+        text = wrapped_text(df, sourcename)
+        if text is None:
+            return
+    for paragraph in text:
+        file.write(paragraph)
+        file.write("\n\n")
@@ -0,0 +1,544 @@
+# local modules
+import cache
+import delta
+import encode
+import encoders
+import helper
+import joins
+import keyindex
+import output
+import profiling
+import reader
+
+# other libraries
+import copy
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from os import access, R_OK
+from os.path import isfile
+import pandas as pd
+
+#########################
+#
+# SOURCE PIPELINE
+#
+# Runs the per-source steps: strip_hash, expand, gene/variant filter, map, onehot, categories, days/age,
+# na-value and template. A source is either processed as a whole dataframe, or streamed in chunks of
+# --chunksize rows which are filtered, encoded and appended to the output files one at a time so that
+# memory is bounded by the chunk size rather than the size of the source file.
+#
+#########################
+
+# rows per chunk when fitting encoders over a whole source
+FIT_CHUNKSIZE = 100000
+
+
+# read mapping file, if any, filter by selected columns, if any, and compile it into lookup tables
+def mapping_config(sourcefile, dic, args, df=None):
+    sourcename = sourcefile['name']
+    map_config_df = pd.DataFrame()
+    if args.map:
+        # see if any of the dictionary fields are set with a map encoder
+        dic_filter_df = dic.loc[(dic['map'] == True)]
+        if len(dic_filter_df) > 0:
+            mapping_file = str(os.path.join(sourcefile['path'], 'mapping.csv'))
+            if not (isfile(mapping_file) and access(mapping_file, R_OK)):
+                # no mapping file found, let's create one, but ask user to re-run if columns are filtered
+                if df is None:
+                    df = prepare(read(sourcefile, dic, args), sourcefile, dic, args)
+                import generate
+                generate.mapping(mapping_file, {sourcename: df}, sourcefile, dic)
+                helper.error("Cannot map columns without mapping file for", sourcename,
+                             "; Please edit generated template.")
+                print("ERROR: Cannot map columns without mapping file for", sourcename,
+                      "; Please edit generated template.")
+                exit(-1)
+            else:
+                helper.debug("Found existing mapping file", mapping_file)
+
+                map_config_df = pd.read_csv(mapping_file)
+                map_config_df = map_config_df.loc[map_config_df['column'].isin(list(set(dic['column'])))]
+
+                helper.debug("Mapping Config:", map_config_df)
+        else:
+            helper.debug("No map fields found in dictionary for", sourcename)
+    return encode.compile_mapping(map_config_df)
+
+
+# row filters for --variant / --gene, which let the reader skip rows that cannot match
+def row_filters(sourcefile, dic, args):
+    if not (args.variant or args.gene):
+        return None
+    return reader.row_filters(sourcefile, dic, args.variant, args.gene, args.expand)
+
+
+# the file columns a run needs from a source, or None for all of them: with --columns, the columns named there (also
+# with the suffix of the source, as in the joined output), the join-group columns, the columns the active options
+# expand or encode, and the columns the template uses
+def projection(sourcefile, dic, args):
+    if args.columns is None:
+        return None
+    suffix = '-' + str(sourcefile['suffix'])
+    needed = {column[:-len(suffix)] if column.endswith(suffix) else column for column in args.columns}
+    needed.update(args.columns)
+    needed.update(dic.loc[dic['join-group'].notnull(), 'column'])
+    for flag, active in [('expand', args.expand), ('map', args.map), ('onehot', args.onehot),
+                         ('category', args.categories)]:
+        if active:
+            needed.update(dic.loc[(dic[flag] == True), 'column'])
+    if args.days or args.age:
+        needed.update(dic.loc[dic['format'].notnull(), 'column'])
+
+    file_columns = reader.header(sourcefile)
+    dic_columns = [reader.dictionary_column(sourcefile, file_column) for file_column in file_columns]
+    if args.template and len(sourcefile['template']) > 0:
+        needed.update(encode.template_columns(sourcefile['template'], dic_columns))
+    columns = [file_column for file_column, column in zip(file_columns, dic_columns) if column in needed]
+    helper.info("Reading", len(columns), "of", len(file_columns), "columns of", sourcefile['name'])
+    return columns
+
+
+# read a whole source (or only the given file columns), looking up the --variant / --gene rows in the join-key
+# index when there is one
+def read(sourcefile, dic, args, columns=None):
+    filters = row_filters(sourcefile, dic, args)
+    df = keyindex.read(sourcefile, dic, filters, args.cache, columns)
+    if df is None:
+        df = reader.read(sourcefile, dic, args.cache, filters, columns)
+    return df
+
+
+# strip, expand and filter the rows of a source (or chunk)
+def prepare(df, sourcefile, dic, args):
+    sourcename = sourcefile['name']
+    helper.debug("File header contains columns:", df.columns)
+
+    if sourcefile['strip_hash'] == 1:
+        df = profiling.run(sourcename, 'strip_hash', encode.strip_hash, df)
+    else:
+        helper.debug("Not stripping column labels")
+
+    if args.expand:
+        df = profiling.run(sourcename, 'expand', encode.expand, df, dic, sourcename)
+
+    # is there an optimal spot to filter for gene and variant?
+    if args.gene:
+        helper.debug("filter genes", args.gene)
+        df = profiling.run(sourcename, 'filter', encode.filter_genes, df, dic, args.gene, sourcename)
+
+    if args.variant:
+        helper.debug("filter variant", args.variant)
+        df = profiling.run(sourcename, 'filter', encode.filter_variants, df, dic, args.variant, sourcename)
+
+    return df
+
+
+# encode the prepared rows of a source (or chunk) and apply the template (reusing the text of the rows that did not
+# change since the last release, with --incremental)
+def transform(df, sourcefile, dic, mapping, args, vocabularies=None, release=None):
+    if args.onehot or args.categories or args.map:  # or args.continuous or args.scaling
+        df = encode.encode(df, dic, mapping, sourcefile['name'], args, vocabularies)
+
+    if args.template and len(sourcefile['template']) > 0 and release is not None:
+        df = profiling.run(sourcefile['name'], 'template', delta.template, release, df, sourcefile,
+                           args.template_jobs)
+    elif args.template and len(sourcefile['template']) > 0:
+        df = profiling.run(sourcefile['name'], 'template', encode.template, df, sourcefile, args.template_jobs)
+
+    helper.debug("Data:", df)
+    return df
+
+
+# process a whole source in memory
+def process(sourcefile, dic, args, release=None):
+    sourcename = sourcefile['name']
+
+    # read source sources
+    helper.info("Reading source for", sourcename, "...")
+
+    # pick the fastest parser for the source and read typed columns per the dictionary (using the columnar
+    # cache of the parsed file when it is still current for the data file), skipping rows that cannot match
+    # the --variant / --gene filters
+    df = profiling.run(sourcename, 'read', read, sourcefile, dic, args, projection(sourcefile, dic, args))
+    if release is not None:
+        delta.add_rows(release, df)
+    df = prepare(df, sourcefile, dic, args)
+
+    # show count of unique values per column
+    if args.counts:
+        print(sourcename, ":", df.nunique())
+        print("Finished reading source file")
+        print()
+        print()
+
+    mapping = mapping_config(sourcefile, dic, args, df)
+    return transform(df, sourcefile, dic, mapping, args, saved_encoders(sourcefile, dic, mapping, args), release)
+
+
+# chunks of rows of a dataframe (at least one, so an empty dataframe still gives the output header)
+def slices(df, chunksize):
+    for start in range(0, max(len(df), 1), chunksize):
+        yield df.iloc[start:start + chunksize]
+
+
+# read the raw source in chunks, from the columnar cache when current or else the source file
+# (only the rows that can match the --variant / --gene filters, when possible)
+def chunks(sourcefile, dic, args, columns=None):
+    data_file = reader.data_file(sourcefile)
+    dtypes = reader.schema(sourcefile, dic)
+    all_dtypes = dtypes
+    if columns is not None:
+        dtypes = {column: dtype for column, dtype in dtypes.items() if column in columns}
+    filters = row_filters(sourcefile, dic, args)
+    if filters:
+        df = keyindex.read(sourcefile, dic, filters, args.cache, columns)
+        if df is not None:
+            yield from slices(df, args.chunksize)
+            return
+    if args.cache:
+        # the cache signature covers the schema of all columns
+        batches = cache.iter_batches(sourcefile, data_file, all_dtypes, args.chunksize, columns, filters)
+        if batches is not None:
+            empty = True
+            for batch in batches:
+                empty = False
+                yield reader.missing_as_nan(batch)
+            if empty:
+                # no matching rows, but the output still gets its header
+                yield reader.read_csv(sourcefile, reader.line_engine(sourcefile), dtypes, nrows=0, usecols=columns)
+            return
+    if filters:
+        df = reader.read_matching(sourcefile, dtypes, filters, usecols=columns)
+        if df is not None:
+            yield from slices(df, args.chunksize)
+            return
+    # pyarrow does not read in chunks
+    read_engine = reader.line_engine(sourcefile)
+    with reader.read_csv(sourcefile, read_engine, dtypes, chunksize=args.chunksize, usecols=columns) as csv_chunks:
+        for chunk in csv_chunks:
+            yield chunk
+
+
+# fit the onehot / category vocabularies over all (expanded, filtered) rows so every chunk is encoded the same
+def vocabularies(sourcefile, dic, mapping, args):
+    fitted = {}
+    encoded = dic.loc[((dic['onehot'] == True) & args.onehot) | ((dic['category'] == True) & args.categories)]
+    if len(encoded) == 0:
+        return fitted
+    # only read the encoded columns and the columns that expand or filter rows
+    needed = set(encoded['column'])
+    if args.expand:
+        needed.update(dic.loc[(dic['expand'] == True), 'column'])
+    if args.gene:
+        needed.update(dic.loc[(dic['join-group'] == 'gene-symbol'), 'column'])
+    if args.variant:
+        needed.update(dic.loc[(dic['join-group'] == 'variation-id'), 'column'])
+    columns = [c for c in reader.header(sourcefile) if reader.dictionary_column(sourcefile, c) in needed]
+
+    helper.info("Fitting encodings for", sourcefile['name'], "...")
+    values = {column: set() for column in encoded['column']}
+    has_na = {column: False for column in encoded['column']}
+    # value counts for --onehot-max
+    counts = {column: {} for column in encoded['column']}
+    for chunk in chunks(sourcefile, dic, args, columns):
+        chunk = prepare(chunk, sourcefile, dic, args)
+        for column in values:
+            values[column].update(chunk[column].dropna().unique())
+            has_na[column] = has_na[column] or bool(chunk[column].isna().any())
+            if args.onehot_max is not None:
+                value_counts = chunk[column].value_counts(dropna=False)
+                for value, count in value_counts.loc[value_counts > 0].items():
+                    counts[column][value] = counts[column].get(value, 0) + count
+
+    for i, r in encoded.iterrows():
+        column = r['column']
+        limit = args.onehot_max if args.onehot and r['onehot'] == True else None
+        if encode.mapped_as_text(r, mapping, args):
+            text_values = {str(v) for v in values[column]}
+            if has_na[column]:
+                text_values.add(str(float('nan')))
+            text_counts = {}
+            for value, count in counts[column].items():
+                text_counts[str(value)] = text_counts.get(str(value), 0) + count
+            fitted[column] = encode.vocabulary(text_values, False, text_counts, limit)
+        else:
+            value_counts = {value: count for value, count in counts[column].items() if not pd.isna(value)}
+            fitted[column] = encode.vocabulary(values[column], has_na[column], value_counts, limit)
+    return fitted
+
+
+# fit the onehot / category vocabularies over all rows of the source (no --variant / --gene filters) and save them
+def fit_encoders(sourcefile, dic, mapping, args):
+    fit_args = copy.copy(args)
+    fit_args.variant = None
+    fit_args.gene = None
+    fit_args.onehot = True
+    fit_args.categories = True
+    fit_args.chunksize = args.chunksize or FIT_CHUNKSIZE
+    fitted = vocabularies(sourcefile, dic, mapping, fit_args)
+    encoders.write(sourcefile, encoders.settings(sourcefile, dic, mapping, args), fitted)
+    return fitted
+
+
+# the vocabularies saved with --fit-encoders (fitted again when the data file changed), or None when the source
+# has none for the encoding settings of the run
+def saved_encoders(sourcefile, dic, mapping, args):
+    if not (args.onehot or args.categories) or not encoders.exists(sourcefile):
+        return None
+    fitted, stale = encoders.read(sourcefile, encoders.settings(sourcefile, dic, mapping, args))
+    if stale:
+        helper.info("Saved encoders for", sourcefile['name'], "are out of date")
+        fitted = fit_encoders(sourcefile, dic, mapping, args)
+    return fitted
+
+
+# the --ml-export columns of the per-source output, or None without --ml-export or numeric encoded columns
+def ml_features(df, sourcefile, dic, mapping, args):
+    if not args.ml_export:
+        return None
+    features = output.feature_columns(df, dic, mapping, args)
+    if len(features) == 0:
+        helper.warning("No numeric encoded columns to export for", sourcefile['name'],
+                       "(see --map, --onehot, --categories, --days and --age)")
+        return None
+    return features
+
+
+# process a source chunk by chunk, appending each encoded chunk to the per-source (and template text) output;
+# returns the processed rows when they are needed for the joined output, otherwise None
+def stream(sourcefile, dic, args, text_file=None, release=None):
+    sourcename = sourcefile['name']
+    helper.info("Streaming source for", sourcename, "in chunks of", args.chunksize, "rows ...")
+
+    mapping = mapping_config(sourcefile, dic, args)
+    fitted = saved_encoders(sourcefile, dic, mapping, args)
+    if fitted is None:
+        fitted = profiling.run(sourcename, 'fit', vocabularies, sourcefile, dic, mapping, args)
+
+    kept = []
+    sparse_parts = []
+    features = None
+    counts = {}
+    written = False
+    df = None
+    columns = projection(sourcefile, dic, args)
+    for chunk in profiling.iterate(sourcename, 'read', chunks(sourcefile, dic, args, columns)):
+        if release is not None:
+            delta.add_rows(release, chunk)
+        df = prepare(chunk, sourcefile, dic, args)
+        if args.counts:
+            for column in df.columns:
+                counts.setdefault(column, set()).update(df[column].dropna().unique())
+        if len(df) == 0 and written:
+            continue
+        df = transform(df, sourcefile, dic, mapping, args, fitted, release)
+        with profiling.stage(sourcename, 'write', df):
+            output.write_source(df, sourcename, args, append=written, more=True)
+            if args.sparse is not None:
+                sparse_parts.append(output.sparse_part(df, args))
+            if not written:
+                features = ml_features(df, sourcefile, dic, mapping, args)
+            if features is not None:
+                output.write_features(df, features, sourcename, args, append=written)
+            if text_file is not None:
+                output.write_text(text_file, df, sourcename)
+            if out_of_core(args):
+                import sqljoin
+                sqljoin.load(args, sourcename, df, append=written)
+        if keep_rows(args):
+            kept.append(df)
+        written = True
+
+    with profiling.stage(sourcename, 'write'):
+        output.close(output.source_output_file(sourcename, args))
+        if args.sparse is not None:
+            output.write_sparse(sparse_parts, sourcename, args)
+        if features is not None:
+            output.finish_features(features, sourcename, args)
+
+    # show count of unique values per column
+    if args.counts:
+        print(sourcename, ":", pd.Series({column: len(v) for column, v in counts.items()}))
+        print("Finished reading source file")
+        print()
+        print()
+
+    if not keep_rows(args):
+        return None
+    if len(kept) == 0:
+        return df
+    return pd.concat(kept, ignore_index=True)
+
+
+# the processed sources are loaded into an SQLite database instead of kept in memory: to join them there for the
+# joined output (--join-engine=sqlite), or as the knowledge base of --build-kb
+def out_of_core(args):
+    return (args.join and args.batch is None and args.join_engine == 'sqlite') or args.build_kb is not None
+
+
+# the processed rows are kept in memory for the joined output, or for the queries of --serve
+def keep_rows(args):
+    return (args.join or args.serve is not None) and not out_of_core(args)
+
+
+# merge the processed sources by join-group with left joins, as if joined in sequence in the order of --sources
+# (see joins.py); suffixes holds the column suffix of each source for columns that are already in the merged output
+def merge(data, dictionary, suffixes, args):
+    helper.info("Merging data sources:", args.sources)
+    out_df = profiling.run(profiling.JOINED, 'join', joins.join, data, dictionary, list(args.sources), suffixes,
+                           args.join_budget)
+
+    # fill in any Nan values after merging dataframes
+    if args.na_value is not None:
+        helper.fillna(out_df, args.na_value)
+
+    # drop any columns that were not included in args.columns (or keep them all)
+    return output.select_columns(out_df, args.columns)
+
+
+# process one source: read, filter, encode and write its per-source (and template text) output; returns what the
+# merged or batch output needs from the source, if anything
+def process_source(sourcefile, dic, args, text_file=None):
+    sourcename = sourcefile['name']
+    if args.batch is not None:
+        # read and filter once for all variants / genes of the batch, the output is written per variant / gene
+        return batch(sourcefile, dic, args)
+
+    # with --incremental, compare the release to the last one and reuse the template text of unchanged rows
+    release = delta.start(sourcefile, dic) if args.incremental else None
+    if args.chunksize:
+        # filter, encode and write the source chunk by chunk
+        df = stream(sourcefile, dic, args, text_file, release)
+    else:
+        df = process(sourcefile, dic, args, release)
+        with profiling.stage(sourcename, 'write', df):
+            if text_file is not None:
+                output.write_text(text_file, df, sourcename)
+            output.write_source(df, sourcename, args)
+            if args.sparse is not None:
+                output.write_sparse([output.sparse_part(df, args)], sourcename, args)
+            features = ml_features(df, sourcefile, dic, mapping_config(sourcefile, dic, args, df), args)
+            if features is not None:
+                output.write_features(df, features, sourcename, args)
+                output.finish_features(features, sourcename, args)
+            if out_of_core(args):
+                import sqljoin
+                sqljoin.load(args, sourcename, df)
+    if release is not None:
+        delta.finish(release)
+    return df if keep_rows(args) else None
+
+
+# process a source in a worker process, writing its template text to a file of its own; also returns the stages
+# measured with --profile
+def process_source_part(sourcefile, dic, args, text_path=None):
+    profiling.reset()
+    if text_path is None:
+        return process_source(sourcefile, dic, args), profiling.records()
+    with open(text_path, 'w') as text_file:
+        return process_source(sourcefile, dic, args, text_file), profiling.records()
+
+
+def data_size(sourcefile):
+    data_file = reader.data_file(sourcefile)
+    return os.path.getsize(data_file) if isfile(data_file) else 0
+
+
+# process (sourcefile, dic) pairs on a pool of --jobs forked worker processes; the processed sources come back to
+# the parent for the merged or batch output, and the template text of each source is appended to text_file in
+# source order
+def process_parallel(sources, args, text_file=None):
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        # main.py is a script that cannot be re-imported by spawned workers
+        helper.warning("Cannot start worker processes on this platform; processing sources one at a time")
+        return {sourcefile['name']: process_source(sourcefile, dic, args, text_file) for sourcefile, dic in sources}
+
+    helper.info("Processing", len(sources), "sources with", args.jobs, "workers")
+    results = {}
+    context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=args.jobs, mp_context=context) as executor:
+        futures = {}
+        # start with the largest data files, so they do not hold up the end of the run
+        for sourcefile, dic in sorted(sources, key=lambda source: -data_size(source[0])):
+            text_path = None
+            if text_file is not None:
+                text_path = text_file.name + '.' + sourcefile['name'] + '.part'
+            futures[sourcefile['name']] = (executor.submit(process_source_part, sourcefile, dic, args, text_path),
+                                           text_path)
+        for sourcefile, dic in sources:
+            future, text_path = futures[sourcefile['name']]
+            results[sourcefile['name']], records = future.result()
+            profiling.merge(records)
+            if text_path is not None:
+                with open(text_path, 'r') as text_part:
+                    shutil.copyfileobj(text_part, text_file)
+                os.remove(text_path)
+    return results
+
+
+# join group filtered by a --variant-file or --gene-file batch
+def batch_join_group(args):
+    return 'variation-id' if args.batch_kind == 'variant' else 'gene-symbol'
+
+
+# rows of a source for one variant or gene of a batch; like the --variant and --gene filters, sources without a
+# column in the join group are not filtered
+def select_key(df, dic, join_group, key):
+    for column in dic.loc[(dic['join-group'] == join_group), 'column']:
+        df = df.loc[df[column].isin([key])]
+    return df
+
+
+# read and filter a source once for all the variants / genes of a batch; the rows of each variant / gene are encoded
+# separately (see batch_rows), so encodings come out as they do when filtering on that single variant / gene
+def batch(sourcefile, dic, args):
+    helper.info("Reading source for", sourcefile['name'], "...")
+    df = prepare(profiling.run(sourcefile['name'], 'read', read, sourcefile, dic, args,
+                               projection(sourcefile, dic, args)), sourcefile, dic, args)
+    mapping = mapping_config(sourcefile, dic, args, df)
+    batch_source = {'sourcefile': sourcefile, 'dic': dic, 'df': df, 'mapping': mapping,
+                    'encoders': saved_encoders(sourcefile, dic, mapping, args), 'shared': None}
+    if len(dic.loc[(dic['join-group'] == batch_join_group(args))]) == 0:
+        # the source is not filtered, so every variant / gene gets the same rows
+        batch_source['shared'] = transform(df, sourcefile, dic, mapping, args, batch_source['encoders'])
+    return batch_source
+
+
+# the encoded rows of a batch source for one variant / gene
+def batch_rows(batch_source, key, args):
+    if batch_source['shared'] is not None:
+        return batch_source['shared']
+    df = select_key(batch_source['df'], batch_source['dic'], batch_join_group(args), key)
+    return transform(df, batch_source['sourcefile'], batch_source['dic'], batch_source['mapping'], args,
+                     batch_source['encoders'])
+
+
+# fan the sources of a batch out into template text (--template) and joined output (--joined-output) files for
+# each variant or gene in --output-dir
+def write_batch(data, dictionary, suffixes, args):
+    os.makedirs(args.output_dir, exist_ok=True)
+    # wrap the template text of the shared sources once, not once per variant / gene
+    shared_texts = {}
+    if args.template:
+        for sourcename, batch_source in data.items():
+            if batch_source['shared'] is not None:
+                shared_texts[sourcename] = output.wrapped_text(batch_source['shared'], sourcename)
+
+    helper.info("Writing", len(args.batch), args.batch_kind, "outputs to", args.output_dir)
+    for key in args.batch:
+        selected = {sourcename: batch_rows(batch_source, key, args) for sourcename, batch_source in data.items()}
+        file_name = str(os.path.join(args.output_dir, args.batch_kind + '_' + str(key)))
+        if args.template:
+            with profiling.stage(profiling.JOINED, 'write'), open(file_name + '.txt', 'w') as text_file:
+                for sourcename, df in selected.items():
+                    if sourcename in shared_texts:
+                        if shared_texts[sourcename] is not None:
+                            output.write_text(text_file, df, sourcename, shared_texts[sourcename])
+                    else:
+                        output.write_text(text_file, df, sourcename)
+        if args.join:
+            out_df = merge(selected, dictionary, suffixes, args)
+            with profiling.stage(profiling.JOINED, 'write', out_df):
+                output.write_frame(out_df, file_name + output.FORMAT_EXTENSIONS[args.output_format], args)
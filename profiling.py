@@ -0,0 +1,179 @@
+# local modules
+import helper
+
+# other libraries
+import atexit
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+import pandas as pd
+
+###############################
+#
+# STAGE PROFILING
+#
+# With --profile every stage of every source (download, read, strip_hash, expand, filter, map, onehot, categories,
+# days/age, template, write) and of the joined output (join, write) is measured, as is the startup of the run:
+# wall time, CPU time (of the process and its finished worker processes), the peak RSS of the process by the end of
+# the stage, and the rows and columns the stage gives. A stage that runs more than once for a source (per chunk, per
+# column, per variant of a batch) is added up over its calls. At exit the stages are written as a JSON report and
+# printed as a table.
+#
+###############################
+
+# source name of the stages of the joined output, and of the run itself
+JOINED = 'joined-output'
+MAIN = 'main'
+
+report_file = None
+started = None
+stages = {}
+
+
+# run_started is the (wall, CPU) time the run started, before its imports
+def setup(profile_file, run_started=None):
+    global report_file, started
+    if profile_file is None:
+        return
+    report_file = profile_file
+    started = run_started if run_started is not None else (time.perf_counter(), cpu_time())
+    atexit.register(report)
+
+
+def enabled():
+    return report_file is not None
+
+
+def cpu_time():
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+# peak resident memory of the process so far, or None where it is not available (Windows)
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+# the startup of the run: imports, arguments and source configuration
+def startup():
+    if enabled():
+        add(MAIN, 'startup', time.perf_counter() - started[0], cpu_time() - started[1])
+
+
+def add(source, stage_name, wall, cpu, df=None, calls=1):
+    record = stages.setdefault((source, stage_name), {'source': source, 'stage': stage_name, 'calls': 0,
+                                                      'wall': 0.0, 'cpu': 0.0, 'peak_rss_mb': None,
+                                                      'rows': None, 'columns': None})
+    record['calls'] = record['calls'] + calls
+    record['wall'] = record['wall'] + wall
+    record['cpu'] = record['cpu'] + cpu
+    peak = peak_rss_mb()
+    if peak is not None:
+        record['peak_rss_mb'] = max(record['peak_rss_mb'] or 0, peak)
+    if isinstance(df, pd.DataFrame):
+        record['rows'] = (record['rows'] or 0) + len(df)
+        record['columns'] = len(df.columns)
+
+
+# measure a block of code as a stage of the source, with the rows of df (if any) as the rows it gives
+@contextmanager
+def stage(source, stage_name, df=None):
+    if not enabled():
+        yield
+        return
+    wall, cpu = time.perf_counter(), cpu_time()
+    yield
+    add(source, stage_name, time.perf_counter() - wall, cpu_time() - cpu, df)
+
+
+# call fn as a stage of the source; the dataframe it returns gives the rows and columns of the stage
+def run(source, stage_name, fn, *arguments, **kwargs):
+    if not enabled():
+        return fn(*arguments, **kwargs)
+    wall, cpu = time.perf_counter(), cpu_time()
+    result = fn(*arguments, **kwargs)
+    add(source, stage_name, time.perf_counter() - wall, cpu_time() - cpu, result)
+    return result
+
+
+# measure each item taken from an iterator (e.g. the chunks read from a source) as a stage of the source
+def iterate(source, stage_name, items):
+    iterator = iter(items)
+    while True:
+        wall, cpu = time.perf_counter(), cpu_time()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        if enabled():
+            add(source, stage_name, time.perf_counter() - wall, cpu_time() - cpu, item)
+        yield item
+
+
+# call fn, adding its time to the stage in timings; for stages run per column, which are added to the source
+# once for all columns with add_timings
+def timed(timings, stage_name, fn, *arguments, **kwargs):
+    if not enabled():
+        return fn(*arguments, **kwargs)
+    wall, cpu = time.perf_counter(), cpu_time()
+    result = fn(*arguments, **kwargs)
+    totals = timings.setdefault(stage_name, [0.0, 0.0])
+    totals[0] = totals[0] + time.perf_counter() - wall
+    totals[1] = totals[1] + cpu_time() - cpu
+    return result
+
+
+def add_timings(source, timings, df=None):
+    for stage_name, (wall, cpu) in timings.items():
+        add(source, stage_name, wall, cpu, df)
+
+
+# the stages measured in a worker process, to send back to the main process
+def records():
+    return list(stages.values())
+
+
+def reset():
+    stages.clear()
+
+
+# add the stages measured in a worker process
+def merge(worker_records):
+    for record in worker_records:
+        add(record['source'], record['stage'], record['wall'], record['cpu'], calls=record['calls'])
+        merged = stages[(record['source'], record['stage'])]
+        if record['peak_rss_mb'] is not None:
+            merged['peak_rss_mb'] = max(merged['peak_rss_mb'] or 0, record['peak_rss_mb'])
+        if record['rows'] is not None:
+            merged['rows'] = (merged['rows'] or 0) + record['rows']
+            merged['columns'] = record['columns']
+
+
+def report():
+    wall, cpu = started
+    total = {'wall': round(time.perf_counter() - wall, 3), 'cpu': round(cpu_time() - cpu, 3),
+             'peak_rss_mb': peak_rss_mb()}
+    stage_records = [dict(record, wall=round(record['wall'], 3), cpu=round(record['cpu'], 3))
+                     for record in stages.values()]
+    try:
+        with open(report_file, 'w') as fp:
+            json.dump({'total': total, 'stages': stage_records}, fp, indent=2)
+    except OSError as exc:
+        helper.error("Cannot write profile report", report_file, ":", exc)
+
+    table = pd.DataFrame(stage_records + [{'source': 'total', 'wall': total['wall'], 'cpu': total['cpu'],
+                                           'peak_rss_mb': total['peak_rss_mb']}],
+                         columns=['source', 'stage', 'calls', 'wall', 'cpu', 'peak_rss_mb', 'rows', 'columns'])
+    for column in ['calls', 'rows', 'columns']:
+        table[column] = table[column].astype('Int64')
+    table.columns = ['Source', 'Stage', 'Calls', 'Wall (s)', 'CPU (s)', 'Peak RSS (MB)', 'Rows', 'Columns']
+    print(table.astype(object).fillna('').to_string(index=False), file=sys.stderr)
+    print("Profile report written to", report_file, file=sys.stderr)
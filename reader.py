@@ -0,0 +1,251 @@
+# local modules
+import cache
+import helper
+
+# other libraries
+import os
+import numpy as np
+import pandas as pd
+
+###############################
+#
+# READ SOURCE FILES
+#
+# Chooses the fastest pandas parser that can handle a source's config.yml settings and builds a dtype
+# schema from the source dictionary, so columns are not left to pandas' object-dtype inference:
+#  - category / onehot columns are read as categoricals
+#  - the variation-id join-group column is read as a (nullable) integer
+#  - other dictionary columns are read as strings
+# Columns flagged for mapping, expansion or continuous values keep pandas' type inference, because the
+# values in mapping.csv were generated from inferred types and expansion rewrites the column values.
+#
+###############################
+
+
+def data_file(sourcefile):
+    return str(os.path.join(sourcefile.get('path'), sourcefile.get('file')))
+
+
+def pyarrow_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def skip_rows(sourcefile):
+    return [r for r in helper.skip_array(sourcefile.get('skip_rows')) if r is not None]
+
+
+# choose the read_csv engine: pyarrow when the settings allow it, then the C parser, then the python parser
+def engine(sourcefile):
+    if helper.get_separator(sourcefile.get('delimiter')) is None:
+        # delimiter detection is only supported by the python parser
+        return 'python'
+    skip = skip_rows(sourcefile)
+    # pyarrow only skips a leading block of rows and does not support alternate quoting strategies
+    if pyarrow_available() and skip == list(range(len(skip))) and sourcefile.get('quoting') in (0, None):
+        return 'pyarrow'
+    return 'c'
+
+
+# the C or python parser, for reads the pyarrow engine does not support (nrows, chunksize, skiprows callables)
+def line_engine(sourcefile):
+    return 'python' if engine(sourcefile) == 'python' else 'c'
+
+
+# keyword arguments for pd.read_csv for the source and engine
+def read_options(sourcefile, read_engine):
+    options = {
+        'header': sourcefile.get('header_row'),
+        'sep': helper.get_separator(sourcefile.get('delimiter')),
+        'engine': read_engine,
+        'on_bad_lines': 'warn',
+    }
+    skip = skip_rows(sourcefile)
+    if read_engine == 'pyarrow':
+        options['skiprows'] = len(skip)
+    else:
+        options['skiprows'] = skip
+        options['quoting'] = sourcefile.get('quoting')
+    return options
+
+
+# the column headers exactly as they appear in the file (before stripping hashes)
+def header(sourcefile):
+    options = read_options(sourcefile, line_engine(sourcefile))
+    return pd.read_csv(data_file(sourcefile), nrows=0, **options).columns.tolist()
+
+
+# dictionary column name for a file column name
+def dictionary_column(sourcefile, file_column):
+    if sourcefile.get('strip_hash') == 1:
+        return file_column.strip(' #')
+    return file_column
+
+
+# dtype for each file column as configured in the source dictionary
+def schema(sourcefile, dic, file_columns=None):
+    if file_columns is None:
+        file_columns = header(sourcefile)
+    settings = {}
+    for i, r in dic.iterrows():
+        settings[r['column']] = r
+    dtypes = {}
+    for file_column in file_columns:
+        r = settings.get(dictionary_column(sourcefile, file_column))
+        if r is None:
+            continue
+        if r.get('map') is True or r.get('expand') is True or r.get('continuous') is True:
+            continue
+        if r.get('join-group') == 'variation-id':
+            dtypes[file_column] = 'Int64'
+        elif not pd.isna(r.get('format')):
+            dtypes[file_column] = str
+        elif r.get('category') is True or r.get('onehot') is True:
+            dtypes[file_column] = 'category'
+        else:
+            dtypes[file_column] = str
+    return dtypes
+
+
+# pyarrow (both the csv engine and Parquet) returns missing strings as None, while the C and python parsers
+# leave NaN; keep NaN so templates and outputs do not depend on how the file was read
+def missing_as_nan(df):
+    for column in df.columns:
+        if df[column].dtype == object:
+            df[column] = df[column].where(df[column].notna(), np.nan)
+    return df
+
+
+# read the source data file (or a buffer holding part of it) with the source settings
+def read_csv(sourcefile, read_engine=None, dtypes=None, source=None, **kwargs):
+    if read_engine is None:
+        read_engine = engine(sourcefile)
+    if source is None:
+        source = data_file(sourcefile)
+    options = read_options(sourcefile, read_engine)
+    options.update(kwargs)
+    helper.debug("Reading", data_file(sourcefile), "with", read_engine, "engine")
+    try:
+        if read_engine != 'pyarrow':
+            return pd.read_csv(source, dtype=dtypes, **options)
+        # pyarrow turns missing values into the text 'None' when reading as str, so convert those columns after
+        string_columns = [column for column, dtype in (dtypes or {}).items() if dtype is str]
+        native_dtypes = {column: dtype for column, dtype in (dtypes or {}).items() if dtype is not str}
+        df = missing_as_nan(pd.read_csv(source, dtype=native_dtypes or None, **options))
+        for column in string_columns:
+            if column in df.columns:
+                df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+        return df
+    except (ValueError, TypeError) as exc:
+        if read_engine == 'pyarrow':
+            helper.warning("pyarrow could not parse", sourcefile.get('name'), ":", exc, "; using C parser")
+            if hasattr(source, 'seek'):
+                source.seek(0)
+            return read_csv(sourcefile, 'c', dtypes, source, **kwargs)
+        if dtypes:
+            # a value did not fit the dictionary schema (e.g. a non-numeric variation id)
+            helper.warning("Schema does not fit", sourcefile.get('name'), ":", exc, "; reading with inferred types")
+            if hasattr(source, 'seek'):
+                source.seek(0)
+            return read_csv(sourcefile, read_engine, None, source, **kwargs)
+        raise
+
+
+# row filters for the --variant and --gene options: a (file column, values, split) tuple for each variation-id or
+# gene-symbol join-group column; split columns are expanded later on, so they match any item of their value list
+def row_filters(sourcefile, dic, variant=None, gene=None, expand=False):
+    groups = []
+    if variant:
+        groups.append(('variation-id', [int(v) for v in variant.split(',')]))
+    if gene:
+        groups.append(('gene-symbol', gene.split(',')))
+    filters = []
+    for file_column in header(sourcefile):
+        column = dictionary_column(sourcefile, file_column)
+        for group, values in groups:
+            dic_filter_df = dic.loc[(dic['column'] == column) & (dic['join-group'] == group)]
+            if len(dic_filter_df) > 0:
+                split = expand and bool((dic_filter_df['expand'] == True).any())
+                filters.append((file_column, values, split))
+    return filters
+
+
+# rows that can match the row filters (a superset of the rows kept by the --variant / --gene filters)
+def matches(df, filters):
+    mask = np.ones(len(df), dtype=bool)
+    for file_column, values, split in filters:
+        column = df[file_column]
+        if split:
+            mask &= column.astype(str).str.contains(helper.list_pattern(values), regex=True).to_numpy(dtype=bool)
+        elif all(isinstance(v, int) for v in values):
+            mask &= pd.to_numeric(column, errors='coerce').isin(values).to_numpy(dtype=bool)
+        else:
+            mask &= column.isin(values).to_numpy(dtype=bool)
+    return mask
+
+
+# record numbers (as counted by the parser's skiprows) of the data rows at the given positions
+def records(sourcefile, positions):
+    header_row = sourcefile.get('header_row')
+    r = positions + (header_row + 1 if header_row is not None else 0)
+    for s in sorted(skip_rows(sourcefile)):
+        r = r + (s <= r)
+    return r
+
+
+# read only the rows that can match the row filters: scan just the filter columns, then parse only the matching
+# records (the C and python parsers skip the other lines without splitting them into fields);
+# returns None when the scan does not line up with the file (e.g. malformed lines), so the caller reads all rows
+def read_matching(sourcefile, dtypes, filters, **kwargs):
+    filter_columns = [file_column for file_column, values, split in filters]
+    scan_dtypes = {column: dtype for column, dtype in (dtypes or {}).items() if column in filter_columns}
+    scan = read_csv(sourcefile, dtypes=scan_dtypes, usecols=filter_columns, skip_blank_lines=False)
+    positions = np.flatnonzero(matches(scan, filters))
+    helper.debug("Found", len(positions), "matching rows of", len(scan), "in", sourcefile.get('name'))
+    del scan
+
+    read_engine = line_engine(sourcefile)
+    if len(positions) == 0:
+        return read_csv(sourcefile, read_engine, dtypes, nrows=0, **kwargs)
+    keep = set(records(sourcefile, positions).tolist())
+    first = records(sourcefile, np.array([0]))[0]
+    skip = set(skip_rows(sourcefile))
+    df = read_csv(sourcefile, read_engine, dtypes, skiprows=lambda i: i in skip or (i >= first and i not in keep),
+                  nrows=len(positions), **kwargs)
+    if len(df) != len(positions) or not matches(df, filters).all():
+        helper.warning("Row scan does not line up with", data_file(sourcefile), "; reading all rows")
+        return None
+    return df
+
+
+# read the source (or only the given file columns), using the columnar cache when enabled and current; with row
+# filters, only rows that can match the filters are read when possible (rows are always filtered exactly afterwards)
+def read(sourcefile, dic, use_cache=True, filters=None, columns=None):
+    file_name = data_file(sourcefile)
+    dtypes = schema(sourcefile, dic)
+    read_dtypes = dtypes
+    if columns is not None:
+        read_dtypes = {column: dtype for column, dtype in dtypes.items() if column in columns}
+    building = use_cache and pyarrow_available()
+    df = None
+    if use_cache:
+        df = cache.read(sourcefile, file_name, dtypes, columns, filters=filters)
+        if df is not None:
+            df = missing_as_nan(df)
+    if df is None and filters and not building:
+        # the cache will not be built, so only parse the matching rows
+        df = read_matching(sourcefile, read_dtypes, filters, usecols=columns)
+    elif df is None and building:
+        # the cache holds all columns
+        df = read_csv(sourcefile, dtypes=dtypes)
+        cache.write(sourcefile, file_name, df, dtypes)
+        if columns is not None:
+            df = df.loc[:, columns]
+    elif df is None:
+        df = read_csv(sourcefile, dtypes=read_dtypes, usecols=columns)
+    if df is None:
+        df = read_csv(sourcefile, dtypes=read_dtypes, usecols=columns)
+    return df
@@ -0,0 +1,154 @@
+# local modules
+import helper
+import kb
+
+# other libraries
+import io
+import json
+import os
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import pandas as pd
+
+###############################
+#
+# QUERY SERVICE
+#
+# --serve processes the sources once, keeps them in memory with an index of the rows holding each value of their
+# join-group columns, and answers variant and gene queries over HTTP, on a local TCP port or a Unix socket, until
+# it is stopped:
+#
+#   GET /lookup?variant=12345,67890             joined rows as CSV
+#   GET /lookup?gene=BRCA1&format=json          {"rows": [joined rows], "text": template text}
+#   GET /lookup?variant=12345&format=text       template text, as in --template-output
+#
+# A query joins the rows of the variants or genes as --lookup does from a knowledge base (see kb.py). Each
+# request is answered in a thread of its own.
+#
+###############################
+
+UNIX_PREFIX = 'unix:'
+DEFAULT_HOST = 'localhost'
+FORMATS = {'csv': 'text/csv', 'json': 'application/json', 'text': 'text/plain'}
+
+
+# the rows holding each value of the columns, and the rows with a missing value
+def key_index(df, columns):
+    index = {}
+    for column in columns:
+        values = df[column]
+        index[column] = (values.groupby(values, sort=False).indices, np.flatnonzero(values.isna()))
+    return index
+
+
+# the rows of a source, in source order, holding one of the values in each of the (column, values) conditions;
+# missing values match each other, as in pd.merge
+def read_rows(df, index, conditions):
+    positions = None
+    for column, values in conditions:
+        rows_of_value, missing_rows = index[column]
+        values = pd.Series(values)
+        found = [rows_of_value[value] for value in values.dropna().unique() if value in rows_of_value]
+        if values.isna().any():
+            found.append(missing_rows)
+        rows = np.unique(np.concatenate(found)) if len(found) > 0 else np.zeros(0, dtype=np.intp)
+        positions = rows if positions is None else np.intersect1d(positions, rows)
+    if positions is None:
+        return df
+    return df.iloc[positions].reset_index(drop=True)
+
+
+# the processed sources, how they join and the index of their join-group columns
+def load(data, dictionary, sources, suffixes):
+    columns = {s: list(data[s].columns) for s in sources}
+    settings = kb.join_settings(dictionary, sources, suffixes, columns)
+    indexes = {s: key_index(data[s], [c['column'] for c in settings['join-columns'] if c['name'] == s])
+               for s in sources}
+    helper.info("Indexed the join-group columns of", len(sources), "sources")
+    return {'data': data, 'settings': settings, 'columns': columns, 'indexes': indexes}
+
+
+# the response body for the query parameters in the format asked for; raises ValueError for a bad query
+def respond(service, params, args):
+    variant = params.get('variant')
+    gene = params.get('gene')
+    response_format = params.get('format', 'csv')
+    if not (variant or gene):
+        raise ValueError("specify variant and / or gene")
+    if response_format not in FORMATS:
+        raise ValueError("format must be one of " + ", ".join(FORMATS))
+
+    def read_source(s, conditions):
+        return read_rows(service['data'][s], service['indexes'][s], conditions)
+
+    joined, data = kb.join_rows(service['settings'], service['columns'], read_source, variant, gene)
+    if response_format == 'csv':
+        return kb.output_rows(joined, args).to_csv(index=False)
+    text = io.StringIO()
+    kb.write_text(text, data)
+    if response_format == 'text':
+        return text.getvalue()
+    rows = kb.output_rows(joined, args).to_json(orient='records')
+    return '{"rows": ' + rows + ', "text": ' + json.dumps(text.getvalue()) + '}'
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/lookup':
+            self.send_error(404, "Use /lookup?variant=<ids> or /lookup?gene=<symbols>")
+            return
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            body = respond(self.server.service, params, self.server.args)
+        except ValueError as exc:
+            # a bad query, or one the join planner rejects (joins.JoinError)
+            self.send_error(400, str(exc))
+            return
+        except (Exception, SystemExit) as exc:
+            # keep serving, and answer instead of dropping the connection
+            helper.error("Query", self.path, "failed:", repr(exc))
+            self.send_error(500, "Query failed: " + repr(exc))
+            return
+        content = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', FORMATS[params.get('format', 'csv')] + '; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    # Unix socket clients have no address to log
+    def log_message(self, format, *arguments):
+        helper.debug("Query:", format % arguments)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+# answer queries on --serve ([host:]port or unix:<socket path>) until interrupted
+def serve(data, dictionary, sources, suffixes, args):
+    service = load(data, dictionary, sources, suffixes)
+    socket_path = None
+    if args.serve.startswith(UNIX_PREFIX):
+        socket_path = args.serve[len(UNIX_PREFIX):]
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        httpd = UnixHTTPServer(socket_path, QueryHandler)
+    else:
+        host, separator, port = args.serve.rpartition(':')
+        httpd = ThreadingHTTPServer((host or DEFAULT_HOST, int(port)), QueryHandler)
+    httpd.service = service
+    httpd.args = args
+    helper.info("Serving lookups of", sources, "on", args.serve)
+    print("Serving lookups on", args.serve, "; press Ctrl-C to stop.")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        if socket_path is not None:
+            os.remove(socket_path)
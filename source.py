@@ -1,9 +1,28 @@
 import helper
-import yaml
+import io
+import json
 import os
 import pandas as pd
 
+###############################
+#
+# SOURCE REGISTRY
+#
+# The config.yml and dictionary.csv of every source are compiled into a JSON registry file in the sources directory,
+# so later runs load them from there instead of parsing the YAML and CSV files again. A source is read again from
+# its files when the modification time of its config.yml or dictionary.csv changes. The dictionaries are kept in
+# the pandas table format of JSON, which restores the same dtypes as reading the CSV file.
+#
+###############################
+
+REGISTRY_FILE = '.registry.json'
+REGISTRY_VERSION = 2
+CONFIG_FILE = 'config.yml'
+DICTIONARY_FILE = 'dictionary.csv'
+
 sources = []
+registry = {'version': REGISTRY_VERSION, 'sources': {}}
+registry_path = None
 
 
 def count():
@@ -23,65 +42,136 @@ def source_list():
 
 
 def df():
-    dataframe = pd.DataFrame(columns=['name', 'suffix', 'path', 'url', 'download_file', 'file', 'gzip', 'header_row',
+    dataframe = pd.DataFrame([[s.name, s.suffix, s.path, s.url, s.download_file,
+                               s.file, s.gzip, s.header_row,
+                               s.skip_rows, s.delimiter, s.quoting,
+                               s.strip_hash, s.md5_url, s.md5_file,
+                               s.template, s.dictionary, s.mapping] for s in sources],
+                             columns=['name', 'suffix', 'path', 'url', 'download_file', 'file', 'gzip', 'header_row',
                                       'skip_rows', 'delimiter', 'quoting', 'strip_hash', 'md5_url', 'md5_file',
                                       'template', 'dictionary', 'mapping'])
-    for s in sources:
-        dataframe.loc[len(dataframe)] = [
-            s.name, s.suffix, s.path, s.url, s.download_file,
-            s.file, s.gzip, s.header_row,
-            s.skip_rows, s.delimiter, s.quoting,
-            s.strip_hash, s.md5_url, s.md5_file,
-            s.template, s.dictionary, s.mapping
-        ]
 
     dataframe.set_index('name')
     return dataframe
 
 
+def modified(file_name):
+    try:
+        return os.stat(file_name).st_mtime_ns
+    except OSError:
+        return None
+
+
+def load_registry(sources_path):
+    global registry, registry_path
+    registry_path = str(os.path.join(sources_path, REGISTRY_FILE))
+    try:
+        with open(registry_path, 'r') as fp:
+            saved = json.load(fp)
+        if isinstance(saved, dict) and saved.get('version') == REGISTRY_VERSION:
+            registry = saved
+    except (OSError, ValueError):
+        helper.debug("No source registry in", sources_path)
+
+
+def save_registry():
+    # runs started at the same time each write a file of their own
+    part_path = registry_path + '.' + str(os.getpid()) + '.part'
+    try:
+        with open(part_path, 'w') as fp:
+            json.dump(registry, fp)
+        os.replace(part_path, registry_path)
+    except OSError as exc:
+        helper.warning("Cannot save source registry", registry_path, ":", exc)
+
+
+# a config.yml with values JSON cannot hold (e.g. YAML dates) is read from its file on every run
+def json_safe(config):
+    try:
+        return json.loads(json.dumps(config)) == config
+    except (TypeError, ValueError):
+        return False
+
+
+# the (top level) source directories with a config.yml
+def source_directories(sources_path):
+    with os.scandir(sources_path) as entries:
+        return [entry.name for entry in entries
+                if entry.is_dir() and os.path.isfile(os.path.join(entry.path, CONFIG_FILE))]
+
+
 def load(sources_path, selected_sources):
-    for root, dirs, files in os.walk(sources_path):
-        for f in files:
-            if f == 'config.yml':
-                name = os.path.basename(root)
-                if (name in selected_sources) or (len(selected_sources) == 0):
-                    file = str(os.path.join(sources_path, os.path.basename(root), f))
-                    Source(file)
-                    helper.debug(file)
+    load_registry(sources_path)
+    changed = False
+    for name in source_directories(sources_path):
+        if (name in selected_sources) or (len(selected_sources) == 0):
+            file = str(os.path.join(sources_path, name, CONFIG_FILE))
+            entry = registry['sources'].get(file)
+            if entry is None or entry['modified'] != modified(file):
+                entry = {'modified': modified(file), 'config': read_config(file)}
+                if json_safe(entry['config']):
+                    registry['sources'][file] = entry
+                    changed = True
+            Source(file, entry['config'])
+            helper.debug(file)
+    if changed:
+        save_registry()
+
+
+def read_config(configfile):
+    # yaml is only needed when a config.yml is new or changed
+    import yaml
+
+    with (open(configfile, "r") as stream):
+        try:
+            config = yaml.safe_load(stream)[0]
+            helper.debug("config:", str(configfile))
+            helper.debug(config)
+            return config
+        except yaml.YAMLError as exc:
+            helper.critical(exc)
+            exit(-1)
+
+
+# the dictionary of the source, from the registry when the dictionary.csv did not change since
+def dictionary(sourcefile):
+    dictionary_file = str(os.path.join(sourcefile.get('path'), sourcefile.get('dictionary')))
+    config_file = str(os.path.join(sourcefile.get('path'), CONFIG_FILE))
+    entry = registry['sources'].get(config_file)
+    if entry is None:
+        return pd.read_csv(dictionary_file)
+    if entry.get('dictionary_modified') != modified(dictionary_file) or 'dictionary' not in entry:
+        dic = pd.read_csv(dictionary_file)
+        entry['dictionary'] = dic.to_json(orient='table', index=False)
+        entry['dictionary_modified'] = modified(dictionary_file)
+        save_registry()
+        return dic
+    return pd.read_json(io.StringIO(entry['dictionary']), orient='table')
 
 
 class Source:
 
     # keep a list of sources
-    def __init__(self, configfile):
+    def __init__(self, configfile, config):
         path = configfile.replace('config.yml', '')[:-1]  # path is everything but trailing /config.yml
-        with (open(configfile, "r") as stream):
-            try:
-                config = yaml.safe_load(stream)[0]
-                helper.debug("config:", str(configfile))
-                helper.debug(config)
-                # add to config dataframe
-                self.name = config.get('name')
-                self.suffix = config.get('suffix')
-                self.path = path
-                self.url = config.get('url')
-                self.download_file = config.get('download_file')
-                self.file = config.get('file')
-                self.gzip = config.get('gzip')
-                self.header_row = config.get('header_row')
-                self.skip_rows = config.get('skip_rows')
-                self.delimiter = config.get('delimiter')
-                self.quoting = config.get('quoting')
-                self.strip_hash = config.get('strip_hash')
-                self.md5_url = config.get('md5_url')
-                self.md5_file = config.get('md5_file')
-                self.template = config.get('template')
-                self.dictionary = 'dictionary.csv'
-                self.mapping = 'mapping.csv'
-
-            except yaml.YAMLError as exc:
-                helper.critical(exc)
-                exit(-1)
+        # add to config dataframe
+        self.name = config.get('name')
+        self.suffix = config.get('suffix')
+        self.path = path
+        self.url = config.get('url')
+        self.download_file = config.get('download_file')
+        self.file = config.get('file')
+        self.gzip = config.get('gzip')
+        self.header_row = config.get('header_row')
+        self.skip_rows = config.get('skip_rows')
+        self.delimiter = config.get('delimiter')
+        self.quoting = config.get('quoting')
+        self.strip_hash = config.get('strip_hash')
+        self.md5_url = config.get('md5_url')
+        self.md5_file = config.get('md5_file')
+        self.template = config.get('template')
+        self.dictionary = DICTIONARY_FILE
+        self.mapping = 'mapping.csv'
 
         # add new source to the shared class list
         sources.append(self)
@@ -0,0 +1,159 @@
+# local modules
+import helper
+import joins
+import output
+
+# other libraries
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+
+###############################
+#
+# OUT-OF-CORE JOIN
+#
+# With --join-engine=sqlite the processed sources are not kept in memory for the joined output. Each source
+# (or each chunk of it, with --chunksize) is loaded into a table of an SQLite database file next to the
+# --joined-output file as soon as it is processed. The joins of joins.plan then run as a single query, with
+# SQLite spilling to disk as needed, and the joined rows are streamed from the query to the output file in
+# batches. Rows come out in the same order and with the same columns as the in-memory (pandas) join.
+#
+###############################
+
+SCHEMA_TABLE = '__schema'
+FETCH_ROWS = 100000
+# seconds to wait for another worker (--jobs) loading a source into the database
+LOCK_TIMEOUT = 600
+
+
+def database_file(args):
+    if args.build_kb is not None:
+        # the knowledge base is built in a file of its own (see kb.py)
+        return args.build_kb + '.part'
+    return args.output + '.sqlite'
+
+
+def quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def connect(file_name):
+    connection = sqlite3.connect(file_name, timeout=LOCK_TIMEOUT)
+    # the database is rebuilt on every run, so no journal; sort and join temporaries go to disk
+    connection.execute("PRAGMA journal_mode = OFF")
+    connection.execute("PRAGMA synchronous = OFF")
+    connection.execute("PRAGMA temp_store = FILE")
+    return connection
+
+
+# start a new database for the run
+def create(args):
+    if os.path.exists(database_file(args)):
+        os.remove(database_file(args))
+    with connect(database_file(args)) as connection:
+        connection.execute("CREATE TABLE " + SCHEMA_TABLE + " (source TEXT, name TEXT, dtype TEXT, position INTEGER)")
+    helper.info("Loading processed sources into", database_file(args))
+
+
+# load the processed rows of a source into its table; append=True adds the rows of a later chunk
+def load(args, sourcename, df, append=False):
+    # SQLite has no sparse columns
+    sparse_columns = output.sparse_columns(df)
+    if len(sparse_columns) > 0:
+        df = df.astype({column: df[column].dtype.subtype for column in sparse_columns})
+    connection = connect(database_file(args))
+    try:
+        with connection:
+            if not append:
+                connection.execute("DELETE FROM " + SCHEMA_TABLE + " WHERE source = ?", (sourcename,))
+                connection.executemany("INSERT INTO " + SCHEMA_TABLE + " VALUES (?, ?, ?, ?)",
+                                       [(sourcename, column, str(dtype), i)
+                                        for i, (column, dtype) in enumerate(df.dtypes.items())])
+            df.to_sql(sourcename, connection, if_exists='append' if append else 'replace', index=False)
+    finally:
+        connection.close()
+    helper.debug("Loaded", len(df), "rows of", sourcename, "into", database_file(args))
+
+
+def schema(connection, sources):
+    rows = connection.execute("SELECT source, name, dtype FROM " + SCHEMA_TABLE + " ORDER BY source, position")
+    columns = {s: {} for s in sources}
+    for source, name, dtype in rows:
+        if source in columns:
+            columns[source][name] = dtype
+    return columns
+
+
+# the dtypes of the joined columns as the pandas join gives them: integer and boolean columns of a source that
+# has rows without a match take missing values
+def restore(df, dtypes, unmatched):
+    for name, (dtype, source) in dtypes.items():
+        if dtype == 'bool':
+            if unmatched[source]:
+                df[name] = df[name].map({1: True, 0: False}).astype(object)
+            else:
+                df[name] = df[name].astype(bool)
+        elif dtype.startswith('int') or dtype.startswith('uint'):
+            df[name] = df[name].astype('float64' if unmatched[source] else dtype)
+        elif dtype in ('Int64', 'float64'):
+            df[name] = df[name].astype(dtype)
+    return df
+
+
+# join the sources loaded into the database as joins.plan picks, streaming the joined rows to the output file
+def join(dictionary, sources, suffixes, args):
+    connection = connect(database_file(args))
+    columns = schema(connection, sources)
+    steps = joins.plan(sources, dictionary)
+    names, owners = joins.output_columns({s: list(columns[s]) for s in sources}, sources, steps, suffixes)
+    alias = {s: 't' + str(i) for i, s in enumerate(sources)}
+
+    # index the join column of each source so the joins are lookups
+    for step in steps:
+        connection.execute("CREATE INDEX IF NOT EXISTS " + quote('__index-' + step['source']) + " ON " +
+                           quote(step['source']) + " (" + quote(step['right']) + ")")
+
+    select = [alias[s] + "." + quote(column) + " AS " + quote(name)
+              for s in sources for column, name in names[s].items()]
+    # whether a source has rows without a match, over all the joined rows
+    select = select + ["MAX(" + alias[step['source']] + ".rowid IS NULL) OVER ()" for step in steps]
+    query = "SELECT " + ", ".join(select) + " FROM " + quote(sources[0]) + " " + alias[sources[0]]
+    for step in steps:
+        s = step['source']
+        # IS matches missing keys to each other, as pd.merge does
+        query = query + " LEFT JOIN " + quote(s) + " " + alias[s] + " ON " + alias[s] + "." + quote(step['right']) + \
+            " IS " + alias[owners[step['left']]] + "." + quote(step['left'])
+    # rows in the order of the sequential join in --sources order
+    query = query + " ORDER BY " + ", ".join(alias[s] + ".rowid" for s in sources)
+    helper.debug("Join query:", query)
+
+    output_names = [name for s in sources for name in names[s].values()]
+    dtypes = {names[s][column]: (dtype, s) for s in sources for column, dtype in columns[s].items()
+              if column in names[s]}
+    helper.info("Generating output", args.output)
+    cursor = connection.execute(query)
+    written = 0
+    while True:
+        rows = cursor.fetchmany(FETCH_ROWS)
+        if len(rows) == 0 and written > 0:
+            break
+        values = np.array(rows, dtype=object).reshape(len(rows), len(select))
+        unmatched = {sources[0]: False}
+        for i, step in enumerate(steps):
+            unmatched[step['source']] = len(rows) > 0 and bool(values[0, len(output_names) + i])
+        out_df = pd.DataFrame(values[:, :len(output_names)], columns=output_names)
+        out_df = restore(out_df.infer_objects(), dtypes, unmatched)
+
+        # fill in any Nan values after merging dataframes
+        if args.na_value is not None:
+            helper.fillna(out_df, args.na_value)
+        out_df = output.select_columns(out_df, args.columns)
+        output.write_frame(out_df, args.output, args, append=written > 0, more=True)
+        written = written + len(rows)
+        if len(rows) == 0:
+            break
+    output.close(args.output)
+    connection.close()
+    helper.info("Joined", written, "rows into", args.output)
+    os.remove(database_file(args))
@@ -0,0 +1,263 @@
+# other libraries
+import os
+import subprocess
+import sys
+import pandas as pd
+import pytest
+
+# the modules of the program are flat scripts in the repository root
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY)
+
+import arguments  # noqa: E402
+import source  # noqa: E402
+
+#########################
+#
+# FIXTURE SOURCES
+#
+# Three small sources shaped like the real ones, written to a sources directory under tmp_path:
+#  - variant-summary: ClinVar variant_summary rows (two assemblies per VariationID, gene lists to --expand,
+#    "-" and off-format dates, a clinical significance without a mapping)
+#  - submission-summary: ClinVar submission_summary rows behind comment lines, several submissions per variant
+#    and some for variants not in variant-summary
+#  - gene-dosage: ClinGen gene dosage rows (comma separated, with a separator line after the header)
+# Joined in that order, submission-summary joins on variation-id and gene-dosage on gene-symbol.
+#
+#########################
+
+JOINED_SOURCES = 'variant-summary,submission-summary,gene-dosage'
+DICTIONARY_COLUMNS = ['column', 'comment', 'join-group', 'onehot', 'category', 'continuous', 'format', 'map', 'days',
+                      'age', 'expand', 'na-value']
+
+TYPES = ['single nucleotide variant', 'Deletion', 'Duplication', 'Indel', 'copy number gain']
+GENES = ['BRCA1', 'BRCA2', 'TP53', 'MLH1', 'BRCA1,NBR2', 'PMS2', 'EGFR', 'TP53,WRAP53', 'LDLR']
+SIGNIFICANCES = ['Pathogenic', 'Likely benign', 'Uncertain significance', 'Benign', 'Pathogenic/Likely pathogenic',
+                 'not provided']
+REVIEW_STATUSES = ['criteria provided, single submitter', 'reviewed by expert panel', 'no assertion criteria provided']
+DATES = ['Mar 23, 2023', 'Jan 05, 2019', '-', 'Dec 31, 2020', '2021-06-18', 'Jul 04, 2015']
+CHROMOSOMES = ['17', '13', 'X', '3', 'MT']
+SUBMITTERS = ['GeneDx', 'Invitae', 'Ambry Genetics', 'OMIM', 'Counsyl']
+DOSAGE_GENES = ['BRCA1', 'BRCA2', 'TP53', 'MLH1', 'PMS2', 'NBR2', 'WRAP53', 'EGFR', 'MSH2', 'APOB']
+HAPLOINSUFFICIENCY = ['Sufficient Evidence for Haploinsufficiency', 'No Evidence for Haploinsufficiency',
+                      'Little Evidence for Haploinsufficiency', 'Dosage Sensitivity Unlikely']
+TRIPLOSENSITIVITY = ['No Evidence for Triplosensitivity', 'Little Evidence for Triplosensitivity']
+
+
+def variant_rows(count=36):
+    rows = []
+    for i in range(count):
+        genes = GENES[i % len(GENES)]
+        rows.append([15000 + i, TYPES[i % len(TYPES)],
+                     'NM_007294.4(' + genes.split(',')[0] + '):c.' + str(100 + i) + 'A>G',
+                     genes, SIGNIFICANCES[i % len(SIGNIFICANCES)], DATES[i % len(DATES)],
+                     REVIEW_STATUSES[i % len(REVIEW_STATUSES)], 1 + i % 4, 'GRCh38' if i % 2 else 'GRCh37',
+                     CHROMOSOMES[(i // 2) % len(CHROMOSOMES)], 1000 + i // 2])
+    return pd.DataFrame(rows, columns=['#AlleleID', 'Type', 'Name', 'GeneSymbol', 'ClinicalSignificance',
+                                       'LastEvaluated', 'ReviewStatus', 'NumberSubmitters', 'Assembly', 'Chromosome',
+                                       'VariationID'])
+
+
+def submission_rows(count=40):
+    rows = []
+    for i in range(count):
+        rows.append([1000 + (i * 5) % 21, SIGNIFICANCES[i % 5], DATES[(i + 1) % len(DATES)],
+                     'Observed in "' + str(i % 3 + 1) + '" families' if i % 4 else '-',
+                     SUBMITTERS[i % len(SUBMITTERS)], 'SCV000' + str(200000 + i) + '.1',
+                     GENES[i % len(GENES)].split(',')[0] if i % 6 else '-', REVIEW_STATUSES[i % 3],
+                     'clinical testing' if i % 3 else 'literature only'])
+    return pd.DataFrame(rows, columns=['#VariationID', 'ClinicalSignificance', 'DateLastEvaluated', 'Description',
+                                       'Submitter', 'SCV', 'SubmittedGeneSymbol', 'ReviewStatus', 'CollectionMethod'])
+
+
+def dosage_rows():
+    rows = []
+    for i, gene in enumerate(DOSAGE_GENES):
+        rows.append([gene, 'HGNC:' + str(1100 + i), HAPLOINSUFFICIENCY[i % len(HAPLOINSUFFICIENCY)],
+                     TRIPLOSENSITIVITY[i % len(TRIPLOSENSITIVITY)],
+                     'https://search.clinicalgenome.org/kb/gene-dosage/HGNC:' + str(1100 + i),
+                     '20' + str(10 + i) + '-0' + str(1 + i % 9) + '-1' + str(i % 10) + 'T14:14:30Z'])
+    return pd.DataFrame(rows, columns=['GENE SYMBOL', 'HGNC ID', 'HAPLOINSUFFICIENCY', 'TRIPLOSENSITIVITY',
+                                       'ONLINE REPORT', 'DATE'])
+
+
+# dictionary.csv rows: column -> (join-group, onehot, category, continuous, format, map, days/age, expand)
+def dictionary_rows(settings):
+    rows = []
+    for column, (join_group, onehot, category, continuous, date_format, mapped, expand) in settings.items():
+        rows.append([column, 'The ' + column + ' of the row.', join_group, onehot, category, continuous, date_format,
+                     mapped, date_format is not None, date_format is not None, expand, None])
+    return pd.DataFrame(rows, columns=DICTIONARY_COLUMNS)
+
+
+VARIANT_DICTIONARY = {
+    'AlleleID': (None, False, False, True, None, False, False),
+    'Type': (None, True, True, False, None, False, False),
+    'Name': (None, False, False, False, None, False, False),
+    'GeneSymbol': ('gene-symbol', False, False, False, None, False, True),
+    'ClinicalSignificance': (None, False, True, False, None, True, False),
+    'LastEvaluated': (None, False, False, False, '%b %d, %Y', False, False),
+    'ReviewStatus': (None, False, False, False, None, True, False),
+    'NumberSubmitters': (None, False, False, False, None, False, False),
+    'Assembly': (None, False, False, False, None, False, False),
+    'Chromosome': (None, True, True, False, None, False, False),
+    'VariationID': ('variation-id', False, False, True, None, False, False),
+}
+SUBMISSION_DICTIONARY = {
+    'VariationID': ('variation-id', False, False, False, None, False, False),
+    'ClinicalSignificance': (None, True, True, False, None, False, False),
+    'DateLastEvaluated': (None, False, False, False, '%b %d, %Y', False, False),
+    'Description': (None, False, False, False, None, False, False),
+    'Submitter': (None, False, True, False, None, False, False),
+    'SCV': (None, False, False, False, None, False, False),
+    'SubmittedGeneSymbol': ('gene-symbol', False, True, False, None, False, False),
+    'ReviewStatus': (None, True, True, False, None, False, False),
+    'CollectionMethod': (None, True, True, False, None, False, False),
+}
+DOSAGE_DICTIONARY = {
+    'GENE SYMBOL': ('gene-symbol', False, False, False, None, False, False),
+    'HGNC ID': ('hgnc-id', False, False, False, None, False, False),
+    'HAPLOINSUFFICIENCY': (None, True, True, False, None, True, False),
+    'TRIPLOSENSITIVITY': (None, True, True, False, None, False, False),
+    'ONLINE REPORT': (None, False, False, False, None, False, False),
+    'DATE': (None, False, False, False, '%Y-%m-%dT%H:%M:%SZ', False, False),
+}
+
+VARIANT_MAPPING = [
+    ['ClinicalSignificance', 'Pathogenic', 'clin-sig-confidence-rank', 0.99],
+    ['ClinicalSignificance', 'Likely benign', 'clin-sig-confidence-rank', 0.1],
+    ['ClinicalSignificance', 'Uncertain significance', 'clin-sig-confidence-rank', 0.5],
+    ['ClinicalSignificance', 'Benign', 'clin-sig-confidence-rank', 0.01],
+    ['ClinicalSignificance', 'Pathogenic/Likely pathogenic', 'clin-sig-confidence-rank', 0.95],
+    ['ClinicalSignificance', 'Pathogenic', 'clin-sig-simple', 1],
+    ['ClinicalSignificance', 'Likely benign', 'clin-sig-simple', 0],
+    ['ClinicalSignificance', 'Uncertain significance', 'clin-sig-simple', 0],
+    ['ClinicalSignificance', 'Benign', 'clin-sig-simple', 0],
+    ['ClinicalSignificance', 'Pathogenic/Likely pathogenic', 'clin-sig-simple', 1],
+    ['ReviewStatus', 'criteria provided, single submitter', 'review-stars', 1],
+    ['ReviewStatus', 'reviewed by expert panel', 'review-stars', 3],
+    ['ReviewStatus', 'no assertion criteria provided', 'review-stars', 0],
+]
+DOSAGE_MAPPING = [
+    ['HAPLOINSUFFICIENCY', 'Sufficient Evidence for Haploinsufficiency', 'haplo-insuff-rank', 0.99],
+    ['HAPLOINSUFFICIENCY', 'No Evidence for Haploinsufficiency', 'haplo-insuff-rank', 0.5],
+    ['HAPLOINSUFFICIENCY', 'Little Evidence for Haploinsufficiency', 'haplo-insuff-rank', 0.75],
+    ['HAPLOINSUFFICIENCY', 'Dosage Sensitivity Unlikely', 'haplo-insuff-rank', 0.01],
+]
+
+VARIANT_CONFIG = """--- # ClinVar Variant Summary (test fixture)
+- name: variant-summary
+  suffix: cvvar
+  url: http://127.0.0.1:9/variant_summary.txt.gz
+  file: variant_summary.txt
+  header_row: 0
+  skip_rows: None
+  delimiter: tab
+  quoting: 0
+  strip_hash: 1
+  md5_url:
+  md5_file:
+  template: >
+    The ${dict.Name} variant (Variation ID ${dict.VariationID}) in ${dict.GeneSymbol} has a clinical significance
+    of ${dict.ClinicalSignificance}, last evaluated on ${dict.LastEvaluated}.
+"""
+SUBMISSION_CONFIG = """--- # ClinVar Submission Summary (test fixture)
+- name: submission-summary
+  suffix: cvsub
+  url: http://127.0.0.1:9/submission_summary.txt.gz
+  file: submission_summary.txt
+  header_row: 0
+  skip_rows: 0,1,2,3
+  delimiter: tab
+  quoting: 3
+  strip_hash: 1
+  md5_url:
+  md5_file:
+  template: >
+    ${dict.Submitter} has classified the variant with ClinVar Variation ID ${dict.VariationID} as
+    ${dict.ClinicalSignificance} (${dict.SCV}).
+"""
+DOSAGE_CONFIG = """--- # ClinGen Gene Dosage Sensitivity (test fixture)
+- name: gene-dosage
+  suffix: cgdose
+  url: http://127.0.0.1:9/gene-dosage/download
+  file: gene-dosage-sensitivity.csv
+  header_row: 0
+  skip_rows: 0,1,2,3,5
+  delimiter: comma
+  quoting: 0
+  strip_hash: 0
+  md5_url:
+  md5_file:
+  template: >
+    ClinGen's assessment of the ${dict['GENE SYMBOL']} gene indicates a haploinsufficiency assertion of
+    "${dict.HAPLOINSUFFICIENCY}".
+"""
+
+
+def write_source(directory, config, dic, mapping):
+    os.makedirs(directory)
+    with open(os.path.join(directory, 'config.yml'), 'w') as fp:
+        fp.write(config)
+    dictionary_rows(dic).to_csv(os.path.join(directory, 'dictionary.csv'), index=False)
+    mapping_df = pd.DataFrame(mapping, columns=['column', 'value', 'map-name', 'map-value'])
+    mapping_df.insert(2, 'frequency', 1)
+    mapping_df.to_csv(os.path.join(directory, 'mapping.csv'), index=False)
+
+
+def write_sources(sources_path):
+    directory = os.path.join(sources_path, 'variant-summary')
+    write_source(directory, VARIANT_CONFIG, VARIANT_DICTIONARY, VARIANT_MAPPING)
+    variant_rows().to_csv(os.path.join(directory, 'variant_summary.txt'), sep='\t', index=False)
+
+    directory = os.path.join(sources_path, 'submission-summary')
+    write_source(directory, SUBMISSION_CONFIG, SUBMISSION_DICTIONARY, [])
+    with open(os.path.join(directory, 'submission_summary.txt'), 'w') as fp:
+        fp.write('##Overview of interpretation, phenotypes, observations, and methods reported in each current '
+                 'submission\n##Explanation of the columns in this report\n#VariationID:  the identifier assigned '
+                 'by ClinVar\n##ClinicalSignificance:  interpretation of the variation-condition relationship\n')
+        submission_rows().to_csv(fp, sep='\t', index=False, quoting=3)
+
+    directory = os.path.join(sources_path, 'gene-dosage')
+    write_source(directory, DOSAGE_CONFIG, DOSAGE_DICTIONARY, DOSAGE_MAPPING)
+    with open(os.path.join(directory, 'gene-dosage-sensitivity.csv'), 'w') as fp:
+        fp.write('"CLINGEN DOSAGE SENSITIVITY CURATIONS"\n"FILE CREATED: 2024-03-01"\n'
+                 '"WEBPAGE: https://search.clinicalgenome.org/kb/gene-dosage"\n"++++++++++++++"\n')
+        lines = dosage_rows().to_csv(index=False).splitlines(keepends=True)
+        fp.write(lines[0] + '"+++++++","+++++++","+++++++","+++++++","+++++++","+++++++"\n' + ''.join(lines[1:]))
+
+
+# a working directory holding the fixture sources in ./sources, as main.py expects
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    write_sources(str(tmp_path / 'sources'))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+# the fixture sources as rows of source.df(), by name
+@pytest.fixture
+def sourcefiles(workdir):
+    source.sources.clear()
+    source.load(os.path.normpath('./sources'), [])
+    return {sourcefile['name']: sourcefile for index, sourcefile in source.df().iterrows()}
+
+
+# program arguments for a command line, e.g. args('--expand', '--map')
+@pytest.fixture
+def args(monkeypatch):
+    def parse(*options):
+        monkeypatch.setattr(sys, 'argv', ['main.py'] + list(options))
+        return arguments.parse()
+    return parse
+
+
+# run main.py over the fixture sources, failing the test when it does not exit cleanly
+@pytest.fixture
+def run_main(workdir):
+    def run(*options):
+        completed = subprocess.run([sys.executable, os.path.join(REPOSITORY, 'main.py')] + list(options),
+                                   cwd=workdir, capture_output=True, text=True)
+        assert completed.returncode == 0, completed.stdout + completed.stderr
+        return completed
+    return run
@@ -0,0 +1,96 @@
+# local modules
+import cache
+import reader
+import source
+
+# other libraries
+from os.path import isfile
+
+#########################
+#
+# COLUMNAR SOURCE CACHE
+#
+# A read builds the Parquet cache of the source, later reads come from the cache with the same rows and dtypes,
+# and the cache stops being used as soon as the data file or the dtype schema changes.
+#
+#########################
+
+
+def csv_text(df):
+    return df.to_csv(index=False)
+
+
+# the parsed source, without the cache
+def parsed(sourcefile, dic):
+    return reader.read_csv(sourcefile, dtypes=reader.schema(sourcefile, dic))
+
+
+def test_cache_round_trip(sourcefiles):
+    sourcefile = sourcefiles['variant-summary']
+    dic = source.dictionary(sourcefile)
+    data_file = reader.data_file(sourcefile)
+    dtypes = reader.schema(sourcefile, dic)
+    assert not cache.is_current(sourcefile, data_file, dtypes)
+
+    df = reader.read(sourcefile, dic)
+    assert isfile(cache.cache_file(sourcefile)) and cache.is_current(sourcefile, data_file, dtypes)
+    cached = reader.missing_as_nan(cache.read(sourcefile, data_file, dtypes))
+    assert csv_text(cached) == csv_text(df) == csv_text(parsed(sourcefile, dic))
+    assert cached.dtypes.astype(str).to_dict() == df.dtypes.astype(str).to_dict()
+
+
+def test_cache_follows_data_file(sourcefiles):
+    sourcefile = sourcefiles['submission-summary']
+    dic = source.dictionary(sourcefile)
+    data_file = reader.data_file(sourcefile)
+    rows = len(reader.read(sourcefile, dic))
+    with open(data_file, 'a') as fp:
+        fp.write('4242\tBenign\t-\t-\tGeneDx\tSCV000999999.1\tLDLR\treviewed by expert panel\tclinical testing\n')
+    assert not cache.is_current(sourcefile, data_file, reader.schema(sourcefile, dic))
+
+    df = reader.read(sourcefile, dic)
+    assert len(df) == rows + 1
+    assert csv_text(df) == csv_text(parsed(sourcefile, dic))
+    assert cache.is_current(sourcefile, data_file, reader.schema(sourcefile, dic))
+
+
+def test_cache_follows_schema(sourcefiles):
+    sourcefile = sourcefiles['gene-dosage']
+    dic = source.dictionary(sourcefile)
+    data_file = reader.data_file(sourcefile)
+    reader.read(sourcefile, dic)
+    dic.loc[dic['column'] == 'TRIPLOSENSITIVITY', ['onehot', 'category']] = False
+    assert not cache.is_current(sourcefile, data_file, reader.schema(sourcefile, dic))
+    assert reader.read(sourcefile, dic)['TRIPLOSENSITIVITY'].dtype == object
+
+
+def test_unreadable_cache_is_rebuilt(sourcefiles):
+    sourcefile = sourcefiles['variant-summary']
+    dic = source.dictionary(sourcefile)
+    reader.read(sourcefile, dic)
+    with open(cache.cache_file(sourcefile), 'wb') as fp:
+        fp.write(b'not a parquet file')
+    assert cache.read(sourcefile, reader.data_file(sourcefile), reader.schema(sourcefile, dic)) is None
+    assert csv_text(reader.read(sourcefile, dic)) == csv_text(parsed(sourcefile, dic))
+    assert cache.read(sourcefile, reader.data_file(sourcefile), reader.schema(sourcefile, dic)) is not None
+
+
+def test_filtered_cache_read(sourcefiles):
+    sourcefile = sourcefiles['variant-summary']
+    dic = source.dictionary(sourcefile)
+    reader.read(sourcefile, dic)
+    filters = reader.row_filters(sourcefile, dic, variant='1002,1011', gene='BRCA2,NBR2', expand=True)
+    df = reader.read(sourcefile, dic, filters=filters)
+    full = parsed(sourcefile, dic)
+    expected = full.loc[reader.matches(full, filters)]
+    assert len(expected) > 0
+    assert csv_text(df) == csv_text(expected)
+
+
+def test_invalidate(sourcefiles):
+    sourcefile = sourcefiles['variant-summary']
+    reader.read(sourcefile, source.dictionary(sourcefile))
+    cache.invalidate(sourcefile)
+    assert not isfile(cache.cache_file(sourcefile)) and not isfile(cache.signature_file(sourcefile))
+    reader.read(sourcefile, source.dictionary(sourcefile))
+    assert isfile(cache.cache_file(sourcefile))
@@ -0,0 +1,93 @@
+# local modules
+import delta
+import encode
+import pipeline
+import reader
+import source
+
+# other libraries
+import json
+import pandas as pd
+from conftest import variant_rows
+
+#########################
+#
+# INCREMENTAL RELEASES
+#
+# With --incremental a new release of a source records the variants added, changed and removed since the last one,
+# and renders the template of only the new or changed rows, giving the same template text as a run without it.
+#
+#########################
+
+
+def process(sourcefile, run_args):
+    dic = source.dictionary(sourcefile)
+    release = delta.start(sourcefile, dic)
+    df = pipeline.process(sourcefile, dic, run_args, release)
+    delta.finish(release)
+    return df, release
+
+
+def test_release_changes(sourcefiles, args):
+    sourcefile = sourcefiles['variant-summary']
+    run_args = args('--template', '--incremental', '--no-cache')
+    df, release = process(sourcefile, run_args)
+    assert release['rendered'] == len(df) and release['reused'] == 0
+    state = delta.load_state(sourcefile)
+    assert len(state['releases']) == 1 and 'added' not in state['releases'][0]
+
+    # the next release: a row of variant 1003 changes, variant 1005 is removed and variant 4242 added
+    rows = variant_rows()
+    rows.loc[rows.index[rows['VariationID'] == 1003][0], 'ClinicalSignificance'] = 'Benign'
+    rows = rows.loc[rows['VariationID'] != 1005]
+    added = [15999, 'Deletion', 'NM_000527.5(LDLR):c.999del', 'LDLR', 'Pathogenic', 'Jan 05, 2019',
+             'reviewed by expert panel', 2, 'GRCh38', '19', 4242]
+    rows = pd.concat([rows, pd.DataFrame([added], columns=rows.columns)], ignore_index=True)
+    rows.to_csv(reader.data_file(sourcefile), sep='\t', index=False)
+
+    df, release = process(sourcefile, run_args)
+    state = delta.load_state(sourcefile)
+    entry = state['releases'][1]
+    assert (entry['added'], entry['changed'], entry['removed']) == (1, 1, 1)
+    changes = pd.read_parquet(delta.changes_file(sourcefile, 1))
+    assert changes.to_dict('records') == [{'key': '1003', 'change': 'changed'}, {'key': '1005', 'change': 'removed'},
+                                          {'key': '4242', 'change': 'added'}]
+    # only the changed and added rows are rendered again
+    assert release['rendered'] == 2 and release['reused'] == len(df) - 2
+
+    dic = source.dictionary(sourcefile)
+    expected = pipeline.process(sourcefile, dic, args('--template', '--no-cache'))
+    assert df.to_csv(index=False) == expected.to_csv(index=False)
+    assert 'variant-summary-template' in df.columns
+
+
+def test_same_release(sourcefiles, args):
+    sourcefile = sourcefiles['submission-summary']
+    run_args = args('--template', '--incremental', '--no-cache')
+    process(sourcefile, run_args)
+    df, release = process(sourcefile, run_args)
+    # the release is not recorded twice, and all of its text is reused
+    assert len(delta.load_state(sourcefile)['releases']) == 1
+    assert release['rendered'] == 0 and release['reused'] == len(df)
+
+
+def test_changed_template(sourcefiles, args):
+    sourcefile = sourcefiles['gene-dosage'].copy()
+    run_args = args('--template', '--incremental', '--no-cache')
+    process(sourcefile, run_args)
+    sourcefile['template'] = 'The ${dict.HAPLOINSUFFICIENCY} of ${dict.DATE}.'
+    df, release = process(sourcefile, run_args)
+    assert release['rendered'] == len(df)
+    expected = encode.template(df.drop(columns=['gene-dosage-template']), sourcefile)
+    assert df['gene-dosage-template'].tolist() == expected['gene-dosage-template'].tolist()
+    with open(delta.state_file(sourcefile)) as fp:
+        assert json.load(fp)['template'] == release['template']
+
+
+def test_changes():
+    previous = pd.DataFrame({'key': ['1', '1', '2', '3', None], 'hash': [10, 11, 20, 30, 40]})
+    current = pd.DataFrame({'key': ['1', '1', '2', '2', '4', None], 'hash': [11, 10, 20, 20, 50, 40]})
+    found = delta.changes(previous, current)
+    # a repeated row counts as a change, the order of the rows does not
+    assert found.to_dict('records') == [{'key': '2', 'change': 'changed'}, {'key': '3', 'change': 'removed'},
+                                        {'key': '4', 'change': 'added'}]
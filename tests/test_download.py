@@ -0,0 +1,234 @@
+# local modules
+import cache
+import download
+import helper
+
+# other libraries
+import gzip
+import hashlib
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+import pytest
+
+#########################
+#
+# DOWNLOADS AGAINST A LOCAL HTTP STAND-IN SERVER
+#
+# The stand-in serves files from a dictionary of path -> (bytes, ETag) and answers as the ClinVar / GenCC servers
+# do: Range requests (206, or 416 past the end), If-Range (the whole file when the ETag changed) and If-None-Match
+# (304 Not Modified). Every request is recorded with its headers.
+#
+#########################
+
+DATA = b''.join(b'%d\tvariant %d\tgene-%d\n' % (i, i, i % 97) for i in range(50000))
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        if self.path not in self.server.files:
+            self.send_error(404)
+            return
+        content, etag = self.server.files[self.path]
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        start = 0
+        ranged = self.headers.get('Range')
+        if ranged is not None and self.headers.get('If-Range', etag) == etag:
+            start = int(ranged[len('bytes='):].rstrip('-'))
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */' + str(len(content)))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes ' + str(start) + '-' + str(len(content) - 1) + '/' +
+                             str(len(content)))
+        else:
+            self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(content) - start))
+        self.end_headers()
+        self.wfile.write(content[start:])
+
+    def log_message(self, format, *arguments):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    httpd.files = {}
+    httpd.requests = []
+    httpd.url = 'http://127.0.0.1:' + str(httpd.server_address[1])
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def md5(content):
+    return hashlib.md5(content).hexdigest()
+
+
+# a .part file left by an interrupted download of the first bytes of content
+def interrupted(filepath, content, etag):
+    with open(filepath + '.part', 'wb') as fp:
+        fp.write(content)
+    with open(filepath + '.part.validator', 'w') as fp:
+        fp.write(etag)
+
+
+def test_fresh_download(server, tmp_path):
+    server.files['/data.tsv'] = (DATA, '"v1"')
+    filepath = str(tmp_path / 'data.tsv')
+    fetched = helper.download(server.url + '/data.tsv', filepath)
+    with open(filepath, 'rb') as fp:
+        assert fp.read() == DATA
+    assert fetched['md5'] == md5(DATA)
+    assert fetched['etag'] == '"v1"'
+    assert fetched['content_length'] == len(DATA)
+    assert not os.path.exists(filepath + '.part')
+    assert not os.path.exists(filepath + '.part.validator')
+
+
+def test_gunzip_while_downloading(server, tmp_path):
+    compressed = gzip.compress(DATA)
+    server.files['/data.tsv.gz'] = (compressed, '"v1"')
+    filepath = str(tmp_path / 'data.tsv.gz')
+    gunzip_path = str(tmp_path / 'data.tsv')
+    fetched = helper.download(server.url + '/data.tsv.gz', filepath, gunzip_path)
+    with open(gunzip_path, 'rb') as fp:
+        assert fp.read() == gzip.decompress(compressed)
+    assert fetched['md5'] == md5(compressed)
+
+
+def test_gunzip_of_several_gzip_members(server, tmp_path):
+    compressed = gzip.compress(DATA[:1000]) + gzip.compress(DATA[1000:])
+    server.files['/data.tsv.gz'] = (compressed, '"v1"')
+    gunzip_path = str(tmp_path / 'data.tsv')
+    helper.download(server.url + '/data.tsv.gz', str(tmp_path / 'data.tsv.gz'), gunzip_path)
+    with open(gunzip_path, 'rb') as fp:
+        assert fp.read() == DATA
+
+
+def test_resume_from_part(server, tmp_path):
+    compressed = gzip.compress(DATA)
+    server.files['/data.tsv.gz'] = (compressed, '"v1"')
+    filepath = str(tmp_path / 'data.tsv.gz')
+    gunzip_path = str(tmp_path / 'data.tsv')
+    interrupted(filepath, compressed[:5000], '"v1"')
+    fetched = helper.download(server.url + '/data.tsv.gz', filepath, gunzip_path)
+    path, headers = server.requests[-1]
+    assert headers['Range'] == 'bytes=5000-'
+    assert headers['If-Range'] == '"v1"'
+    with open(filepath, 'rb') as fp:
+        assert fp.read() == compressed
+    with open(gunzip_path, 'rb') as fp:
+        assert fp.read() == DATA
+    # the checksum covers the bytes downloaded before the interruption too
+    assert fetched['md5'] == md5(compressed)
+
+
+def test_resume_after_file_changed(server, tmp_path):
+    changed = DATA.replace(b'variant', b'allele')
+    server.files['/data.tsv'] = (changed, '"v2"')
+    filepath = str(tmp_path / 'data.tsv')
+    interrupted(filepath, DATA[:5000], '"v1"')
+    fetched = helper.download(server.url + '/data.tsv', filepath)
+    # the server sends the whole new file instead of the rest of the old one
+    with open(filepath, 'rb') as fp:
+        assert fp.read() == changed
+    assert fetched['md5'] == md5(changed)
+    assert fetched['etag'] == '"v2"'
+
+
+def test_restart_when_part_is_past_the_end(server, tmp_path):
+    server.files['/data.tsv'] = (DATA, '"v1"')
+    filepath = str(tmp_path / 'data.tsv')
+    interrupted(filepath, DATA + b'extra', '"v1"')
+    fetched = helper.download(server.url + '/data.tsv', filepath, conditions={'If-None-Match': '"v0"'})
+    assert [headers.get('Range') for path, headers in server.requests] == ['bytes=' + str(len(DATA) + 5) + '-', None]
+    # the conditions of a refresh are kept on the restarted request
+    assert server.requests[-1][1]['If-None-Match'] == '"v0"'
+    with open(filepath, 'rb') as fp:
+        assert fp.read() == DATA
+    assert fetched['md5'] == md5(DATA)
+
+
+def test_resume_keeps_conditions(server, tmp_path):
+    server.files['/data.tsv'] = (DATA, '"v1"')
+    filepath = str(tmp_path / 'data.tsv')
+    interrupted(filepath, DATA[:5000], '"v1"')
+    assert helper.download(server.url + '/data.tsv', filepath, conditions={'If-None-Match': '"v1"'}) is None
+    assert server.requests[-1][1]['If-None-Match'] == '"v1"'
+
+
+def test_not_modified(server, tmp_path):
+    server.files['/data.tsv'] = (DATA, '"v1"')
+    filepath = str(tmp_path / 'data.tsv')
+    assert helper.download(server.url + '/data.tsv', filepath, conditions={'If-None-Match': '"v1"'}) is None
+    assert not os.path.exists(filepath)
+
+
+#########################
+#
+# --refresh OF A SOURCE
+#
+#########################
+
+def source(tmp_path, url, md5_url=None):
+    settings = {'name': 'stand-in', 'path': str(tmp_path), 'file': 'data.tsv', 'url': url}
+    if md5_url is not None:
+        settings.update({'md5_url': md5_url, 'md5_file': 'data.tsv.md5'})
+    return pd.Series(settings)
+
+
+def test_refresh_not_modified(server, tmp_path):
+    server.files['/data.tsv'] = (DATA, '"v1"')
+    s = source(tmp_path, server.url + '/data.tsv')
+    assert download.download(s, False)
+    assert not download.download(s, False, refresh=True)
+    assert server.requests[-1][1]['If-None-Match'] == '"v1"'
+
+    server.files['/data.tsv'] = (DATA + DATA, '"v2"')
+    assert download.download(s, False, refresh=True)
+    with open(tmp_path / 'data.tsv', 'rb') as fp:
+        assert fp.read() == DATA + DATA
+    with open(download.fetch_file(s), 'r') as fp:
+        assert json.load(fp)['etag'] == '"v2"'
+
+
+def test_refresh_with_unchanged_published_md5(server, tmp_path):
+    server.files['/data.tsv'] = (DATA, '"v1"')
+    server.files['/data.tsv.md5'] = ((md5(DATA) + '  data.tsv\n').encode(), '"m1"')
+    s = source(tmp_path, server.url + '/data.tsv', server.url + '/data.tsv.md5')
+    assert download.download(s, False)
+    requests_before = len(server.requests)
+    assert not download.download(s, False, refresh=True)
+    # only the published checksum is fetched
+    assert [path for path, headers in server.requests[requests_before:]] == ['/data.tsv.md5']
+
+
+def test_new_download_keeps_indexes(server, tmp_path):
+    server.files['/data.tsv'] = (DATA, '"v1"')
+    s = source(tmp_path, server.url + '/data.tsv')
+    assert download.download(s, False)
+    os.makedirs(cache.cache_dir(s))
+    kept = os.path.join(cache.cache_dir(s), 'stand-in.index.parquet')
+    for file_name in [cache.cache_file(s), cache.signature_file(s), kept]:
+        with open(file_name, 'w') as fp:
+            fp.write('')
+    server.files['/data.tsv'] = (DATA + DATA, '"v2"')
+    assert download.download(s, False, refresh=True)
+    # the source cache of the old data file is removed, the join-key index finds out itself
+    assert not os.path.exists(cache.cache_file(s))
+    assert not os.path.exists(cache.signature_file(s))
+    assert os.path.exists(kept)
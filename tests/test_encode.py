@@ -0,0 +1,183 @@
+# local modules
+import encode
+import encoders
+import helper
+import pipeline
+import reader
+import source
+
+# other libraries
+import json
+import os
+import pandas as pd
+import pytest
+
+#########################
+#
+# ENCODINGS
+#
+# The vectorized --expand, --map and --days / --age encodings give the same values as the row by row versions
+# the program used before (kept here as the baseline), and the encoders saved with --fit-encoders give a filtered
+# run the same one-hot columns and category codes as a run over the whole source.
+#
+#########################
+
+DATE_COLUMNS = [('variant-summary', 'LastEvaluated'), ('submission-summary', 'DateLastEvaluated'),
+                ('gene-dosage', 'DATE')]
+
+
+def csv_text(df):
+    return df.to_csv(index=False)
+
+
+# the source as read before the encodings, with the hashes stripped from the column labels
+def prepared(sourcefile, dic):
+    return encode.strip_hash(reader.read(sourcefile, dic, use_cache=False))
+
+
+# the previous --expand: a copy of the row is appended for each value, and the row with the list is kept
+def baseline_expand(df, dic):
+    dic_filter_df = dic.loc[(dic.get('expand') == True)]
+    for i, r in dic_filter_df.iterrows():
+        col_name = r['column']
+        expandable_rows_df = df.loc[(df.get(col_name).str.contains(","))]
+        for exp_i, exp_r in expandable_rows_df.iterrows():
+            values = exp_r[col_name].split(",")
+            for v in values:
+                new_row = expandable_rows_df.loc[exp_i].copy()
+                new_row[col_name] = v
+                df.loc[len(df)] = new_row
+    return df
+
+
+# the previous --map of a column: a left merge of the mapping.csv rows for each map-name
+def baseline_map(df, map_config_df, column_name):
+    map_col_df = map_config_df.loc[(map_config_df['column'] == column_name)]
+    map_col_df = map_col_df.drop(columns={'column', 'frequency'}, axis=1)
+    map_col_df.rename(columns={'value': column_name}, inplace=True)
+    for m in map_col_df['map-name'].unique():
+        map_name_df = map_col_df.loc[(map_col_df['map-name'] == m)]
+        map_name_df = map_name_df.drop(columns={'map-name'}, axis=1)
+        map_name_df.rename(columns={'map-value': m}, inplace=True)
+        df[column_name] = df[column_name].astype(str)
+        map_name_df[column_name] = map_name_df[column_name].astype(str)
+        df = pd.merge(left=df, right=map_name_df, left_on=column_name, right_on=column_name, how='left',
+                      suffixes=(None, '_remove'))
+        df.drop(df.filter(regex='_remove$').columns, axis=1, inplace=True)
+    return df
+
+
+def test_expand_matches_row_by_row(sourcefiles):
+    sourcefile = sourcefiles['variant-summary']
+    dic = source.dictionary(sourcefile)
+    # the previous --expand needed text columns
+    df = prepared(sourcefile, dic).astype({'GeneSymbol': object})
+    expanded = encode.expand(df.copy(), dic, sourcefile['name'])
+    baseline = baseline_expand(df.copy(), dic)
+
+    # the same rows, apart from the rows with a list the row by row version kept
+    kept = baseline.loc[~baseline['GeneSymbol'].str.contains(',')]
+    assert len(expanded) == len(kept) > len(df)
+    columns = list(df.columns)
+    assert csv_text(expanded.sort_values(columns)) == csv_text(kept.sort_values(columns))
+    # with the new rows in place of the row they came from
+    assert expanded['GeneSymbol'].tolist() == [gene for genes in df['GeneSymbol'] for gene in genes.split(',')]
+    assert expanded['#AlleleID' if '#AlleleID' in columns else 'AlleleID'].is_monotonic_increasing
+
+
+@pytest.mark.parametrize('name', ['variant-summary', 'gene-dosage'])
+def test_compiled_mapping_matches_merges(sourcefiles, name):
+    sourcefile = sourcefiles[name]
+    dic = source.dictionary(sourcefile)
+    map_config_df = pd.read_csv(os.path.join(sourcefile['path'], 'mapping.csv'))
+    mapping = encode.compile_mapping(map_config_df)
+    df = prepared(sourcefile, dic)
+    expected = df.copy()
+    for column_name in dic.loc[(dic['map'] == True), 'column']:
+        df = encode.map_column(df, column_name, mapping)
+        expected = baseline_map(expected, map_config_df, column_name)
+    assert len(df.columns) > len(prepared(sourcefile, dic).columns)
+    assert csv_text(df) == csv_text(expected)
+
+
+def test_mapping_through_pipeline(sourcefiles, args):
+    sourcefile = sourcefiles['variant-summary']
+    dic = source.dictionary(sourcefile)
+    run_args = args('--map', '--no-cache')
+    df = pipeline.process(sourcefile, dic, run_args)
+    map_config_df = pd.read_csv(os.path.join(sourcefile['path'], 'mapping.csv'))
+    expected = prepared(sourcefile, dic)
+    for column_name in ['ClinicalSignificance', 'ReviewStatus']:
+        expected = baseline_map(expected, map_config_df, column_name)
+    assert csv_text(df) == csv_text(expected)
+    # a value without a mapping is left empty
+    assert df.loc[df['ClinicalSignificance'] == 'not provided', 'clin-sig-simple'].isna().all()
+
+
+@pytest.mark.parametrize('name, column', DATE_COLUMNS)
+def test_vectorized_dates_match_dateparser(sourcefiles, name, column):
+    sourcefile = sourcefiles[name]
+    dic = source.dictionary(sourcefile)
+    date_format = dic.loc[(dic['column'] == column), 'format'].iloc[0]
+    values = prepared(sourcefile, dic)[column]
+    parsed = helper.parse_dates(values, date_format)
+    sentinels = helper.date_sentinels(values)
+    assert helper.dates_to_days(parsed, sentinels).tolist() == [helper.get_days(v, date_format) for v in values]
+    assert helper.dates_to_age(parsed, sentinels).tolist() == [helper.get_age(v, date_format) for v in values]
+
+
+def test_dates_encoding(sourcefiles, args):
+    sourcefile = sourcefiles['variant-summary']
+    dic = source.dictionary(sourcefile)
+    df = encode.dates(prepared(sourcefile, dic), 'LastEvaluated', '%b %d, %Y', args('--days', '--age'))
+    # "-" is -1, and dates off the format go to dateparser
+    assert df.loc[df['LastEvaluated'] == '-', 'days_LastEvaluated'].eq(-1).all()
+    assert df.loc[df['LastEvaluated'] == '2021-06-18', 'days_LastEvaluated'].eq(18796).all()
+    assert df.loc[df['LastEvaluated'] == 'Jul 04, 2015', 'days_LastEvaluated'].eq(16620).all()
+
+
+# encoded columns of the rows of variant 1003
+def variant_columns(df):
+    encoded = [column for column in df.columns if '_hot_' in column or column.startswith(encode.CATEGORIES_PREFIX)]
+    return df.loc[df['VariationID'] == 1003, encoded].reset_index(drop=True)
+
+
+@pytest.mark.parametrize('name', ['variant-summary', 'submission-summary'])
+def test_saved_encoders_round_trip(sourcefiles, args, name):
+    sourcefile = sourcefiles[name]
+    dic = source.dictionary(sourcefile)
+    run_args = args('--onehot', '--categories', '--no-cache')
+    mapping = pipeline.mapping_config(sourcefile, dic, run_args)
+    # fitted over the whole source with LabelEncoder and pd.get_dummies
+    whole = pipeline.process(sourcefile, dic, run_args)
+
+    fitted = pipeline.fit_encoders(sourcefile, dic, mapping, run_args)
+    assert encoders.exists(sourcefile)
+    saved, stale = encoders.read(sourcefile, encoders.settings(sourcefile, dic, mapping, run_args))
+    assert not stale
+    assert saved == json.loads(json.dumps(fitted, default=encoders.json_value))
+
+    filtered = pipeline.process(sourcefile, dic, args('--onehot', '--categories', '--no-cache', '--variant', '1003'))
+    assert len(filtered) > 0
+    assert csv_text(variant_columns(filtered)) == csv_text(variant_columns(whole))
+
+
+def test_saved_encoders_out_of_date(sourcefiles, args):
+    sourcefile = sourcefiles['submission-summary']
+    dic = source.dictionary(sourcefile)
+    run_args = args('--onehot', '--categories')
+    mapping = pipeline.mapping_config(sourcefile, dic, run_args)
+    pipeline.fit_encoders(sourcefile, dic, mapping, run_args)
+
+    # other settings do not use the saved encoders
+    other_args = args('--onehot', '--categories', '--onehot-max', '2')
+    assert encoders.read(sourcefile, encoders.settings(sourcefile, dic, mapping, other_args)) == (None, False)
+
+    # a new data file fits them again
+    with open(reader.data_file(sourcefile), 'a') as fp:
+        fp.write('4242\tDrug response\t-\t-\tGeneDx\tSCV000999999.1\tLDLR\treviewed by expert panel\t'
+                 'clinical testing\n')
+    assert encoders.read(sourcefile, encoders.settings(sourcefile, dic, mapping, run_args))[1]
+    fitted = pipeline.saved_encoders(sourcefile, dic, mapping, run_args)
+    assert 'Drug response' in fitted['ClinicalSignificance']['values']
+    assert not encoders.read(sourcefile, encoders.settings(sourcefile, dic, mapping, run_args))[1]
@@ -0,0 +1,150 @@
+# local modules
+import joins
+import output
+import pipeline
+import source
+import sqljoin
+
+# other libraries
+import logging
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import JOINED_SOURCES
+
+#########################
+#
+# JOINED OUTPUT
+#
+# The join planner gives the same rows, in the same order, as the sequential left joins in --sources order the
+# program ran before (kept here as the baseline), whatever order it runs the joins in; its row counts are those of
+# the joins; and the SQLite engine (--join-engine=sqlite) gives the same output as the in-memory join.
+#
+#########################
+
+ORDERS = [JOINED_SOURCES.split(','), ['variant-summary', 'gene-dosage', 'submission-summary'],
+          ['submission-summary', 'variant-summary', 'gene-dosage'], ['gene-dosage', 'variant-summary']]
+OPTIONS = [[], ['--expand', '--map', '--onehot', '--categories', '--days'], ['--variant', '1003,1007', '--expand'],
+           ['--gene', 'TP53', '--template']]
+
+
+def csv_text(df):
+    return df.to_csv(index=False)
+
+
+# the processed sources, the dictionary of all sources (as main.py builds it) and the column suffix of each source
+def processed(sourcefiles, run_args):
+    data = {}
+    dictionary = []
+    suffixes = {}
+    for name, sourcefile in sourcefiles.items():
+        dic = source.dictionary(sourcefile)
+        data[name] = pipeline.process(sourcefile, dic, run_args)
+        dictionary.append(dic.assign(name=name))
+        suffixes[name] = sourcefile['suffix']
+    return data, pd.concat(dictionary, ignore_index=True), suffixes
+
+
+# the previous joined output: left joins in --sources order, each on the first join-group (by precedence) that a
+# source before it has, with the suffix of the joined source on repeated columns
+def baseline_join(data, dictionary, sources, suffixes):
+    dic_df = dictionary[dictionary['join-group'].notnull()].copy()
+    dic_df['precedence'] = dic_df['join-group'].map({'variation-id': 0, 'gene-symbol': 1, 'hgnc-id': 2})
+    out_df = pd.DataFrame()
+    already_joined_dic_df = pd.DataFrame(data=None, columns=dic_df.columns)
+    for c, s in enumerate(sources):
+        s_dic_df = dic_df.loc[(dic_df['name'] == s)].sort_values(by=['precedence'])
+        if c == 0:
+            out_df = data[s]
+        else:
+            selected_join_group = None
+            for jg in s_dic_df['join-group'].unique():
+                if len(already_joined_dic_df.loc[(already_joined_dic_df['join-group'] == jg)]) > 0:
+                    selected_join_group = jg
+                    break
+            left_join_column = already_joined_dic_df.loc[(already_joined_dic_df['join-group']
+                                                          == selected_join_group)].iloc[0]['column']
+            right_join_column = s_dic_df.loc[(s_dic_df['join-group'] == selected_join_group)].iloc[0]['column']
+            out_df = pd.merge(out_df, data[s], how='left', left_on=left_join_column, right_on=right_join_column,
+                              suffixes=('', '-' + suffixes[s]))
+        already_joined_dic_df = pd.concat([already_joined_dic_df, s_dic_df])
+    return out_df
+
+
+@pytest.mark.parametrize('options', OPTIONS)
+@pytest.mark.parametrize('sources', ORDERS)
+def test_join_matches_sequential_merges(sourcefiles, args, sources, options):
+    data, dictionary, suffixes = processed(sourcefiles, args('--no-cache', *options))
+    joined = joins.join(data, dictionary, sources, suffixes)
+    assert csv_text(joined) == csv_text(baseline_join(data, dictionary, sources, suffixes))
+
+
+def test_planner_reorders_joins(sourcefiles, args, caplog):
+    data, dictionary, suffixes = processed(sourcefiles, args('--no-cache', '--expand'))
+    sources = JOINED_SOURCES.split(',')
+    with caplog.at_level(logging.DEBUG):
+        joined = joins.join(data, dictionary, sources, suffixes)
+    # the gene join adds no rows, so it runs before the submissions multiply the rows
+    assert "Join order: ['variant-summary', 'gene-dosage', 'submission-summary']" in caplog.messages
+    assert csv_text(joined) == csv_text(baseline_join(data, dictionary, sources, suffixes))
+
+
+def test_plan(sourcefiles, args):
+    data, dictionary, suffixes = processed(sourcefiles, args('--no-cache'))
+    assert joins.plan(JOINED_SOURCES.split(','), dictionary) == [
+        {'source': 'submission-summary', 'join-group': 'variation-id', 'left': 'VariationID', 'right': 'VariationID'},
+        {'source': 'gene-dosage', 'join-group': 'gene-symbol', 'left': 'GeneSymbol', 'right': 'GENE SYMBOL'}]
+    with pytest.raises(joins.JoinError):
+        joins.plan(['variant-summary', 'gene-dosage'], dictionary.loc[dictionary['join-group'] != 'gene-symbol'])
+
+
+@pytest.mark.parametrize('left, right', [(['a', 'b', None, 'c', 'a'], ['a', 'a', None, None, 'd']),
+                                         ([1, 2, 3], [4, 5]), ([], [1, 1]), ([1, 1, 2], [])])
+def test_estimate_rows(left, right):
+    left = pd.Series(left, dtype=object)
+    right = pd.Series(right, dtype=object)
+    keys = pd.Index(pd.concat([left, right], ignore_index=True).dropna().unique())
+    rows = joins.estimate_rows(joins.key_codes(keys, left), joins.key_codes(keys, right), len(keys))
+    # missing keys match each other, as in pd.merge
+    assert rows == len(pd.merge(left.to_frame('key'), right.to_frame('key'), how='left', on='key'))
+
+
+def test_join_budget(sourcefiles, args):
+    data, dictionary, suffixes = processed(sourcefiles, args('--no-cache'))
+    sources = JOINED_SOURCES.split(',')
+    rows = len(joins.join(data, dictionary, sources, suffixes))
+    assert len(joins.join(data, dictionary, sources, suffixes, budget=rows)) == rows
+    with pytest.raises(joins.JoinError):
+        joins.join(data, dictionary, sources, suffixes, budget=rows - 1)
+
+
+@pytest.mark.parametrize('options', OPTIONS + [['--na-value', '0', '--map'], ['--variant', '4242']])
+@pytest.mark.parametrize('sources', ORDERS)
+def test_sqlite_join_matches_pandas(sourcefiles, args, sources, options):
+    run_args = args('--no-cache', '--sources', ','.join(sources), '--joined-output', 'sqlite.csv',
+                    '--join-engine', 'sqlite', *options)
+    data, dictionary, suffixes = processed(sourcefiles, run_args)
+    sqljoin.create(run_args)
+    for name in sources:
+        # in two parts, as chunks are loaded
+        half = len(data[name]) // 2
+        sqljoin.load(run_args, name, data[name].iloc[:half])
+        sqljoin.load(run_args, name, data[name].iloc[half:], append=True)
+    sqljoin.join(dictionary, sources, suffixes, run_args)
+
+    pandas_args = args('--no-cache', '--sources', ','.join(sources), '--joined-output', 'pandas.csv', *options)
+    output.write_frame(pipeline.merge(data, dictionary, suffixes, pandas_args), 'pandas.csv', pandas_args)
+    with open('sqlite.csv') as sqlite_file, open('pandas.csv') as pandas_file:
+        assert sqlite_file.read() == pandas_file.read()
+
+
+def test_output_columns():
+    steps = [{'source': 'b', 'join-group': 'variation-id', 'left': 'id', 'right': 'id'},
+             {'source': 'c', 'join-group': 'gene-symbol', 'left': 'gene', 'right': 'symbol'}]
+    names, owners = joins.output_columns({'a': ['id', 'gene', 'value'], 'b': ['id', 'value'],
+                                          'c': ['symbol', 'value']}, ['a', 'b', 'c'], steps,
+                                         {'a': 'x', 'b': 'y', 'c': 'z'})
+    assert names == {'a': {'id': 'id', 'gene': 'gene', 'value': 'value'}, 'b': {'value': 'value-y'},
+                     'c': {'symbol': 'symbol', 'value': 'value-z'}}
+    assert owners['value-z'] == 'c' and owners['id'] == 'a'
+    assert np.array_equal(joins.key_codes(pd.Index(['x', 'y']), pd.Series(['y', None, 'q'])), [1, -1, -1])
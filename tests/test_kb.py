@@ -0,0 +1,77 @@
+# local modules
+import output
+
+# other libraries
+import pandas as pd
+import pytest
+from conftest import JOINED_SOURCES
+
+#########################
+#
+# KNOWLEDGE BASE
+#
+# A --lookup in the knowledge base built with --build-kb gives the same joined rows and template text as a
+# --joined-output run over the sources filtered on the same variants or genes, with the template text of the
+# source rows in them.
+#
+#########################
+
+OPTIONS = ['--expand', '--map', '--days', '--age']
+LOOKUPS = [['--variant', '1003'], ['--variant', '1002,1011,4242'], ['--gene', 'NBR2'], ['--gene', 'TP53,EGFR'],
+           ['--variant', '1002', '--gene', 'PMS2']]
+
+
+def read(file_name):
+    with open(file_name) as fp:
+        return fp.read()
+
+
+# the paragraphs of a template text output
+def paragraphs(file_name):
+    return {paragraph for paragraph in read(file_name).split('\n\n') if paragraph != ''}
+
+
+# the template text of the source rows in a joined output (a sources run also writes the text of the source rows
+# that did not join)
+def joined_text(file_name):
+    joined = pd.read_csv(file_name)
+    text = set()
+    for sourcename in JOINED_SOURCES.split(','):
+        rows = joined.dropna(subset=[sourcename + '-template'])
+        text.update(output.wrapped_text(rows, sourcename))
+    return text
+
+
+@pytest.fixture
+def knowledge_base(run_main):
+    run_main('--build-kb', 'kb.sqlite', '--sources', JOINED_SOURCES, *OPTIONS)
+    return 'kb.sqlite'
+
+
+@pytest.mark.parametrize('lookup', LOOKUPS)
+def test_lookup_matches_joined_output(run_main, knowledge_base, lookup):
+    run_main('--lookup', knowledge_base, '--joined-output', 'lookup.csv', '--template-output', 'lookup.txt',
+             *OPTIONS, *lookup)
+    run_main('--sources', JOINED_SOURCES, '--joined-output', 'joined.csv', '--template-output', 'joined.txt',
+             *OPTIONS, *lookup)
+    assert read('lookup.csv') == read('joined.csv')
+    assert paragraphs('lookup.txt') == joined_text('joined.csv')
+
+
+def test_lookup_to_standard_output(run_main, knowledge_base):
+    found = run_main('--lookup', knowledge_base, '--variant', '1003', *OPTIONS)
+    # the knowledge base keeps the template text
+    run_main('--sources', JOINED_SOURCES, '--joined-output', 'joined.csv', '--template', '--variant', '1003',
+             *OPTIONS)
+    assert found.stdout == read('joined.csv')
+
+
+def test_lookup_batch(run_main, knowledge_base):
+    with open('variants.txt', 'w') as fp:
+        fp.write('1003\n1008\n')
+    run_main('--lookup', knowledge_base, '--variant-file', 'variants.txt', '--output-dir', 'lookups', *OPTIONS)
+    for variant in ['1003', '1008']:
+        run_main('--sources', JOINED_SOURCES, '--joined-output', 'joined.csv', '--template', '--variant', variant,
+                 *OPTIONS)
+        assert read('lookups/variant_' + variant + '.csv') == read('joined.csv')
+        assert paragraphs('lookups/variant_' + variant + '.txt') == joined_text('joined.csv')
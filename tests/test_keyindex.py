@@ -0,0 +1,78 @@
+# local modules
+import keyindex
+import pipeline
+import reader
+import source
+
+# other libraries
+import pytest
+from conftest import JOINED_SOURCES
+
+#########################
+#
+# JOIN-KEY INDEX
+#
+# --variant / --gene lookups through the join-key index, from the cache row groups or by seeking to the lines of
+# the data file, read the same rows as filtering a full read; the index is rebuilt when the data file changes.
+#
+#########################
+
+SOURCE_NAMES = JOINED_SOURCES.split(',')
+FILTERS = [['--variant', '1003,1010'], ['--gene', 'NBR2', '--expand'], ['--gene', 'TP53,EGFR'],
+           ['--variant', '1002', '--gene', 'TP53'], ['--variant', '4242']]
+
+
+def csv_text(df):
+    return df.to_csv(index=False)
+
+
+@pytest.mark.parametrize('cached', [False, True])
+@pytest.mark.parametrize('options', FILTERS)
+@pytest.mark.parametrize('name', SOURCE_NAMES)
+def test_index_lookup_matches_filter(sourcefiles, args, name, options, cached):
+    sourcefile = sourcefiles[name]
+    dic = source.dictionary(sourcefile)
+    run_args = args(*options) if cached else args('--no-cache', *options)
+    filters = pipeline.row_filters(sourcefile, dic, run_args)
+    if cached:
+        reader.read(sourcefile, dic)
+    assert keyindex.build(sourcefile, dic)
+    assert keyindex.current(sourcefile, dic) is not None
+
+    df = keyindex.read(sourcefile, dic, filters, run_args.cache)
+    if not filters:
+        # the source has no column to filter on
+        assert df is None
+        return
+    # the index gives the rows that can match, which the filters then narrow down
+    full = reader.read(sourcefile, dic, use_cache=False)
+    assert csv_text(pipeline.prepare(df, sourcefile, dic, run_args)) == \
+        csv_text(pipeline.prepare(full, sourcefile, dic, run_args))
+    columns = reader.header(sourcefile)[:3]
+    assert csv_text(keyindex.read(sourcefile, dic, filters, run_args.cache, columns)) == csv_text(df.loc[:, columns])
+
+
+def test_index_follows_data_file(sourcefiles, args):
+    sourcefile = sourcefiles['submission-summary']
+    dic = source.dictionary(sourcefile)
+    keyindex.build(sourcefile, dic)
+    with open(reader.data_file(sourcefile), 'a') as fp:
+        fp.write('1003\tBenign\t-\t-\tGeneDx\tSCV000999999.1\tLDLR\treviewed by expert panel\tclinical testing\n')
+    assert keyindex.current(sourcefile, dic) is None
+
+    filters = pipeline.row_filters(sourcefile, dic, args('--no-cache', '--variant', '1003'))
+    df = keyindex.read(sourcefile, dic, filters, use_cache=False)
+    assert 'SCV000999999.1' in df['SCV'].tolist()
+    full = reader.read(sourcefile, dic, use_cache=False)
+    assert csv_text(df) == csv_text(full.loc[reader.matches(full, filters)])
+    assert keyindex.current(sourcefile, dic) is not None
+
+
+def test_no_index(sourcefiles, args):
+    sourcefile = sourcefiles['variant-summary']
+    dic = source.dictionary(sourcefile)
+    filters = pipeline.row_filters(sourcefile, dic, args('--variant', '1003'))
+    assert keyindex.read(sourcefile, dic, filters) is None
+    keyindex.build(sourcefile, dic)
+    # columns outside the index are not looked up
+    assert keyindex.read(sourcefile, dic, [('Type', ['Deletion'], False)]) is None
@@ -0,0 +1,104 @@
+# local modules
+import output
+import pipeline
+import source
+
+# other libraries
+import gzip
+import json
+import numpy as np
+import pandas as pd
+import pytest
+
+#########################
+#
+# OUTPUT FILES
+#
+# Each --output-format reads back as the rows written, in one go or in parts (as the chunks of --chunksize are
+# written), and the --ml-export matrix holds the float32 values of the feature columns its manifest lists.
+#
+#########################
+
+FORMATS = ['csv', 'csv.gz', 'parquet', 'feather']
+OPTIONS = ['--expand', '--map', '--onehot', '--categories', '--days', '--age']
+
+
+def csv_text(df):
+    return df.to_csv(index=False)
+
+
+def read_back(file_name, output_format):
+    if output_format == 'parquet':
+        return pd.read_parquet(file_name)
+    if output_format == 'feather':
+        return pd.read_feather(file_name)
+    return pd.read_csv(file_name, low_memory=False)
+
+
+# the frame as it reads back from CSV, which does not keep the dtypes of the columns
+def read_back_csv(df):
+    df.to_csv('expected.csv', index=False)
+    return pd.read_csv('expected.csv', low_memory=False)
+
+
+def processed(sourcefiles, run_args, name='variant-summary'):
+    sourcefile = sourcefiles[name]
+    dic = source.dictionary(sourcefile)
+    return pipeline.process(sourcefile, dic, run_args), sourcefile, dic
+
+
+@pytest.mark.parametrize('output_format', FORMATS)
+def test_write_frame_round_trip(sourcefiles, args, output_format):
+    run_args = args('--no-cache', '--output-format', output_format, *OPTIONS)
+    df, sourcefile, dic = processed(sourcefiles, run_args)
+    file_name = 'out' + output.FORMAT_EXTENSIONS[output_format]
+    output.write_frame(df, file_name, run_args)
+    if output_format == 'csv.gz':
+        with gzip.open(file_name, 'rt') as fp:
+            assert fp.read() == csv_text(df)
+    found = read_back(file_name, output_format)
+    assert found.columns.tolist() == df.columns.tolist()
+    assert csv_text(found) == csv_text(read_back_csv(df))
+
+
+@pytest.mark.parametrize('output_format', FORMATS)
+def test_parts_match_one_write(sourcefiles, args, output_format):
+    run_args = args('--no-cache', '--output-format', output_format, *OPTIONS)
+    df, sourcefile, dic = processed(sourcefiles, run_args, 'submission-summary')
+    whole_file = 'whole' + output.FORMAT_EXTENSIONS[output_format]
+    parts_file = 'parts' + output.FORMAT_EXTENSIONS[output_format]
+    output.write_frame(df, whole_file, run_args)
+    parts = [df.iloc[:7], df.iloc[7:20], df.iloc[20:]]
+    output.write_frame(parts[0], parts_file, run_args, more=True)
+    output.write_frame(parts[1], parts_file, run_args, append=True, more=True)
+    output.write_frame(parts[2], parts_file, run_args, append=True, more=True)
+    output.close(parts_file)
+    assert parts_file not in output.writers
+    assert csv_text(read_back(parts_file, output_format)) == csv_text(read_back(whole_file, output_format))
+
+
+def test_ml_export(sourcefiles, args):
+    run_args = args('--no-cache', '--ml-export', *OPTIONS)
+    df, sourcefile, dic = processed(sourcefiles, run_args)
+    mapping = pipeline.mapping_config(sourcefile, dic, run_args, df)
+    features = pipeline.ml_features(df, sourcefile, dic, mapping, run_args)
+    names = [feature['name'] for feature in features]
+    assert {'clin-sig-confidence-rank', 'review-stars', 'days_LastEvaluated'} <= set(names)
+    # text columns are not features
+    assert 'Name' not in names and 'ClinicalSignificance' not in names
+
+    # in two parts, as chunks are written
+    output.write_features(df.iloc[:10], features, 'variant-summary', run_args)
+    output.write_features(df.iloc[10:], features, 'variant-summary', run_args, append=True)
+    output.finish_features(features, 'variant-summary', run_args)
+    matrix_file, manifest_file = output.feature_output_files('variant-summary', run_args)
+    matrix = np.load(matrix_file, mmap_mode='r')
+    expected = df[names].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float32, na_value=np.nan)
+    assert matrix.dtype == np.float32
+    assert np.array_equal(matrix, expected, equal_nan=True)
+    with open(manifest_file) as fp:
+        manifest = json.load(fp)
+    assert manifest['shape'] == [len(df), len(names)]
+    assert [column['name'] for column in manifest['columns']] == names
+    assert [column['index'] for column in manifest['columns']] == list(range(len(names)))
+    assert manifest['columns'][names.index('review-stars')]['column'] == 'ReviewStatus'
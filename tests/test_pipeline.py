@@ -0,0 +1,44 @@
+# other libraries
+import pytest
+from conftest import JOINED_SOURCES
+
+#########################
+#
+# CHUNKED PIPELINE
+#
+# main.py runs over the fixture sources give the same per-source, joined and template text outputs streaming the
+# sources in chunks (--chunksize), from the cache or the source files, as processing each source as a whole.
+#
+#########################
+
+SOURCE_NAMES = JOINED_SOURCES.split(',')
+OPTIONS = [['--expand', '--map', '--onehot', '--categories', '--days', '--age', '--template'],
+           ['--expand', '--map', '--onehot', '--onehot-max', '2', '--categories', '--na-value', '0'],
+           ['--variant', '1003,1008', '--expand', '--onehot', '--categories', '--template'],
+           ['--gene', 'TP53,NBR2', '--expand', '--map', '--columns', 'VariationID,GeneSymbol,Type,review-stars']]
+
+
+def read(file_name):
+    with open(file_name) as fp:
+        return fp.read()
+
+
+# run main.py with the options; returns the text of the joined, per-source and template text outputs
+def run(run_main, name, *options):
+    run_main('--sources', JOINED_SOURCES, '--joined-output', name + '.csv', '--template-output', name + '.txt',
+             *options)
+    found = {'joined': read(name + '.csv'), 'text': read(name + '.txt')}
+    for sourcename in SOURCE_NAMES:
+        found[sourcename] = read(sourcename + '-' + name + '.csv')
+    return found
+
+
+@pytest.mark.parametrize('options', OPTIONS)
+def test_chunks_match_whole_sources(run_main, options):
+    whole = run(run_main, 'whole', '--no-cache', *options)
+    assert len(whole['joined'].splitlines()) > 1
+
+    # from the source files, then from the cache (built by the first run without --no-cache)
+    assert run(run_main, 'chunks', '--no-cache', '--chunksize', '7', *options) == whole
+    assert run(run_main, 'cached', *options) == whole
+    assert run(run_main, 'cached-chunks', '--chunksize', '5', *options) == whole
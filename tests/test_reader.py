@@ -0,0 +1,95 @@
+# local modules
+import helper
+import pipeline
+import reader
+import source
+
+# other libraries
+import pandas as pd
+import pytest
+from conftest import JOINED_SOURCES
+
+#########################
+#
+# SOURCE READER
+#
+# The typed reads with the fastest parser (--no-cache), the --variant / --gene filters pushed down into the reader
+# and the --columns projection give the same rows as reading every row and column of the source with the python
+# parser, as the program did before, and filtering and selecting afterwards.
+#
+#########################
+
+SOURCE_NAMES = JOINED_SOURCES.split(',')
+FILTERS = [['--variant', '1003,1010'], ['--gene', 'NBR2'], ['--gene', 'NBR2,TP53', '--expand'],
+           ['--variant', '1002', '--gene', 'TP53'], ['--variant', '4242']]
+
+
+# the previous read: all columns with the python parser, types left to pandas
+def baseline_read(sourcefile):
+    return pd.read_csv(reader.data_file(sourcefile),
+                       header=sourcefile.get('header_row'), sep=helper.get_separator(sourcefile.get('delimiter')),
+                       skiprows=helper.skip_array(sourcefile.get('skip_rows')), engine='python',
+                       quoting=sourcefile.get('quoting'), on_bad_lines='warn')
+
+
+def csv_text(df):
+    return df.to_csv(index=False)
+
+
+def test_engine_choice(sourcefiles):
+    assert reader.engine(sourcefiles['variant-summary']) == 'pyarrow'
+    # quoting=3 and skipped rows after the header need the C parser
+    assert reader.engine(sourcefiles['submission-summary']) == 'c'
+    assert reader.engine(sourcefiles['gene-dosage']) == 'c'
+
+
+@pytest.mark.parametrize('name', SOURCE_NAMES)
+def test_typed_read_matches_python_parser(sourcefiles, name):
+    sourcefile = sourcefiles[name]
+    dic = source.dictionary(sourcefile)
+    df = reader.read(sourcefile, dic, use_cache=False)
+    assert csv_text(df) == csv_text(baseline_read(sourcefile))
+
+
+def test_schema_types(sourcefiles):
+    sourcefile = sourcefiles['submission-summary']
+    dtypes = reader.schema(sourcefile, source.dictionary(sourcefile))
+    assert dtypes['#VariationID'] == 'Int64'
+    assert dtypes['ClinicalSignificance'] == 'category'
+    assert dtypes['DateLastEvaluated'] is str
+    assert dtypes['SCV'] is str
+
+
+@pytest.mark.parametrize('cached', [False, True])
+@pytest.mark.parametrize('options', FILTERS)
+@pytest.mark.parametrize('name', SOURCE_NAMES)
+def test_filter_pushdown_matches_post_filter(sourcefiles, args, name, options, cached):
+    sourcefile = sourcefiles[name]
+    dic = source.dictionary(sourcefile)
+    run_args = args(*options) if cached else args('--no-cache', *options)
+    if cached:
+        # build the cache, so the filtered read comes from it
+        reader.read(sourcefile, dic)
+    df = pipeline.prepare(pipeline.read(sourcefile, dic, run_args), sourcefile, dic, run_args)
+    expected = pipeline.prepare(baseline_read(sourcefile), sourcefile, dic, run_args)
+    assert csv_text(df) == csv_text(expected)
+
+
+@pytest.mark.parametrize('options', [['--columns', 'VariationID,ClinicalSignificance,clin-sig-simple', '--map'],
+                                     ['--columns', 'GeneSymbol,Type,cat_Type', '--categories', '--expand'],
+                                     ['--columns', 'SCV,days_DateLastEvaluated', '--days', '--template'],
+                                     ['--columns', 'HAPLOINSUFFICIENCY-cgdose', '--variant', '1003']])
+@pytest.mark.parametrize('name', SOURCE_NAMES)
+def test_projection_matches_full_read(sourcefiles, args, monkeypatch, name, options):
+    sourcefile = sourcefiles[name]
+    dic = source.dictionary(sourcefile)
+    run_args = args('--no-cache', *options)
+    columns = pipeline.projection(sourcefile, dic, run_args)
+    assert len(columns) < len(reader.header(sourcefile))
+    df = pipeline.process(sourcefile, dic, run_args)
+
+    monkeypatch.setattr(pipeline, 'projection', lambda *arguments: None)
+    expected = pipeline.process(sourcefile, dic, run_args)
+    assert set(df.columns) < set(expected.columns)
+    assert csv_text(df.loc[:, [c for c in df.columns if c in run_args.columns]]) == \
+        csv_text(expected.loc[:, [c for c in expected.columns if c in run_args.columns]])